@@ -0,0 +1,71 @@
+"""Benchmark of exporting a result in each output format.
+
+Writes a dataset of random polygons with a few attributes with the GDAL drivers (GeoJSON, ESRI Shapefile, CSV),
+and in the GeoParquet, Arrow IPC and FlatGeobuf output formats.
+
+Usage:
+    python benchmarks/export_formats.py [--features N] [--vertices V] [--formats F [F ...]]
+"""
+import argparse
+import os
+import tempfile
+from shutil import rmtree
+from time import perf_counter
+import numpy as np
+import pygeos as pg
+from geometry_service.api.geovaex import GeoVaex
+from geometry_service.api.geometries import OUTPUT_FORMATS, export
+
+# The GDAL drivers compared, with the extension of their files.
+DRIVERS = {'GeoJSON': '.geojson', 'ESRI Shapefile': '.shp', 'CSV': '.csv'}
+
+
+def dataset(features, vertices, directory, seed=0):
+    """Creates a CSV file with random polygons as WKT, and converts it."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0, 100, (features, 2))
+    polygons = pg.buffer(pg.points(centers), rng.uniform(0.1, 1, features), quadsegs=max(vertices // 4, 1))
+    path = os.path.join(directory, 'polygons.csv')
+    with open(path, 'w') as f:
+        f.write('id,name,value,WKT\n')
+        for i, wkt in enumerate(pg.to_wkt(polygons, rounding_precision=6)):
+            f.write('{id},feature_{id},{value},"{wkt}"\n'.format(id=i, value=rng.random(), wkt=wkt))
+    return GeoVaex(path, directory, crs='EPSG:4326', read_options={'geom': 'WKT'}, cache=False, arrow_file=os.path.join(directory, 'polygons.arrow'))
+
+
+def size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+    if os.path.splitext(path)[1] == '.shp':
+        base = os.path.splitext(path)[0]
+        return sum(os.path.getsize(base + extension) for extension in ['.shp', '.shx', '.dbf', '.prj'] if os.path.exists(base + extension))
+    return os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--features', type=int, default=200000, help='Number of random polygons.')
+    parser.add_argument('--vertices', type=int, default=32, help='Approximate number of vertices per polygon.')
+    parser.add_argument('--formats', nargs='+', default=list(DRIVERS) + list(OUTPUT_FORMATS), help='Drivers and output formats to compare.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        gdf = dataset(args.features, args.vertices, directory).gdf
+        print('{features} polygons with {vertices} vertices'.format(features=len(gdf), vertices=args.vertices))
+        for name in args.formats:
+            if name in DRIVERS:
+                output_format, driver, extension = 'native', name, DRIVERS[name]
+            else:
+                output_format, driver, extension = name, None, OUTPUT_FORMATS[name]
+            path = os.path.join(directory, 'export_' + name.replace(' ', '_').lower() + extension)
+            start = perf_counter()
+            export(gdf, path, output_format=output_format, driver=driver)
+            elapsed = perf_counter() - start
+            print('{label:<28} {elapsed:8.3f} s {size:10.1f} MB'.format(label=name, elapsed=elapsed, size=size(path) / 1024 ** 2))
+    finally:
+        rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark of the within filter against isochrone-sized query polygons.
+
+Compares testing random points against the plain query polygon, the prepared polygon, and the prepared polygon
+subdivided into a quadtree.
+
+Usage:
+    python benchmarks/filter_within.py [--features N] [--vertices V] [--max-vertices M]
+"""
+import argparse
+from time import perf_counter
+import numpy as np
+import pygeos as pg
+from geometry_service.api.predicates import PreparedQuery
+
+
+def isochrone(vertices, seed=0):
+    """Creates a star-shaped polygon with a jagged boundary, similar to an isochrone."""
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radii = 0.5 + 0.4 * rng.random(vertices)
+    radii = np.convolve(np.concatenate([radii[-2:], radii, radii[:2]]), np.ones(5) / 5, mode='valid')
+    coords = np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])
+    return pg.polygons(np.vstack([coords, coords[:1]]))
+
+
+def timeit(label, func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{label:<28} {elapsed:8.3f} s'.format(label=label, elapsed=best))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--features', type=int, default=1000000, help='Number of random points.')
+    parser.add_argument('--vertices', type=int, default=50000, help='Number of vertices of the query polygon.')
+    parser.add_argument('--max-vertices', type=int, default=1000, help='Maximum vertices per quadtree cell.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    points = pg.points(rng.uniform(-1, 1, (args.features, 2)))
+    polygon = isochrone(args.vertices)
+    print('{features} points, query polygon with {vertices} vertices'.format(features=args.features, vertices=pg.get_num_coordinates(polygon)))
+
+    expected = timeit('plain', lambda: pg.within(points, pg.from_wkb(pg.to_wkb(polygon))), repeat=1)
+    prepared = PreparedQuery(pg.from_wkb(pg.to_wkb(polygon)), max_vertices=0)
+    result = timeit('prepared', lambda: prepared.within(points))
+    assert np.array_equal(result, expected)
+    start = perf_counter()
+    subdivided = PreparedQuery(pg.from_wkb(pg.to_wkb(polygon)), max_vertices=args.max_vertices)
+    print('{label:<28} {elapsed:8.3f} s ({cells} cells)'.format(label='quadtree build', elapsed=perf_counter() - start, cells=subdivided.num_cells))
+    result = timeit('prepared + quadtree', lambda: subdivided.within(points))
+    assert np.array_equal(result, expected)
+
+
+if __name__ == '__main__':
+    main()
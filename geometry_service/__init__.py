@@ -50,12 +50,16 @@ if os.getenv('WORKING_DIR') is None:
     working_dir = os.path.join(tempfile.gettempdir(), os.getenv('FLASK_APP'))
     os.environ['WORKING_DIR'] = working_dir
     logger.info('Set environment variable [WORKING_DIR="%s"]', working_dir)
+if os.getenv('DATASET_DIR') is None:
+    dataset_dir = os.path.join(os.environ['WORKING_DIR'], 'datasets')
+    os.environ['DATASET_DIR'] = dataset_dir
+    logger.info('Set environment variable [DATASET_DIR="%s"]', dataset_dir)
 if os.getenv('CORS') is None:
     os.environ['CORS'] = '*'
     logger.info('Set environment variable [CORS="*"]')
 
 # Create directories
-for path in [os.environ['WORKING_DIR'], os.environ['OUTPUT_DIR']]:
+for path in [os.environ['WORKING_DIR'], os.environ['OUTPUT_DIR'], os.environ['DATASET_DIR']]:
     try:
         os.makedirs(path)
     except OSError:
@@ -70,7 +74,7 @@ def create_app():
     from flask_cors import CORS
     from shutil import rmtree
     from geometry_service.database.model import Queue
-    from geometry_service.api import constructive, filter_, join, jobs, misc
+    from geometry_service.api import constructive, filter_, join, datasets, jobs, misc
 
     logger.debug('Initializing app.')
     app = Flask(__name__)
@@ -96,11 +100,13 @@ def create_app():
     constructive.executor.init_app(app)
     filter_.executor.init_app(app)
     join.executor.init_app(app)
+    datasets.executor.init_app(app)
     logger.debug('Registering blueprints.')
     # Add blueprints
     app.register_blueprint(constructive.bp)
     app.register_blueprint(filter_.bp)
     app.register_blueprint(join.bp)
+    app.register_blueprint(datasets.bp)
     app.register_blueprint(jobs.bp)
     app.register_blueprint(misc.bp)
 
@@ -1 +1 @@
-from .requests import constructive, filter_, join , jobs, misc
\ No newline at end of file
+from .requests import constructive, filter_, join, datasets, jobs, misc
\ No newline at end of file
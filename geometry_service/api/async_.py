@@ -1,40 +1,64 @@
 from .geovaex import GeoVaex
-from .valhalla import Valhalla
+from .crs import to_epsg, transform
+from .isochrones import isochrone, isochrones, read_origins, read_contours
 from shutil import rmtree
 import os
-import pyproj
+import json
 import numpy as np
 import pygeos as pg
-from geometry_service.database.actions import db_update_queue_status
+from geometry_service.database.actions import db_update_queue_status, db_update_dataset, db_delete_dataset
 from geometry_service.exceptions import ResultedEmptyDataFrame
-from .helpers import copy_to_output
+from geometry_service.loggers import logger
+from .helpers import copy_to_output, save_to_output
 
-def async_callback(future):
+def async_callback(future, working_path=None):
     """Generic callback for asynchronous operations.
 
-    Updates database with the results.
+    Updates database with the results, and removes the working path of the session.
 
     Arguments:
         future (obj): Future object.
+
+    Keyword Arguments:
+        working_path (str): The working path of the session (default: {None}, i.e. the folder of the resulted file)
     """
     ticket, file, success, error_msg = future.result()
     path = None
-    if success:
+    if success and isinstance(file, dict):
+        path = save_to_output(file, ticket)
+    elif success:
         path = copy_to_output(file, ticket)
-    try:
-        rmtree(os.path.dirname(file))
-    except:
-        pass
+    if working_path is None and isinstance(file, str):
+        working_path = os.path.dirname(file)
+    if working_path is not None:
+        rmtree(working_path, ignore_errors=True)
     db_update_queue_status(ticket, completed=True, success=success, error_msg=error_msg, result=path)
 
 
+def dataset_callback(future):
+    """Callback for the asynchronous dataset registration.
+
+    Updates database with the dataset details, or removes the dataset in case of failure.
+
+    Arguments:
+        future (obj): Future object.
+    """
+    ticket, dataset, success, error_msg = future.result()
+    key = dataset.pop('key')
+    if success:
+        db_update_dataset(key, ready=True, **dataset)
+    else:
+        db_delete_dataset(key)
+    db_update_queue_status(ticket, completed=True, success=success, error_msg=error_msg)
+
+
 def constructive_process(session, file, action, *args, **kwargs):
     """Wrapper function for the constuctive process.
 
     Arguments:
         session (dict): Dictionary with session information.
         file (str): The full path of the source file.
-        action (str): The constructive operation.
+        action (str): The constructive operation; 'pipeline' for a sequence of operations, given as *steps*, or 'simplify_levels' for several tolerances.
         *args: Additional arguments for the constructive operation.
         **kwargs: Additional keyword arguments for the constructive operation.
 
@@ -48,14 +72,34 @@ def constructive_process(session, file, action, *args, **kwargs):
     try:
         crs = kwargs.pop('crs', None)
         read_options = kwargs.pop('read_options', {})
-        geovaex = GeoVaex(file, session['working_path'], crs=crs, read_options=read_options)
-        export = geovaex.constructive(action, *args, **kwargs)
+        output_format = kwargs.pop('output_format', None) or 'native'
+        dataset = kwargs.pop('dataset', False)
+        geovaex = GeoVaex(file, session['working_path'], crs=crs, read_options=read_options, output_format=output_format, dataset=dataset)
+        if action in ['pipeline', 'simplify_levels']:
+            export = getattr(geovaex, action)(*args, **kwargs)
+        else:
+            export = geovaex.constructive(action, *args, **kwargs)
     except Exception as e:
         return (session['ticket'], None, False, str(e))
 
     return (session['ticket'], export, True, None)
 
 
+def _to_crs(geometries, crs):
+    """Transforms geometries from WGS 84 to the given CRS.
+
+    Arguments:
+        geometries (obj|ndarray): The pygeos geometries in WGS 84.
+        crs (obj): The target CRS.
+
+    Returns:
+        (obj|ndarray): The transformed geometries.
+    """
+    if to_epsg(crs) == 4326:
+        return geometries
+    return transform(geometries, 4326, crs)
+
+
 def filter_process(session, file, action, wkt, **kwargs):
     """Wrapper function for the filtering process.
 
@@ -63,7 +107,7 @@ def filter_process(session, file, action, wkt, **kwargs):
         session (dict): Dictionary with session information.
         file (str): The full path of the source file.
         action (str): The filtering operation.
-        wkt (str): Well-Known Text of the input geometry.
+        wkt (str): Well-Known Text of the input geometry; the query geometries for batch filtering.
         **kwargs: Additional keyword arguments for the filtering operation.
 
     Returns:
@@ -76,27 +120,32 @@ def filter_process(session, file, action, wkt, **kwargs):
     try:
         crs = kwargs.pop('crs', None)
         read_options = kwargs.pop('read_options', {})
-        geovaex = GeoVaex(file, session['working_path'], crs=crs, read_options=read_options)
+        output_format = kwargs.pop('output_format', None) or 'native'
+        dataset = kwargs.pop('dataset', False)
+        geovaex = GeoVaex(file, session['working_path'], crs=crs, read_options=read_options, output_format=output_format, dataset=dataset)
         if action == 'travel_distance' or action == 'travel_time':
-            valhalla = Valhalla()
-            distance = kwargs.pop('distance', None)
-            time = kwargs.pop('time', None)
+            kind = 'distance' if action == 'travel_distance' else 'time'
+            contour = kwargs.pop(kind, None)
+            kwargs.pop('distance', None)
+            kwargs.pop('time', None)
             costing = kwargs.pop('costing', None)
             if costing == '':
                 costing = None
-            lat, lon = wkt
-            polygon = valhalla.isochrone(lat, lon, distance=distance, costing=costing) if action == 'travel_distance' else valhalla.isochrone(lat, lon, time=time, costing=costing)
-            if geovaex.gdf.geometry.crs.to_epsg() != 4326:
-                from_ = pyproj.crs.CRS.from_epsg(4326)
-                to_ = geovaex.gdf.geometry.crs
-                transformer = pyproj.Transformer.from_crs(from_, to_, always_xy=True)
-                def transform(coords):
-                    x, y = transformer.transform(*coords.T)
-                    return np.array([x, y]).T
-                polygon = pg.apply(polygon, transform)
-            wkt = pg.to_wkt(polygon)
-            action = 'within'
-        export = geovaex.filter_(action, wkt, **kwargs)
+            origins = kwargs.pop('origins', None)
+            contours = kwargs.pop('contours', None)
+            if origins or contours:
+                origin_ids, coords = read_origins(origins) if origins else ([0], np.array([wkt], dtype=np.float64))
+                contours = read_contours(contours) if contours else [contour]
+                polygons = _to_crs(isochrones(coords, contours, kind=kind, costing=costing), geovaex.gdf.geometry.crs)
+                export = geovaex.filter_isochrones(polygons, origin_ids, contours, **kwargs)
+            else:
+                lat, lon = wkt
+                polygon = _to_crs(isochrone(lat, lon, costing=costing, **{kind: contour}), geovaex.gdf.geometry.crs)
+                export = geovaex.filter_('within', pg.to_wkt(polygon), **kwargs)
+        elif action == 'batch':
+            export = geovaex.filter_batch(wkt, **kwargs)
+        else:
+            export = geovaex.filter_(action, wkt, **kwargs)
     except ResultedEmptyDataFrame as e:
         return (session['ticket'], None, True, str(e))
     except Exception as e:
@@ -122,16 +171,76 @@ def join_process(session, left, right, predicate, **kwargs):
             - (bool): Whether operation succeeded.
             - (str): Error message in case of failure.
     """
+    geovaex = None
     try:
         crs = kwargs.pop('left_crs', None)
         read_options = kwargs.pop('left_read_options', {})
-        geovaex = GeoVaex(left, session['working_path'], crs=crs, read_options=read_options)
+        output_format = kwargs.pop('output_format', None) or 'native'
+        left_dataset = kwargs.pop('left_dataset', False)
+        geovaex = GeoVaex(left, session['working_path'], crs=crs, read_options=read_options, output_format=output_format, dataset=left_dataset)
         right_crs = kwargs.pop('right_crs', None)
         right_read_options = kwargs.pop('right_read_options', {})
-        export = geovaex.join(right, predicate, crs=right_crs, read_options=right_read_options, **kwargs)
+        right_dataset = kwargs.pop('right_dataset', False)
+        export = geovaex.join(right, predicate, crs=right_crs, read_options=right_read_options, dataset=right_dataset, **kwargs)
     except ResultedEmptyDataFrame as e:
         return (session['ticket'], None, True, str(e))
     except Exception as e:
         return (session['ticket'], None, False, str(e))
+    finally:
+        if geovaex is not None and geovaex.plan is not None:
+            _record_plan(session['ticket'], geovaex.plan)
 
     return (session['ticket'], export, True, None)
+
+
+def _record_plan(ticket, plan):
+    """Records the plan of a spatial join in the job status; a failure to record it does not fail the join."""
+    try:
+        db_update_queue_status(ticket, plan=json.dumps(plan))
+    except Exception as e:
+        logger.warning('Could not record join plan [ticket="%s", error="%s"]', ticket, e)
+
+
+def dataset_process(session, file, key, **kwargs):
+    """Wrapper function for the dataset registration.
+
+    Converts the spatial file to the dataset directory and computes its details.
+
+    Arguments:
+        session (dict): Dictionary with session information.
+        file (str): The full path of the source file.
+        key (str): The dataset key.
+        **kwargs: Additional keyword arguments for reading the file.
+
+    Returns:
+        (tuple):
+            - (str): Request ticket.
+            - (dict): The dataset key, and its details in case of success.
+            - (bool): Whether operation succeeded.
+            - (str): Error message in case of failure.
+    """
+    path = os.path.join(os.environ['DATASET_DIR'], key)
+    try:
+        crs = kwargs.pop('crs', None)
+        read_options = kwargs.pop('read_options', {})
+        os.makedirs(path, exist_ok=True)
+        geovaex = GeoVaex(file, session['working_path'], crs=crs, read_options=read_options, cache=False, arrow_file=os.path.join(path, 'data.arrow'), sort=True)
+        minx, miny, maxx, maxy = geovaex.total_bounds
+        dataset = {
+            'key': key,
+            'path': geovaex.arrow_file,
+            'driver': geovaex.driver,
+            'crs': geovaex.gdf.geometry.crs.to_string(),
+            'rows': len(geovaex.gdf),
+            'minx': minx,
+            'miny': miny,
+            'maxx': maxx,
+            'maxy': maxy
+        }
+    except Exception as e:
+        rmtree(path, ignore_errors=True)
+        return (session['ticket'], {'key': key}, False, str(e))
+    finally:
+        rmtree(session['working_path'], ignore_errors=True)
+
+    return (session['ticket'], dataset, True, None)
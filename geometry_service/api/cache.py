@@ -0,0 +1,309 @@
+"""Persistent cache of spatial files converted to Arrow.
+
+Converting a spatial file to Arrow is the most expensive step of every request, so the converted files are kept
+in a cache shared among requests (and workers). Each entry is addressed by a key derived from the source file,
+the requested CRS and the read options; the cache is bounded in size and evicts the least recently used entries.
+"""
+import os
+import json
+import hashlib
+from glob import glob
+from uuid import uuid4
+from geometry_service.loggers import logger
+
+# Bump when the layout of the cached Arrow files changes, so that stale entries are not reused.
+FORMAT_VERSION = 5
+
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+
+# Read options equivalent to not specifying the option at all.
+DEFAULT_READ_OPTIONS = {'delimiter': ',', 'encoding': '', 'geom': '', 'lat': '', 'lon': ''}
+
+
+class ConversionCache:
+    """Size-bounded LRU cache of converted Arrow files.
+
+    Each entry consists of the Arrow file ``<key>.arrow``, any sidecar files named ``<key>.*`` and a metadata
+    file ``<key>.json``. The modification time of the metadata file is updated on each hit and is used to
+    determine the least recently used entries.
+    """
+
+    def __init__(self, path=None, max_size=None):
+        """Initializes the cache.
+
+        Keyword Arguments:
+            path (str): The cache directory (default: {None}, environment variable CACHE_DIR, or *cache* inside the working dir).
+            max_size (int): The maximum total size of the cache in bytes; zero disables the cache (default: {None}, environment variable CACHE_MAX_SIZE).
+        """
+        if path is None:
+            path = os.getenv('CACHE_DIR') or os.path.join(os.environ['WORKING_DIR'], 'cache')
+        if max_size is None:
+            max_size = int(os.getenv('CACHE_MAX_SIZE', DEFAULT_MAX_SIZE))
+        self.path = path
+        self.max_size = max_size
+        if self.enabled:
+            os.makedirs(self.path, exist_ok=True)
+
+
+    @property
+    def enabled(self):
+        """Whether the cache is enabled."""
+        return self.max_size > 0
+
+
+    def key(self, file, crs=None, read_options={}):
+        """Computes the cache key of a spatial file.
+
+        Files in the input directory are identified by their real path, modification time and size, while any
+        other file (e.g. an uploaded one) is identified by the hash of its content. A directory (e.g. of a
+        shapefile) is identified by the files it contains.
+
+        Arguments:
+            file (str): Full path of the spatial file or directory.
+
+        Keyword Arguments:
+            crs (str): Native CRS of the spatial file (default: {None})
+            read_options (dict): Read options for CSV files (default: {{}})
+
+        Returns:
+            (str): The cache key.
+        """
+        real_path = os.path.realpath(file)
+        input_dir = os.path.realpath(os.environ['INPUT_DIR'])
+        if os.path.commonpath([real_path, input_dir]) == input_dir:
+            fingerprint = ['stat', real_path, []]
+            for member in self._files(real_path):
+                stat = os.stat(member)
+                fingerprint[2].append([os.path.relpath(member, real_path), stat.st_mtime_ns, stat.st_size])
+        else:
+            fingerprint = ['sha256', self._hash_file(real_path)]
+        read_options = {key: value for key, value in read_options.items() if value is not None and DEFAULT_READ_OPTIONS.get(key) != value}
+        payload = json.dumps([FORMAT_VERSION, fingerprint, crs, read_options], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+
+    def lookup(self, key):
+        """Looks up an entry in the cache.
+
+        Arguments:
+            key (str): The cache key.
+
+        Returns:
+            (tuple|None): The path of the cached Arrow file and its metadata, or None in case of a miss.
+        """
+        if not self.enabled:
+            return None
+        arrow_file = self.arrow_file(key)
+        meta_file = self._meta_file(key)
+        try:
+            with open(meta_file) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(arrow_file):
+            return None
+        try:
+            os.utime(meta_file)
+        except OSError:
+            pass
+        logger.debug('Conversion cache hit [key="%s"]', key)
+        return arrow_file, meta
+
+
+    def store(self, key, convert, meta={}):
+        """Stores a new entry in the cache.
+
+        Arguments:
+            key (str): The cache key.
+            convert (callable): Function that converts the source file to the Arrow file given as its single argument, and returns the metadata to store.
+
+        Keyword Arguments:
+            meta (dict): Additional metadata to store with the entry (default: {{}})
+
+        Returns:
+            (tuple): The path of the cached Arrow file and its metadata.
+        """
+        arrow_file = self.arrow_file(key)
+        temp_file = os.path.join(self.path, '{key}.{uuid}.tmp.arrow'.format(key=key, uuid=uuid4()))
+        try:
+            meta = {**meta, **(convert(temp_file) or {})}
+            # Sidecar files are named after the Arrow file, e.g. the spatial index.
+            for file in glob(temp_file + '?*'):
+                os.replace(file, arrow_file + file[len(temp_file):])
+            os.replace(temp_file, arrow_file)
+        finally:
+            for file in glob(temp_file + '*'):
+                os.remove(file)
+        temp_meta = self._meta_file(key) + '.' + str(uuid4())
+        with open(temp_meta, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_meta, self._meta_file(key))
+        logger.info('Stored converted file in cache [key="%s", size=%d]', key, self._entry_size(key))
+        self.evict(keep=key)
+        return arrow_file, meta
+
+
+    def evict(self, keep=None):
+        """Evicts the least recently used entries, until the cache size is below the limit.
+
+        Keyword Arguments:
+            keep (str): Key of an entry that should never be evicted (default: {None})
+        """
+        entries = []
+        for meta_file in glob(os.path.join(self.path, '*.json')):
+            key = os.path.splitext(os.path.basename(meta_file))[0]
+            try:
+                entries.append((os.path.getmtime(meta_file), key, self._entry_size(key)))
+            except OSError:
+                continue
+        total = sum(entry[2] for entry in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            self.remove(key)
+            total -= size
+            logger.info('Evicted entry from conversion cache [key="%s", size=%d]', key, size)
+
+
+    def remove(self, key):
+        """Removes an entry from the cache.
+
+        Arguments:
+            key (str): The cache key.
+        """
+        for file in self._entry_files(key):
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+
+    def arrow_file(self, key):
+        """The path of the Arrow file for a cache key."""
+        return os.path.join(self.path, key + '.arrow')
+
+
+    def _meta_file(self, key):
+        return os.path.join(self.path, key + '.json')
+
+
+    def _entry_files(self, key):
+        # Only the files of a committed entry; the temporary files of a conversion in progress are left alone.
+        return [self._meta_file(key)] + glob(self.arrow_file(key) + '*')
+
+
+    def _entry_size(self, key):
+        size = 0
+        for file in set(self._entry_files(key)):
+            try:
+                size += os.path.getsize(file)
+            except OSError:
+                pass
+        return size
+
+
+    @staticmethod
+    def _files(path):
+        """The file itself, or the files inside a directory, in a stable order."""
+        if not os.path.isdir(path):
+            return [path]
+        return sorted(os.path.join(root, filename) for root, _, filenames in os.walk(path) for filename in filenames)
+
+
+    @classmethod
+    def _hash_file(cls, path, block_size=1024*1024):
+        sha = hashlib.sha256()
+        for file in cls._files(path):
+            if file != path:
+                sha.update('{name}\0{size}\0'.format(name=os.path.relpath(file, path), size=os.path.getsize(file)).encode())
+            with open(file, 'rb') as f:
+                for block in iter(lambda: f.read(block_size), b''):
+                    sha.update(block)
+        return sha.hexdigest()
+
+
+# File extensions of the spatial files, and of the archives that may contain them.
+SPATIAL_EXTENSIONS = ('.shp', '.geojson', '.json', '.csv', '.gpkg', '.kml', '.gml')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+
+def is_spatial_file(file):
+    """Whether a file could be converted, judging by its extension.
+
+    Since the extensions of JSON files and archives are not specific to spatial data, a .json file is accepted
+    only when a GeoJSON feature is mentioned near its start, and an archive only when it contains a spatial file.
+
+    Arguments:
+        file (str): Full path of the file.
+
+    Returns:
+        (bool): Whether the file is a spatial file.
+    """
+    import zipfile
+    import tarfile
+    name = file.lower()
+    try:
+        if name.endswith('.json') and not name.endswith('.geojson'):
+            with open(file, 'rb') as f:
+                return b'"Feature' in f.read(4096)
+        if name.endswith(ARCHIVE_EXTENSIONS):
+            if zipfile.is_zipfile(file):
+                with zipfile.ZipFile(file) as handle:
+                    members = handle.namelist()
+            elif tarfile.is_tarfile(file):
+                with tarfile.open(file) as handle:
+                    members = handle.getnames()
+            else:
+                return False
+            return any(member.lower().endswith(SPATIAL_EXTENSIONS) for member in members)
+    except (OSError, zipfile.BadZipFile, tarfile.TarError):
+        return False
+    return name.endswith(SPATIAL_EXTENSIONS)
+
+
+def find_spatial_files(path):
+    """Finds the spatial files in a directory tree (see :func:`is_spatial_file`).
+
+    Arguments:
+        path (str): The root of the directory tree.
+
+    Returns:
+        (list): The full paths of the spatial files found.
+    """
+    files = []
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            if is_spatial_file(os.path.join(root, filename)):
+                files.append(os.path.join(root, filename))
+    return sorted(files)
+
+
+def warm(file, crs=None, read_options={}):
+    """Converts a spatial file and stores it in the conversion cache, unless already cached.
+
+    Arguments:
+        file (str): Full path of the spatial file.
+
+    Keyword Arguments:
+        crs (str): Native CRS of the spatial file (default: {None})
+        read_options (dict): Read options for CSV files (default: {{}})
+
+    Returns:
+        (tuple):
+            - (str): The full path of the spatial file.
+            - (bool): Whether the conversion succeeded.
+            - (str): Error message in case of failure.
+    """
+    from shutil import rmtree
+    from .geovaex import GeoVaex
+    working_dir = os.path.join(os.environ['WORKING_DIR'], 'warm', str(uuid4()))
+    os.makedirs(working_dir, exist_ok=True)
+    try:
+        GeoVaex(file, working_dir, crs=crs, read_options=read_options)
+    except Exception as e:
+        return (file, False, str(e))
+    finally:
+        rmtree(working_dir, ignore_errors=True)
+    return (file, True, None)
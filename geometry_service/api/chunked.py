@@ -0,0 +1,304 @@
+"""Chunked, parallel execution of constructive operations.
+
+Constructive operations compute each geometry from the original one alone, so a dataset is split in chunks of
+consecutive rows; each chunk is read from the converted file, processed and written to an Arrow part, and the parts
+are opened (not loaded) as a single GeoDataFrame. Chunks are processed by a pool of threads when the pygeos functions
+behind the operations release the GIL, or by the worker processes otherwise; either way, a job keeps at most as many
+chunks in flight as its parallelism budget. The operations of a pipeline are applied to each chunk in turn, so that
+no intermediate result is written or exported.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pygeos as pg
+from .parallel import parallelism, min_rows, get_pool
+
+# pygeos releases the GIL while computing these (since version 0.10), so that they scale over threads.
+GIL_RELEASING = ['centroid', 'convex_hull', 'simplify', 'buffer']
+
+# The steps of a pipeline, with their parameters: (name, types, required, default).
+STEPS = {
+    'simplify': [('tolerance', (int, float), True, None), ('preserve_topology', bool, False, False)],
+    'centroid': [],
+    'convex_hull': [],
+    'buffer': [('distance', (int, float), True, None), ('resolution', int, False, 16)],
+    'reproject': [('crs', str, True, None)],
+}
+
+# Maximum number of levels of a multi-resolution simplification.
+MAX_LEVELS = 16
+
+# Number of chunks per worker, so that uneven chunks are balanced among the workers.
+CHUNKS_PER_WORKER = 4
+
+EXECUTORS = ['thread', 'process']
+
+
+def executor_type(actions):
+    """The type of pool that processes the chunks of some operations.
+
+    Arguments:
+        actions (list): The constructive operations applied to each chunk.
+
+    Returns:
+        (str): The value of environment variable CONSTRUCTIVE_EXECUTOR, if one of 'thread', 'process'; otherwise 'thread' if all the operations release the GIL, else 'process'.
+    """
+    value = (os.getenv('CONSTRUCTIVE_EXECUTOR') or '').lower()
+    if value in EXECUTORS:
+        return value
+    version = tuple(int(part) for part in pg.__version__.split('.')[:2] if part.isdigit())
+    return 'thread' if version >= (0, 10) and all(action in GIL_RELEASING for action in actions) else 'process'
+
+
+def read_steps(text):
+    """Reads the steps of a constructive pipeline, given as JSON list of objects with the *action* and its parameters.
+
+    Arguments:
+        text (str|list): The steps, e.g. '[{"action": "simplify", "tolerance": 10}, {"action": "centroid"}, {"action": "reproject", "crs": "EPSG:4326"}]'.
+
+    Raises:
+        ValueError: The steps could not be read.
+
+    Returns:
+        (list): The (action, args, kwargs) of each step.
+    """
+    import json
+    from pyproj.exceptions import CRSError
+    from .crs import get_crs
+    try:
+        items = json.loads(text) if isinstance(text, str) else text
+    except ValueError:
+        raise ValueError('Steps should be a JSON list.')
+    if not isinstance(items, list) or len(items) == 0:
+        raise ValueError('Steps should be a non-empty JSON list.')
+    steps = []
+    for position, item in enumerate(items, 1):
+        if not isinstance(item, dict) or item.get('action') not in STEPS:
+            raise ValueError('Step {position}: action should be one of {actions}.'.format(position=position, actions=', '.join(STEPS)))
+        action = item['action']
+        parameters = STEPS[action]
+        unknown = set(item) - {'action'} - {name for name, _, _, _ in parameters}
+        if len(unknown) > 0:
+            raise ValueError('Step {position}: unknown parameters {names}.'.format(position=position, names=', '.join(sorted(unknown))))
+        kwargs = {}
+        for name, types, required, default in parameters:
+            value = item.get(name, default)
+            if value is None and required:
+                raise ValueError('Step {position}: {name} is required.'.format(position=position, name=name))
+            # Booleans are ints too, but not valid numbers.
+            if not isinstance(value, types) or (types != bool and isinstance(value, bool)):
+                raise ValueError('Step {position}: invalid {name}.'.format(position=position, name=name))
+            kwargs[name] = value
+        if action == 'reproject':
+            try:
+                get_crs(kwargs['crs'])
+            except CRSError:
+                raise ValueError('Step {position}: invalid crs.'.format(position=position))
+        elif action == 'buffer' and kwargs['resolution'] < 1:
+            raise ValueError('Step {position}: invalid resolution.'.format(position=position))
+        steps.append((action, (), kwargs))
+    return steps
+
+
+def apply_steps(gdf, steps):
+    """Applies constructive operations to a GeoDataFrame, in turn.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        steps (list): The (action, args, kwargs) of each operation; 'reproject' transforms the geometries to another CRS.
+
+    Returns:
+        (obj): The resulted GeoDataFrame.
+    """
+    for action, args, kwargs in steps:
+        if action == 'reproject':
+            gdf = gdf.to_crs(*args, **kwargs)
+        else:
+            gdf = getattr(gdf.constructive, action)(*args, **kwargs)
+    return gdf
+
+
+def process_chunk(task):
+    """Applies constructive operations to a chunk of a converted file, and writes the result to an Arrow part.
+
+    Arguments:
+        task (tuple): The Arrow file, the first and last (exclusive) row of the chunk, the steps (see :func:`apply_steps`) and the path of the part.
+
+    Returns:
+        (str): The path of the part.
+    """
+    import geovaex as gvx
+    from .geometries import export_arrow
+    arrow_file, start, stop, steps, part = task
+    export_arrow(apply_steps(gvx.open(arrow_file)[start:stop], steps), part)
+    return part
+
+
+def bounded_map(executor, function, tasks, limit):
+    """Maps a function over tasks with an executor, keeping at most a number of tasks in flight.
+
+    Arguments:
+        executor (obj): The executor, possibly shared with other jobs.
+        function (callable): The function.
+        tasks (list): The tasks.
+        limit (int): The maximum number of tasks in flight.
+
+    Returns:
+        (list): The results, in the order of the tasks.
+    """
+    results = [None] * len(tasks)
+    pending = {}
+    for position, task in enumerate(tasks):
+        if len(pending) >= limit:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+        pending[executor.submit(function, task)] = position
+    for future in list(pending):
+        results[pending.pop(future)] = future.result()
+    return results
+
+
+def _chunks(num_rows, workers, chunk_size=None):
+    """The (first, last) rows of the chunks of a dataset."""
+    from .geometries import DEFAULT_CHUNK_SIZE
+    chunk_size = chunk_size or min(max(int(np.ceil(num_rows / (workers * CHUNKS_PER_WORKER))), 1), DEFAULT_CHUNK_SIZE)
+    return [(start, min(start + chunk_size, num_rows)) for start in range(0, num_rows, chunk_size)]
+
+
+def _run(function, tasks, workers, executor):
+    """Runs the tasks of a job with a pool of threads, or the worker processes, within its parallelism budget."""
+    if executor == 'thread':
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(function, tasks))
+    return bounded_map(get_pool(), function, tasks, workers)
+
+
+def apply(gdf, arrow_file, steps, directory, workers=None, chunk_size=None):
+    """Applies constructive operations to a dataset, in parallel chunks.
+
+    Small datasets, or jobs with a single worker, are processed at once in the calling thread.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        arrow_file (str): The converted (Arrow) file of the GeoDataFrame, from which the chunks are read.
+        steps (list): The (action, args, kwargs) of each operation.
+        directory (str): The directory for the parts of the result; it should outlive the result.
+
+    Keyword Arguments:
+        workers (int): The parallelism budget of the job (default: {None}, i.e. the configured parallelism)
+        chunk_size (int): The number of rows of each chunk (default: {None}, i.e. sized by the number of workers)
+
+    Returns:
+        (obj): The resulted GeoDataFrame.
+    """
+    from .geometries import concat
+    workers = workers if workers is not None else parallelism()
+    if workers == 1 or len(gdf) < min_rows():
+        return apply_steps(gdf, steps)
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(arrow_file, start, stop, steps, os.path.join(directory, 'part_{index}.arrow'.format(index=index)))
+        for index, (start, stop) in enumerate(_chunks(len(gdf), workers, chunk_size=chunk_size))]
+    return concat(_run(process_chunk, tasks, workers, executor_type([action for action, _, _ in steps])))
+
+
+def read_tolerances(text):
+    """Reads the tolerances of a simplification, given as a number, a comma separated list or a JSON list of numbers.
+
+    Arguments:
+        text (str): The tolerances, e.g. '1.5', '1,5,10' or '[1, 5, 10]'.
+
+    Raises:
+        ValueError: The tolerances could not be read.
+
+    Returns:
+        (list): The distinct tolerances, in increasing order.
+    """
+    import json
+    text = (text or '').strip()
+    try:
+        values = json.loads(text) if text.startswith('[') else text.split(',')
+        if not isinstance(values, list) or any(isinstance(value, bool) for value in values):
+            raise ValueError()
+        values = [float(value) for value in values]
+    except (ValueError, TypeError):
+        raise ValueError('Tolerance should be a number, or a list of numbers.')
+    if len(values) == 0 or len(values) > MAX_LEVELS or not all(np.isfinite(value) and value > 0 for value in values):
+        raise ValueError('Tolerance should be up to {maximum} positive numbers.'.format(maximum=MAX_LEVELS))
+    return sorted(set(values))
+
+
+def simplify_levels(gdf, tolerances, preserve_topology=False, level_column=False):
+    """Simplifies a GeoDataFrame at increasing tolerances.
+
+    Each level is simplified from the original geometries at its full tolerance, so that it is identical to a single
+    simplification at that tolerance; simplifying a level from the previous one would not be, since Douglas-Peucker
+    barely changes geometries already simplified at a close tolerance. The levels share a single read of the data.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        tolerances (list): The tolerances, in increasing order.
+
+    Keyword Arguments:
+        preserve_topology (bool): Whether to avoid creating invalid geometries (default: {False})
+        level_column (bool): Whether to add a *level* column, with the tolerance of each level (default: {False})
+
+    Returns:
+        (list): The GeoDataFrame of each level.
+    """
+    levels = []
+    for tolerance in tolerances:
+        level = gdf.constructive.simplify(tolerance, preserve_topology=preserve_topology)
+        if level_column:
+            level.add_column('level', np.full(len(level), tolerance, dtype=np.float64))
+        levels.append(level)
+    return levels
+
+
+def simplify_chunk(task):
+    """Simplifies a chunk of a converted file at increasing tolerances, and writes each level to an Arrow part.
+
+    Arguments:
+        task (tuple): The Arrow file, the first and last (exclusive) row of the chunk, the tolerances, whether to preserve the topology and to add a *level* column, and the path of the parts, to be formatted with the level.
+
+    Returns:
+        (list): The path of the part of each level.
+    """
+    import geovaex as gvx
+    from .geometries import export_arrow
+    arrow_file, start, stop, tolerances, preserve_topology, level_column, parts = task
+    levels = simplify_levels(gvx.open(arrow_file)[start:stop], tolerances, preserve_topology=preserve_topology, level_column=level_column)
+    paths = []
+    for level, gdf in enumerate(levels):
+        paths.append(parts.format(level=level))
+        export_arrow(gdf, paths[-1])
+    return paths
+
+
+def apply_levels(gdf, arrow_file, tolerances, directory, preserve_topology=False, level_column=False, workers=None, chunk_size=None):
+    """Simplifies a dataset at increasing tolerances in a single pass, in parallel chunks (see :func:`simplify_levels`).
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        arrow_file (str): The converted (Arrow) file of the GeoDataFrame, from which the chunks are read.
+        tolerances (list): The tolerances, in increasing order.
+        directory (str): The directory for the parts of the result; it should outlive the result.
+
+    Keyword Arguments:
+        preserve_topology (bool): Whether to avoid creating invalid geometries (default: {False})
+        level_column (bool): Whether to add a *level* column, with the tolerance of each level (default: {False})
+        workers (int): The parallelism budget of the job (default: {None}, i.e. the configured parallelism)
+        chunk_size (int): The number of rows of each chunk (default: {None}, i.e. sized by the number of workers)
+
+    Returns:
+        (list): The GeoDataFrame of each level.
+    """
+    from .geometries import concat
+    workers = workers if workers is not None else parallelism()
+    if workers == 1 or len(gdf) < min_rows():
+        return simplify_levels(gdf, tolerances, preserve_topology=preserve_topology, level_column=level_column)
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(arrow_file, start, stop, tolerances, preserve_topology, level_column, os.path.join(directory, 'level_{{level}}_{index}.arrow'.format(index=index)))
+        for index, (start, stop) in enumerate(_chunks(len(gdf), workers, chunk_size=chunk_size))]
+    parts = _run(simplify_chunk, tasks, workers, executor_type(['simplify']))
+    return [concat([paths[level] for paths in parts]) for level in range(len(tolerances))]
@@ -0,0 +1,113 @@
+"""Process-wide caches of parsed CRS objects and transformers.
+
+Parsing a CRS or creating a transformer queries the PROJ database, which is expensive compared to the operations
+they are used for; the results are therefore cached and shared among requests.
+"""
+from functools import lru_cache
+import numpy as np
+import pygeos as pg
+import pyproj
+
+CACHE_SIZE = 128
+
+
+def _key(crs):
+    """A hashable key for a CRS given as user input (e.g. 'EPSG:4326', 4326) or as CRS object.
+
+    EPSG codes and CRS objects that exactly match an authority code share the key of the authority string, e.g.
+    'EPSG:4326', so that they share the cached objects as well.
+    """
+    if isinstance(crs, int):
+        return 'EPSG:{code}'.format(code=crs)
+    if isinstance(crs, str):
+        return crs
+    return _wkt_key(crs.to_wkt())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _wkt_key(wkt):
+    authority = pyproj.crs.CRS.from_wkt(wkt).to_authority(min_confidence=100)
+    return ':'.join(authority) if authority is not None else wkt
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse(key):
+    return pyproj.crs.CRS.from_user_input(key)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _epsg(key):
+    return _parse(key).to_epsg()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _transformer(source, target, always_xy):
+    return pyproj.Transformer.from_crs(_parse(source), _parse(target), always_xy=always_xy)
+
+
+def get_crs(crs):
+    """Parses a CRS.
+
+    Arguments:
+        crs (str|int|obj): The CRS, in any form accepted by pyproj.
+
+    Raises:
+        pyproj.exceptions.CRSError: The CRS is not valid.
+
+    Returns:
+        (obj): The pyproj CRS.
+    """
+    if isinstance(crs, pyproj.crs.CRS):
+        return crs
+    return _parse(_key(crs))
+
+
+def to_epsg(crs):
+    """The EPSG code of a CRS, or None if it does not correspond to one.
+
+    Arguments:
+        crs (str|int|obj): The CRS, in any form accepted by pyproj.
+
+    Returns:
+        (int|None): The EPSG code.
+    """
+    return _epsg(_key(crs))
+
+
+def get_transformer(source, target, always_xy=True):
+    """Creates a transformer between two CRSs.
+
+    Arguments:
+        source (str|int|obj): The source CRS.
+        target (str|int|obj): The target CRS.
+
+    Keyword Arguments:
+        always_xy (bool): Whether coordinates are always in (x, y), i.e. (lon, lat), order (default: {True})
+
+    Returns:
+        (obj): The pyproj Transformer.
+    """
+    return _transformer(_key(source), _key(target), always_xy)
+
+
+def transform(geometries, source, target):
+    """Transforms geometries between two CRSs, with a single vectorized call over all their coordinates.
+
+    Arguments:
+        geometries (obj|ndarray): The pygeos geometries.
+        source (str|int|obj): The source CRS.
+        target (str|int|obj): The target CRS.
+
+    Returns:
+        (obj|ndarray): The transformed geometries.
+    """
+    if _key(source) == _key(target):
+        return geometries
+    transformer = get_transformer(source, target)
+    scalar = isinstance(geometries, pg.Geometry)
+    # The array is copied, since the coordinates are replaced in place.
+    array = np.array([geometries] if scalar else geometries, dtype=object)
+    coords = pg.get_coordinates(array)
+    x, y = transformer.transform(coords[:, 0], coords[:, 1])
+    array = pg.set_coordinates(array, np.column_stack([x, y]))
+    return array[0] if scalar else array
@@ -63,12 +63,39 @@ def add_components(spec):
                 "description": "The encoding of the file. If not given, the encoding is automatically detected.",
                 "example": "UTF-8"
             },
+            "output_format": {
+                "type": "string",
+                "description": "The format of the resulted file; *native* is the format of the given file. *geoparquet* and *arrow* (Arrow IPC) files are written directly from memory, which is much faster than the other formats; *flatgeobuf* files include a spatial index.",
+                "enum": ["native", "geoparquet", "arrow", "flatgeobuf"],
+                "default": "native"
+            },
+        },
+    }
+
+    output = {
+        "output": {
+            "type": "string",
+            "description": "*file* exports the result to a spatial file; *count* returns only the number of the resulted features and their bounding box, without writing any file; *summary* additionally returns the first *limit* features as GeoJSON.",
+            "enum": ["file", "count", "summary"],
+            "default": "file"
         },
+        "limit": {
+            "type": "integer",
+            "description": "The number of features returned when *output* is *summary*.",
+            "default": 10,
+            "example": 10
+        }
+    }
+
+    dataset = {
+        "type": "string",
+        "description": "The key of a registered dataset, given in place of *resource*.",
+        "example": "3ba6a8b5ecea27db3c5f4e0159c63283"
     }
 
     resource = {
         "type": "string",
-        "description": "A resolvable path to the spatial file, relative to the **input directory**. The file could be in compressed form: zipped or tar(.gz) archive.",
+        "description": "A resolvable path to the spatial file, relative to the **input directory**. The file could be in compressed form: zipped or tar(.gz) archive. Required, unless *dataset* is given.",
         "example": "/datasets/shapefile.tar.gz"
     }
 
@@ -82,9 +109,9 @@ def add_components(spec):
         **base_form,
         "properties": {
             **base_form["properties"],
-            "resource": resource
-        },
-        "required": ["resource"]
+            "resource": resource,
+            "dataset": dataset
+        }
     }
     spec.components.schema('constructiveForm', constructive_form)
 
@@ -100,15 +127,20 @@ def add_components(spec):
 
     simplify_extra = {
         "tolerance": {
-            "type": "number",
-            "format": "float",
-            "description": "The maximum allowed geometry displacement. The higher this value, the smaller the number of vertices in the resulting geometry.",
+            "type": "string",
+            "description": "The maximum allowed geometry displacement. The higher this value, the smaller the number of vertices in the resulting geometry. A comma separated (or JSON) list of up to 16 tolerances simplifies the geometries at each one, in a single pass.",
             "example": "1.0"
         },
         "preserve_topology": {
             "type": "boolean",
             "description": "If set to *true*, the operation will avoid creating invalid geometries.",
             "default": "false"
+        },
+        "pyramid": {
+            "type": "string",
+            "description": "For several tolerances, *archive* exports each level to its own file, named after its index (starting from 0, in increasing order of tolerance) and its tolerance, while *column* exports all the levels to a single file, with the tolerance of each feature in column *level*.",
+            "enum": ["archive", "column"],
+            "default": "archive"
         }
     }
 
@@ -117,9 +149,10 @@ def add_components(spec):
         "properties": {
             **base_form["properties"],
             **simplify_extra,
-            "resource": resource
+            "resource": resource,
+            "dataset": dataset
         },
-        "required": ["tolerance", "resource"]
+        "required": ["tolerance"]
     }
     spec.components.schema('simplifyConstructiveForm', simplify_form)
 
@@ -134,6 +167,37 @@ def add_components(spec):
     }
     spec.components.schema('simplifyConstructiveFormMultipart', simplify_form_multi)
 
+    pipeline_extra = {
+        "steps": {
+            "type": "string",
+            "description": "JSON list of the steps, applied in turn; each one is an object with the *action* and its parameters: *simplify* (*tolerance*, *preserve_topology*), *centroid*, *convex_hull*, *buffer* (*distance*, *resolution*: the number of segments per quarter circle, default 16), *reproject* (*crs*).",
+            "example": '[{"action": "simplify", "tolerance": 10}, {"action": "centroid"}, {"action": "reproject", "crs": "EPSG:4326"}]'
+        }
+    }
+
+    pipeline_form = {
+        **base_form,
+        "properties": {
+            **base_form["properties"],
+            **pipeline_extra,
+            "resource": resource,
+            "dataset": dataset
+        },
+        "required": ["steps"]
+    }
+    spec.components.schema('pipelineConstructiveForm', pipeline_form)
+
+    pipeline_form_multi = {
+        **base_form,
+        "properties": {
+            **base_form["properties"],
+            **pipeline_extra,
+            "resource": resource_multi
+        },
+        "required": ["steps", "resource"]
+    }
+    spec.components.schema('pipelineConstructiveFormMultipart', pipeline_form_multi)
+
     wkt = {
         "type": "string",
         "description": "The Well-Known-Text representation of the geometry to filter with. It is meant to be in the same srid as the spatial file.",
@@ -144,19 +208,26 @@ def add_components(spec):
         **base_form,
         "properties": {
             **base_form["properties"],
+            **output,
             "resource": resource,
+            "dataset": dataset,
             "point_lat": {
                 "type": "number",
                 "format": "float",
-                "description": "Latitude of the source point in WGS 84 (EPSG:4326).",
+                "description": "Latitude of the source point in WGS 84 (EPSG:4326). Required, unless *origins* is given.",
                 "example": 37.968312
             },
             "point_lon": {
                 "type": "number",
                 "format": "float",
-                "description": "Lotitude of the source point in WGS 84 (EPSG:4326).",
+                "description": "Lotitude of the source point in WGS 84 (EPSG:4326). Required, unless *origins* is given.",
                 "example": 23.710438
             },
+            "origins": {
+                "type": "string",
+                "description": "A JSON array of source points in WGS 84 (EPSG:4326), given in place of *point_lat*, *point_lon*; each one as [lat, lon] or as an object with members *lat*, *lon* and optionally *id*. The ids identify the origins in the result, provided they are unique; otherwise the origins are identified by their position, starting from 0. The number of origins is limited by the service configuration (100 by default).",
+                "example": "[{\"id\": \"A\", \"lat\": 37.968312, \"lon\": 23.710438}, {\"id\": \"B\", \"lat\": 37.975, \"lon\": 23.735}]"
+            },
             "costing": {
                 "type": "string",
                 "description": "Costing algorithm (one of *auto*, *bicyle*, *pedestrian*, *bikeshare* or *bus*; see [https://valhalla.readthedocs.io/en/latest/api/turn-by-turn/api-reference/#costing-models](https://valhalla.readthedocs.io/en/latest/api/turn-by-turn/api-reference/#costing-models)).",
@@ -177,9 +248,13 @@ def add_components(spec):
                 "minimum": 0.0,
                 "maximum": 200.0,
                 "example": 10
+            },
+            "distances": {
+                "type": "string",
+                "description": "A list of distances in kilometers (max: 200), as JSON array or comma separated values, given in place of *distance*.",
+                "example": "5,10,15"
             }
-        },
-        "required": ["resource", "point_lat", "point_lon", "distance"]
+        }
     }
     spec.components.schema('travelDistanceFilterForm', travel_dist_form)
 
@@ -188,7 +263,8 @@ def add_components(spec):
         "properties": {
             **travel_dist_form["properties"],
             "resource": resource_multi
-        }
+        },
+        "required": ["resource"]
     }
     spec.components.schema('travelDistanceFilterFormMultipart', travel_dist_form_multi)
 
@@ -203,9 +279,13 @@ def add_components(spec):
                 "minimum": 0.0,
                 "maximum": 120.0,
                 "example": 60
+            },
+            "times": {
+                "type": "string",
+                "description": "A list of times in minutes (max: 120), as JSON array or comma separated values, given in place of *time*.",
+                "example": "5,10,15"
             }
-        },
-        "required": ["resource", "point_lat", "point_lon", "time"]
+        }
     }
     spec.components.schema('travelTimeFilterForm', travel_time_form)
 
@@ -214,7 +294,8 @@ def add_components(spec):
         "properties": {
             **travel_time_form["properties"],
             "resource": resource_multi
-        }
+        },
+        "required": ["resource"]
     }
     spec.components.schema('travelTimeFilterFormMultipart', travel_time_form_multi)
 
@@ -222,10 +303,12 @@ def add_components(spec):
         **base_form,
         "properties": {
             **base_form["properties"],
+            **output,
             "wkt": wkt,
-            "resource": resource
+            "resource": resource,
+            "dataset": dataset
         },
-        "required": ["wkt", "resource"]
+        "required": ["wkt"]
     }
     spec.components.schema('filterForm', filter_form)
 
@@ -233,6 +316,7 @@ def add_components(spec):
         **base_form,
         "properties": {
             **base_form["properties"],
+            **output,
             "wkt": wkt,
             "resource": resource_multi
         },
@@ -240,12 +324,50 @@ def add_components(spec):
     }
     spec.components.schema('filterFormMultipart', filter_form_multi)
 
+    nearest_extra = {
+        "k": {
+            "type": "integer",
+            "description": "The number of nearest geometries to return. If not given, all the geometries are returned, sorted by distance.",
+            "example": 10
+        },
+        "maximum_distance": {
+            "type": "number",
+            "format": "float",
+            "description": "The maximum distance from the given geometry, specified in units defined by the srid.",
+            "example": 0.5
+        }
+    }
+
+    nearest_form = {
+        **filter_form,
+        "properties": {
+            **filter_form["properties"],
+            **nearest_extra
+        }
+    }
+    spec.components.schema('nearestFilterForm', nearest_form)
+
+    nearest_form_multi = {
+        **filter_form_multi,
+        "properties": {
+            **filter_form_multi["properties"],
+            **nearest_extra
+        }
+    }
+    spec.components.schema('nearestFilterFormMultipart', nearest_form_multi)
+
     buffer_extra = {
         "radius": {
             "type": "number",
             "format": "float",
             "description": "The radius from the given geometry that the geometries should lie within. The radius is specified in units defined by the srid.",
             "example": 0.1
+        },
+        "method": {
+            "type": "string",
+            "description": "How the features are tested; *distance* compares the exact distance of point features with the radius, building the buffer only for other geometries, while *buffer* tests all the features against the (approximated) buffer of the given geometry.",
+            "enum": ["distance", "buffer"],
+            "default": "distance"
         }
     }
 
@@ -254,9 +376,10 @@ def add_components(spec):
         "properties": {
             **filter_form["properties"],
             **buffer_extra,
-            "resource": resource
+            "resource": resource,
+            "dataset": dataset
         },
-        "required": ["wkt", "radius", "resource"]
+        "required": ["wkt", "radius"]
     }
     spec.components.schema('bufferFilterForm', buffer_form)
 
@@ -271,10 +394,56 @@ def add_components(spec):
     }
     spec.components.schema('bufferFilterFormMultipart', buffer_form_multi)
 
+    batch_extra = {
+        "queries": {
+            "type": "string",
+            "description": "The query geometries, as a GeoJSON FeatureCollection, a JSON array of Well-Known-Text geometries, or Well-Known-Text geometries in separate lines. They are meant to be in the same srid as the spatial file. The ids of the features identify the queries, provided they are unique; otherwise queries are identified by their position, starting from 0.",
+            "example": "[\"POLYGON((6.4 49., 6.5 50., 6.6 49.5, 6.4 49.))\", \"POLYGON((7.4 49., 7.5 50., 7.6 49.5, 7.4 49.))\"]"
+        },
+        "predicate": {
+            "type": "string",
+            "description": "The predicate that the features should satisfy with a query geometry.",
+            "enum": ["within", "intersects"],
+            "default": "within"
+        },
+        "layout": {
+            "type": "string",
+            "description": "*split* results in one spatial file per query geometry, while *column* results in a single spatial file with the id of the matched query geometry in column *query_id*.",
+            "enum": ["split", "column"],
+            "default": "split"
+        }
+    }
+
+    batch_form = {
+        **base_form,
+        "properties": {
+            **base_form["properties"],
+            **output,
+            **batch_extra,
+            "resource": resource,
+            "dataset": dataset
+        },
+        "required": ["queries"]
+    }
+    spec.components.schema('batchFilterForm', batch_form)
+
+    batch_form_multi = {
+        **base_form,
+        "properties": {
+            **base_form["properties"],
+            **output,
+            **batch_extra,
+            "resource": resource_multi
+        },
+        "required": ["queries", "resource"]
+    }
+    spec.components.schema('batchFilterFormMultipart', batch_form_multi)
+
     join_base_form = {
         **base_form,
         "properties": {
             **base_form["properties"],
+            **output,
             "other_delimiter": {
                 "type": "string",
                 "description": "In case the **other** file is a delimited text file, the character used to separate values. Ignored for not delimited files.",
@@ -306,6 +475,11 @@ def add_components(spec):
                 "description": "The encoding of the **other** file. If not given, the encoding is automatically detected.",
                 "example": "UTF-8"
             },
+            "other_layer": {
+                "type": "string",
+                "description": "The name of a pinned reference layer (see environment variable PINNED_LAYERS), given in place of *other*. Pinned layers stay loaded and indexed in the service, so that joins only pay for the *resource* dataset.",
+                "example": "admin"
+            },
             "how": {
                 "type": "string",
                 "description": "Type of the spatial join.",
@@ -331,16 +505,32 @@ def add_components(spec):
                 "type": "string",
                 "description": "Suffix for the *right* attributes.",
                 "example": "_r"
+            },
+            "aggregate": {
+                "type": "boolean",
+                "description": "Whether to return one feature per *left* feature, with the number of its matches (*count*) and the requested *aggregates* of their attributes, instead of one feature per matching pair. Requires *how* to be 'left' or 'inner'.",
+                "default": False
+            },
+            "aggregates": {
+                "type": "string",
+                "description": "For aggregate joins, comma separated list of *column:function* of numeric attributes of the *right* dataset, with function one of sum, mean, min, max. Each results in an attribute named *column_function*.",
+                "example": "population:sum,price:mean"
             }
         }
     }
 
     other = {
         "type": "string",
-        "description": "A resolvable path to the **other** spatial file, relative to the **input directory**. The file could be in compressed form: zipped or tar(.gz) archive.",
+        "description": "A resolvable path to the **other** spatial file, relative to the **input directory**. The file could be in compressed form: zipped or tar(.gz) archive. Required, unless *other_dataset* or *other_layer* is given.",
         "example": "/datasets/shapefile.tar.gz"
     }
 
+    other_dataset = {
+        "type": "string",
+        "description": "The key of a registered dataset, given in place of *other*.",
+        "example": "3ba6a8b5ecea27db3c5f4e0159c63283"
+    }
+
     other_multi = {
         "type" : "string",
         "format": "binary",
@@ -352,9 +542,10 @@ def add_components(spec):
         "properties": {
             **join_base_form["properties"],
             "resource": resource,
-            "other": other
-        },
-        "required": ["resource", "other"]
+            "dataset": dataset,
+            "other": other,
+            "other_dataset": other_dataset
+        }
     }
     spec.components.schema('joinForm', join_form)
 
@@ -374,9 +565,10 @@ def add_components(spec):
         "properties": {
             **join_base_form["properties"],
             "resource": resource_multi,
-            "other": other
+            "other": other,
+            "other_dataset": other_dataset
         },
-        "required": ["resource", "other"]
+        "required": ["resource"]
     }
     spec.components.schema('joinFormMultipartResource', join_form_multi_resource)
 
@@ -385,9 +577,10 @@ def add_components(spec):
         "properties": {
             **join_base_form["properties"],
             "resource": resource,
+            "dataset": dataset,
             "other": other_multi
         },
-        "required": ["resource", "other"]
+        "required": ["other"]
     }
     spec.components.schema('joinFormMultipartOther', join_form_multi_other)
 
@@ -405,7 +598,7 @@ def add_components(spec):
             **join_form["properties"],
             **dwithin_join_extra
         },
-        "required": ["resource", "other", "distance"]
+        "required": ["distance"]
     })
     spec.components.schema('dwithinJoinFormMultipartBoth', {
         **join_form_multi_both,
@@ -421,7 +614,7 @@ def add_components(spec):
             **join_form_multi_resource["properties"],
             **dwithin_join_extra
         },
-        "required": ["resource", "other", "distance"]
+        "required": ["resource", "distance"]
     })
     spec.components.schema('dwithinJoinFormMultipartOther', {
         **join_form_multi_other,
@@ -429,7 +622,119 @@ def add_components(spec):
             **join_form_multi_other["properties"],
             **dwithin_join_extra
         },
-        "required": ["resource", "other", "distance"]
+        "required": ["other", "distance"]
+    })
+
+    nearest_join_extra = {
+        "k": {
+            "type": "integer",
+            "description": "The number of nearest features of the **other** dataset joined to each feature of the **resource**.",
+            "example": 3,
+            "default": 1
+        },
+        "maximum_distance": {
+            "type": "number",
+            "format": "float",
+            "description": "The maximum distance of the joined features, specified in units defined by the srid of the *resource* spatial file.",
+            "example": 0.5
+        }
+    }
+    spec.components.schema('nearestJoinForm', {
+        **join_form,
+        "properties": {
+            **join_form["properties"],
+            **nearest_join_extra
+        }
+    })
+    spec.components.schema('nearestJoinFormMultipartBoth', {
+        **join_form_multi_both,
+        "properties": {
+            **join_form_multi_both["properties"],
+            **nearest_join_extra
+        }
+    })
+    spec.components.schema('nearestJoinFormMultipartResource', {
+        **join_form_multi_resource,
+        "properties": {
+            **join_form_multi_resource["properties"],
+            **nearest_join_extra
+        }
+    })
+    spec.components.schema('nearestJoinFormMultipartOther', {
+        **join_form_multi_other,
+        "properties": {
+            **join_form_multi_other["properties"],
+            **nearest_join_extra
+        }
+    })
+
+    dataset_form = {
+        **base_form,
+        "properties": {
+            key: value for key, value in base_form["properties"].items() if key not in ['download', 'output_format']
+        }
+    }
+    spec.components.schema('datasetForm', {
+        **dataset_form,
+        "properties": {
+            **dataset_form["properties"],
+            "resource": {**resource, "description": "A resolvable path to the spatial file, relative to the **input directory**. The file could be in compressed form: zipped or tar(.gz) archive."}
+        },
+        "required": ["resource"]
+    })
+    spec.components.schema('datasetFormMultipart', {
+        **dataset_form,
+        "properties": {
+            **dataset_form["properties"],
+            "resource": resource_multi
+        },
+        "required": ["resource"]
+    })
+
+    spec.components.schema('datasetInfo', {
+        "type": "object",
+        "properties": {
+            "key": {
+                "type": "string",
+                "description": "The unique key of the dataset.",
+                "example": "3ba6a8b5ecea27db3c5f4e0159c63283"
+            },
+            "name": {
+                "type": "string",
+                "description": "The name of the source file.",
+                "example": "shapefile.tar.gz"
+            },
+            "ready": {
+                "type": "boolean",
+                "description": "Whether the dataset has been converted and can be used."
+            },
+            "driver": {
+                "type": "string",
+                "description": "The driver of the source file.",
+                "example": "ESRI Shapefile"
+            },
+            "crs": {
+                "type": "string",
+                "description": "The Coordinate Reference System of the geometries.",
+                "example": "EPSG:4326"
+            },
+            "rows": {
+                "type": "integer",
+                "description": "The number of features.",
+                "example": 1250
+            },
+            "bounds": {
+                "type": "array",
+                "description": "The bounds of the dataset, as [minx, miny, maxx, maxy].",
+                "items": {"type": "number", "format": "float"},
+                "example": [19.3, 34.8, 28.3, 41.8]
+            },
+            "created": {
+                "type": "string",
+                "format": "date-time",
+                "description": "The timestamp of the registration."
+            }
+        }
     })
 
     # Responses
@@ -512,6 +817,25 @@ def add_components(spec):
                             "type": "string",
                             "description": "The relative to the *output directory* path for the spatial file.",
                             "example": "2103/3ba6a8b5ecea27db3c5f4e0159c63283/example.csv.gz"
+                        },
+                        "result": {
+                            "type": "object",
+                            "description": "When form parameter *output* was set to *count* or *summary*.",
+                            "properties": {
+                                "count": {
+                                    "type": "integer",
+                                    "description": "The number of the resulted features."
+                                },
+                                "bounds": {
+                                    "type": "array",
+                                    "description": "The bounding box of the resulted features as [minx, miny, maxx, maxy]; null if there are none.",
+                                    "items": {"type": "number"}
+                                },
+                                "features": {
+                                    "type": "object",
+                                    "description": "GeoJSON FeatureCollection with the first *limit* features (*summary* only)."
+                                }
+                            }
                         }
                     }
                 }
@@ -1,5 +1,8 @@
 from flask_wtf import FlaskForm
 
+# The formats of the exported files; 'native' is the format of the source file.
+OUTPUT_FORMATS = ['native', 'geoparquet', 'arrow', 'flatgeobuf']
+
 class BaseForm(FlaskForm):
     """The WTForms base form, it disables CSRF.
 
@@ -1,8 +1,8 @@
 from flask_wtf.file import FileField, FileRequired
-from wtforms import StringField, FloatField, BooleanField
+from wtforms import StringField, BooleanField
 from wtforms.validators import Optional, Length, DataRequired, AnyOf
-from .validators import CRS, Encoding
-from . import BaseForm
+from .validators import CRS, Encoding, Dataset, RequiredUnless, Steps, Tolerances
+from . import BaseForm, OUTPUT_FORMATS
 
 class ConstructiveForm(BaseForm):
     """Base form for constructive requests.
@@ -18,6 +18,8 @@ class ConstructiveForm(BaseForm):
     geom = StringField('geom', validators=[Optional()])
     crs = StringField('crs', validators=[Optional(), CRS()])
     encoding = StringField('encoding', validators=[Optional(), Encoding()])
+    dataset = StringField('dataset', validators=[Optional(), Dataset()])
+    output_format = StringField('output_format', default='native', validators=[Optional(), AnyOf(OUTPUT_FORMATS)])
 
 class ConstructiveFileForm(ConstructiveForm):
     """Generic form for constructive requests with file resource.
@@ -33,7 +35,7 @@ class ConstructivePathForm(ConstructiveForm):
     Extends:
         ConstructiveForm
     """
-    resource = StringField('resource', validators=[DataRequired()])
+    resource = StringField('resource', validators=[RequiredUnless('dataset')])
 
 class SimplifyFileForm(ConstructiveFileForm):
     """Form for simplify constructive requests with file resource.
@@ -41,8 +43,9 @@ class SimplifyFileForm(ConstructiveFileForm):
     Extends:
         ConstructiveFileForm
     """
-    tolerance = FloatField('tolerance', validators=[DataRequired()])
+    tolerance = StringField('tolerance', validators=[DataRequired(), Tolerances()])
     preserve_topology = BooleanField('preserve_topology', default=False, validators=[Optional()])
+    pyramid = StringField('pyramid', default='archive', validators=[Optional(), AnyOf(['archive', 'column'])])
 
 class SimplifyPathForm(ConstructivePathForm):
     """Form for simplify constructive requests with resource as path.
@@ -50,5 +53,22 @@ class SimplifyPathForm(ConstructivePathForm):
     Extends:
         ConstructiveFileForm
     """
-    tolerance = FloatField('tolerance', validators=[DataRequired()])
+    tolerance = StringField('tolerance', validators=[DataRequired(), Tolerances()])
     preserve_topology = BooleanField('preserve_topology', default=False, validators=[Optional()])
+    pyramid = StringField('pyramid', default='archive', validators=[Optional(), AnyOf(['archive', 'column'])])
+
+class PipelineFileForm(ConstructiveFileForm):
+    """Form for constructive pipeline requests with file resource.
+
+    Extends:
+        ConstructiveFileForm
+    """
+    steps = StringField('steps', validators=[DataRequired(), Steps()])
+
+class PipelinePathForm(ConstructivePathForm):
+    """Form for constructive pipeline requests with resource as path.
+
+    Extends:
+        ConstructivePathForm
+    """
+    steps = StringField('steps', validators=[DataRequired(), Steps()])
@@ -0,0 +1,35 @@
+from flask_wtf.file import FileField, FileRequired
+from wtforms import StringField
+from wtforms.validators import Optional, Length, DataRequired, AnyOf
+from .validators import CRS, Encoding
+from . import BaseForm
+
+class DatasetForm(BaseForm):
+    """Base form for dataset registration requests.
+
+    Extends:
+        BaseForm
+    """
+    response = StringField('response', default='deferred', validators=[Optional(), AnyOf(['prompt', 'deferred'])])
+    delimiter = StringField('delimiter', default=',', validators=[Optional(), Length(min=1, max=2)])
+    lat = StringField('lat', validators=[Optional()])
+    lon = StringField('lon', validators=[Optional()])
+    geom = StringField('geom', validators=[Optional()])
+    crs = StringField('crs', validators=[Optional(), CRS()])
+    encoding = StringField('encoding', validators=[Optional(), Encoding()])
+
+class DatasetFileForm(DatasetForm):
+    """Form for dataset registration requests with file resource.
+
+    Extends:
+        DatasetForm
+    """
+    resource = FileField('resource', validators=[FileRequired()])
+
+class DatasetPathForm(DatasetForm):
+    """Form for dataset registration requests with resource as path.
+
+    Extends:
+        DatasetForm
+    """
+    resource = StringField('resource', validators=[DataRequired()])
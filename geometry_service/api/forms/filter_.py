@@ -1,8 +1,8 @@
 from flask_wtf.file import FileField, FileRequired
-from wtforms import StringField, FloatField, BooleanField
+from wtforms import StringField, FloatField, IntegerField, BooleanField
 from wtforms.validators import Optional, Length, DataRequired, AnyOf, NumberRange
-from .validators import CRS, Encoding, WKT
-from . import BaseForm
+from .validators import CRS, Encoding, Dataset, RequiredUnless, WKT, Queries, Origins, Contours
+from . import BaseForm, OUTPUT_FORMATS
 
 class FilterForm(BaseForm):
     """Base form for filter requests.
@@ -18,6 +18,10 @@ class FilterForm(BaseForm):
     geom = StringField('geom', validators=[Optional()])
     crs = StringField('crs', validators=[Optional(), CRS()])
     encoding = StringField('encoding', validators=[Optional(), Encoding()])
+    dataset = StringField('dataset', validators=[Optional(), Dataset()])
+    output = StringField('output', default='file', validators=[Optional(), AnyOf(['file', 'count', 'summary'])])
+    output_format = StringField('output_format', default='native', validators=[Optional(), AnyOf(OUTPUT_FORMATS)])
+    limit = IntegerField('limit', default=10, validators=[Optional(), NumberRange(min=0, max=1000)])
 
 class FilterFileForm(FilterForm):
     """Generic form for filter requests with file resource.
@@ -34,9 +38,27 @@ class FilterPathForm(FilterForm):
     Extends:
         FilterForm
     """
-    resource = StringField('resource', validators=[DataRequired()])
+    resource = StringField('resource', validators=[RequiredUnless('dataset')])
     wkt = StringField('wkt', validators=[DataRequired(), WKT()])
 
+class NearestFileForm(FilterFileForm):
+    """Form for nearest filter requests with file resource.
+
+    Extends:
+        FilterFileForm
+    """
+    k = IntegerField('k', validators=[Optional(), NumberRange(min=1)])
+    maximum_distance = FloatField('maximum_distance', validators=[Optional(), NumberRange(min=0)])
+
+class NearestPathForm(FilterPathForm):
+    """Form for nearest filter requests with resource as path.
+
+    Extends:
+        FilterPathForm
+    """
+    k = IntegerField('k', validators=[Optional(), NumberRange(min=1)])
+    maximum_distance = FloatField('maximum_distance', validators=[Optional(), NumberRange(min=0)])
+
 class BufferFileForm(FilterFileForm):
     """Form for within buffer filter requests with file resource.
 
@@ -44,6 +66,7 @@ class BufferFileForm(FilterFileForm):
         FilterFileForm
     """
     radius = FloatField('radius', validators=[DataRequired()])
+    method = StringField('method', default='distance', validators=[Optional(), AnyOf(['distance', 'buffer'])])
     wkt = StringField('wkt', validators=[DataRequired(), WKT()])
 
 class BufferPathForm(FilterPathForm):
@@ -53,32 +76,63 @@ class BufferPathForm(FilterPathForm):
         FilterPathForm
     """
     radius = FloatField('radius', validators=[DataRequired()])
+    method = StringField('method', default='distance', validators=[Optional(), AnyOf(['distance', 'buffer'])])
     wkt = StringField('wkt', validators=[DataRequired(), WKT()])
 
+class BatchFileForm(FilterForm):
+    """Form for batch filter requests with file resource.
+
+    Extends:
+        FilterForm
+    """
+    resource = FileField('resource', validators=[FileRequired()])
+    queries = StringField('queries', validators=[DataRequired(), Queries()])
+    predicate = StringField('predicate', default='within', validators=[Optional(), AnyOf(['within', 'intersects'])])
+    layout = StringField('layout', default='split', validators=[Optional(), AnyOf(['split', 'column'])])
+
+class BatchPathForm(FilterForm):
+    """Form for batch filter requests with resource as path.
+
+    Extends:
+        FilterForm
+    """
+    resource = StringField('resource', validators=[RequiredUnless('dataset')])
+    queries = StringField('queries', validators=[DataRequired(), Queries()])
+    predicate = StringField('predicate', default='within', validators=[Optional(), AnyOf(['within', 'intersects'])])
+    layout = StringField('layout', default='split', validators=[Optional(), AnyOf(['split', 'column'])])
+
 class TravelDistanceFileForm(FilterForm):
     resource = FileField('resource', validators=[FileRequired()])
-    distance = FloatField('distance', validators=[DataRequired(), NumberRange(min=0, max=200.0)])
-    point_lat = FloatField('point_lat', validators=[DataRequired()])
-    point_lon = FloatField('point_lon', validators=[DataRequired()])
+    distance = FloatField('distance', validators=[RequiredUnless('distances'), NumberRange(min=0, max=200.0)])
+    distances = StringField('distances', validators=[Optional(), Contours(maximum=200.0)])
+    point_lat = FloatField('point_lat', validators=[RequiredUnless('origins')])
+    point_lon = FloatField('point_lon', validators=[RequiredUnless('origins')])
+    origins = StringField('origins', validators=[Optional(), Origins()])
     costing = StringField('costing', default="auto", validators=[Optional(), AnyOf(['auto', 'bicycle', 'pedestrian', 'bikeshare', 'bus'])])
 
 class TravelDistancePathForm(FilterForm):
-    resource = StringField('resource', validators=[DataRequired()])
-    distance = FloatField('distance', validators=[DataRequired(), NumberRange(min=0, max=200.0)])
-    point_lat = FloatField('point_lat', validators=[DataRequired()])
-    point_lon = FloatField('point_lon', validators=[DataRequired()])
+    resource = StringField('resource', validators=[RequiredUnless('dataset')])
+    distance = FloatField('distance', validators=[RequiredUnless('distances'), NumberRange(min=0, max=200.0)])
+    distances = StringField('distances', validators=[Optional(), Contours(maximum=200.0)])
+    point_lat = FloatField('point_lat', validators=[RequiredUnless('origins')])
+    point_lon = FloatField('point_lon', validators=[RequiredUnless('origins')])
+    origins = StringField('origins', validators=[Optional(), Origins()])
     costing = StringField('costing', default="auto", validators=[Optional(), AnyOf(['auto', 'bicycle', 'pedestrian', 'bikeshare', 'bus'])])
 
 class TravelTimeFileForm(FilterForm):
     resource = FileField('resource', validators=[FileRequired()])
-    time = FloatField('time', validators=[DataRequired(), NumberRange(min=0, max=120)])
-    point_lat = FloatField('point_lat', validators=[DataRequired()])
-    point_lon = FloatField('point_lon', validators=[DataRequired()])
+    time = FloatField('time', validators=[RequiredUnless('times'), NumberRange(min=0, max=120)])
+    times = StringField('times', validators=[Optional(), Contours(maximum=120)])
+    point_lat = FloatField('point_lat', validators=[RequiredUnless('origins')])
+    point_lon = FloatField('point_lon', validators=[RequiredUnless('origins')])
+    origins = StringField('origins', validators=[Optional(), Origins()])
     costing = StringField('costing', default="auto", validators=[Optional(), AnyOf(['auto', 'bicycle', 'pedestrian', 'bikeshare', 'bus'])])
 
 class TravelTimePathForm(FilterForm):
-    resource = StringField('resource', validators=[DataRequired()])
-    time = FloatField('time', validators=[DataRequired(), NumberRange(min=0, max=120)])
-    point_lat = FloatField('point_lat', validators=[DataRequired()])
-    point_lon = FloatField('point_lon', validators=[DataRequired()])
+    resource = StringField('resource', validators=[RequiredUnless('dataset')])
+    time = FloatField('time', validators=[RequiredUnless('times'), NumberRange(min=0, max=120)])
+    times = StringField('times', validators=[Optional(), Contours(maximum=120)])
+    point_lat = FloatField('point_lat', validators=[RequiredUnless('origins')])
+    point_lon = FloatField('point_lon', validators=[RequiredUnless('origins')])
+    origins = StringField('origins', validators=[Optional(), Origins()])
     costing = StringField('costing', default="auto", validators=[Optional(), AnyOf(['auto', 'bicycle', 'pedestrian', 'bikeshare', 'bus'])])
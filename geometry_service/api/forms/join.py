@@ -1,8 +1,8 @@
 from flask_wtf.file import FileField, FileRequired
-from wtforms import StringField, FloatField, BooleanField
-from wtforms.validators import Optional, Length, DataRequired, AnyOf
-from .validators import CRS, Encoding
-from . import BaseForm
+from wtforms import StringField, FloatField, IntegerField, BooleanField
+from wtforms.validators import Optional, Length, DataRequired, AnyOf, NumberRange
+from .validators import CRS, Encoding, Dataset, RequiredUnless, Aggregates, PinnedLayer
+from . import BaseForm, OUTPUT_FORMATS
 
 class JoinForm(BaseForm):
     """Base form for join requests.
@@ -18,17 +18,25 @@ class JoinForm(BaseForm):
     geom = StringField('geom', validators=[Optional()])
     crs = StringField('crs', validators=[Optional(), CRS()])
     encoding = StringField('encoding', validators=[Optional(), Encoding()])
+    dataset = StringField('dataset', validators=[Optional(), Dataset()])
+    output = StringField('output', default='file', validators=[Optional(), AnyOf(['file', 'count', 'summary'])])
+    output_format = StringField('output_format', default='native', validators=[Optional(), AnyOf(OUTPUT_FORMATS)])
+    limit = IntegerField('limit', default=10, validators=[Optional(), NumberRange(min=0, max=1000)])
     other_delimiter = StringField('other_delimiter', default=',', validators=[Optional(), Length(min=1, max=2)])
     other_lat = StringField('other_lat', validators=[Optional()])
     other_lon = StringField('other_lon', validators=[Optional()])
     other_geom = StringField('other_geom', validators=[Optional()])
     other_crs = StringField('other_crs', validators=[Optional(), CRS()])
     other_encoding = StringField('other_encoding', validators=[Optional(), Encoding()])
+    other_dataset = StringField('other_dataset', validators=[Optional(), Dataset()])
+    other_layer = StringField('other_layer', validators=[Optional(), PinnedLayer()])
     how = StringField('how', default="inner", validators=[Optional(), AnyOf(["left", "right", "inner"])])
     lprefix = StringField('lprefix', validators=[Optional()])
     rprefix = StringField('rprefix', validators=[Optional()])
     lsuffix = StringField('lsuffix', validators=[Optional()])
     rsuffix = StringField('rsuffix', validators=[Optional()])
+    aggregate = BooleanField('aggregate', default=False, validators=[Optional()])
+    aggregates = StringField('aggregates', validators=[Optional(), Aggregates()])
 
 
 class JoinFileForm(JoinForm):
@@ -47,7 +55,7 @@ class JoinResourceFileForm(JoinForm):
         JoinForm
     """
     resource = FileField('resource', validators=[FileRequired()])
-    other = StringField('other', validators=[DataRequired()])
+    other = StringField('other', validators=[RequiredUnless('other_dataset', 'other_layer')])
 
 class JoinOtherFileForm(JoinForm):
     """Generic form for join requests with main asset as path and the other as file.
@@ -55,7 +63,7 @@ class JoinOtherFileForm(JoinForm):
     Extends:
         JoinForm
     """
-    resource = StringField('resource', validators=[DataRequired()])
+    resource = StringField('resource', validators=[RequiredUnless('dataset')])
     other = FileField('other', validators=[FileRequired()])
 
 class JoinPathForm(JoinForm):
@@ -64,8 +72,8 @@ class JoinPathForm(JoinForm):
     Extends:
         JoinForm
     """
-    resource = StringField('resource', validators=[DataRequired()])
-    other = StringField('other', validators=[DataRequired()])
+    resource = StringField('resource', validators=[RequiredUnless('dataset')])
+    other = StringField('other', validators=[RequiredUnless('other_dataset', 'other_layer')])
 
 class JoinDWithinFileForm(JoinFileForm):
     """Form for dwithin join requests with both assets as files.
@@ -98,3 +106,39 @@ class JoinDWithinPathForm(JoinPathForm):
         JoinPathForm
     """
     distance = FloatField('distance', validators=[DataRequired()])
+
+class JoinNearestFileForm(JoinFileForm):
+    """Form for nearest join requests with both assets as files.
+
+    Extends:
+        JoinFileForm
+    """
+    k = IntegerField('k', default=1, validators=[Optional(), NumberRange(min=1, max=100)])
+    maximum_distance = FloatField('maximum_distance', validators=[Optional(), NumberRange(min=0)])
+
+class JoinNearestResourceFileForm(JoinResourceFileForm):
+    """Form for nearest join requests with main asset as file and the other as path.
+
+    Extends:
+        JoinResourceFileForm
+    """
+    k = IntegerField('k', default=1, validators=[Optional(), NumberRange(min=1, max=100)])
+    maximum_distance = FloatField('maximum_distance', validators=[Optional(), NumberRange(min=0)])
+
+class JoinNearestOtherFileForm(JoinOtherFileForm):
+    """Form for nearest join requests with main asset as path and the other as file.
+
+    Extends:
+        JoinOtherFileForm
+    """
+    k = IntegerField('k', default=1, validators=[Optional(), NumberRange(min=1, max=100)])
+    maximum_distance = FloatField('maximum_distance', validators=[Optional(), NumberRange(min=0)])
+
+class JoinNearestPathForm(JoinPathForm):
+    """Form for nearest join requests with both assets as paths.
+
+    Extends:
+        JoinPathForm
+    """
+    k = IntegerField('k', default=1, validators=[Optional(), NumberRange(min=1, max=100)])
+    maximum_distance = FloatField('maximum_distance', validators=[Optional(), NumberRange(min=0)])
@@ -1,6 +1,7 @@
 """A collection of custom WTForms Validators."""
 
-from wtforms.validators import ValidationError
+import os
+from wtforms.validators import ValidationError, StopValidation, DataRequired
 
 class CRS(object):
     """Validates CRS fields."""
@@ -10,10 +11,10 @@ class CRS(object):
         self.message = message
 
     def __call__(self, form, field):
-        import pyproj
         from pyproj.exceptions import CRSError
+        from geometry_service.api.crs import get_crs
         try:
-            pyproj.crs.CRS.from_user_input(field.data)
+            get_crs(field.data)
         except CRSError:
             raise ValidationError(self.message)
 
@@ -45,3 +46,130 @@ class WKT(object):
             from_wkt(field.data)
         except GEOSException:
             raise ValidationError(self.message)
+
+
+class Queries(object):
+    """Validates a collection of query geometries."""
+    def __init__(self, message=None):
+        if not message:
+            message = 'Field must be a GeoJSON FeatureCollection or a list of Well-Known-Text geometries.'
+        self.message = message
+
+    def __call__(self, form, field):
+        from geometry_service.api.predicates import read_queries
+        try:
+            read_queries(field.data)
+        except ValueError:
+            raise ValidationError(self.message)
+
+
+class Origins(object):
+    """Validates a list of travel origins."""
+    def __init__(self, maximum=None, message=None):
+        self.maximum = maximum
+        self.message = message
+
+    def __call__(self, form, field):
+        from geometry_service.api.isochrones import read_origins, max_origins
+        maximum = self.maximum if self.maximum is not None else max_origins()
+        try:
+            read_origins(field.data, maximum=maximum)
+        except ValueError:
+            raise ValidationError(self.message or 'Field must be a list of up to {maximum} origins, as [lat, lon] or {{"id": ..., "lat": ..., "lon": ...}}.'.format(maximum=maximum))
+
+
+class Contours(object):
+    """Validates a list of travel contours."""
+    def __init__(self, maximum=None, message=None):
+        if not message:
+            message = 'Field must be a list of positive values{limit}.'.format(limit='' if maximum is None else ' up to {maximum}'.format(maximum=maximum))
+        self.maximum = maximum
+        self.message = message
+
+    def __call__(self, form, field):
+        from geometry_service.api.isochrones import read_contours
+        try:
+            read_contours(field.data, maximum=self.maximum)
+        except ValueError:
+            raise ValidationError(self.message)
+
+
+class Aggregates(object):
+    """Validates the aggregates of an aggregate join."""
+    def __init__(self, message=None):
+        if not message:
+            message = 'Field must be a comma separated list of column:function, with function one of sum, mean, min, max.'
+        self.message = message
+
+    def __call__(self, form, field):
+        from geometry_service.api.spatial_join import read_aggregates
+        try:
+            read_aggregates(field.data)
+        except ValueError:
+            raise ValidationError(self.message)
+
+
+class Tolerances(object):
+    """Validates the tolerances of a simplification."""
+    def __init__(self, message=None):
+        self.message = message
+
+    def __call__(self, form, field):
+        from geometry_service.api.chunked import read_tolerances
+        try:
+            read_tolerances(field.data)
+        except ValueError as e:
+            raise ValidationError(self.message or str(e))
+
+
+class Steps(object):
+    """Validates the steps of a constructive pipeline."""
+    def __init__(self, message=None):
+        self.message = message
+
+    def __call__(self, form, field):
+        from geometry_service.api.chunked import read_steps
+        try:
+            read_steps(field.data)
+        except ValueError as e:
+            raise ValidationError(self.message or str(e))
+
+
+class Dataset(object):
+    """Validates a registered dataset field."""
+    def __init__(self, message=None):
+        if not message:
+            message = 'Field must be the key of a registered dataset.'
+        self.message = message
+
+    def __call__(self, form, field):
+        from geometry_service.database.model import Dataset as DatasetModel
+        dataset = DatasetModel().get(key=field.data)
+        if dataset is None or not dataset['ready'] or not os.path.isfile(dataset['path']):
+            raise ValidationError(self.message)
+
+
+class PinnedLayer(object):
+    """Validates a pinned layer field."""
+    def __init__(self, message=None):
+        if not message:
+            message = 'Field must be the name of a pinned layer.'
+        self.message = message
+
+    def __call__(self, form, field):
+        from geometry_service.api.layers import pinned_layers
+        if field.data not in pinned_layers():
+            raise ValidationError(self.message)
+
+
+class RequiredUnless(object):
+    """Makes a field required, unless any of some other fields is given."""
+    def __init__(self, *others, message=None):
+        self.others = others
+        self.message = message
+
+    def __call__(self, form, field):
+        if any(form[other].data for other in self.others):
+            field.errors[:] = []
+            raise StopValidation()
+        DataRequired(self.message)(form, field)
@@ -0,0 +1,361 @@
+"""Helpers to access the geometries of a GeoDataFrame as pygeos arrays."""
+import numpy as np
+import pygeos as pg
+
+DEFAULT_CHUNK_SIZE = 1000000
+
+# Hidden columns with the bounding box of each geometry, added during conversion; hidden columns are not exported.
+BBOX_COLUMNS = ['__minx', '__miny', '__maxx', '__maxy']
+
+# The output formats besides 'native' (the driver of the source file), with the extension of their files.
+OUTPUT_FORMATS = {'geoparquet': '.parquet', 'arrow': '.arrow', 'flatgeobuf': '.fgb'}
+
+GEOPARQUET_VERSION = '1.0.0'
+
+
+def to_pygeos(gdf):
+    """Decodes the geometries of a GeoDataFrame.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+
+    Returns:
+        (ndarray): Array of pygeos geometries.
+    """
+    return pg.from_wkb(gdf.geometry.to_numpy())
+
+
+def chunks(gdf, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Iterates over consecutive slices of a GeoDataFrame.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+
+    Keyword Arguments:
+        chunk_size (int): The number of rows of each slice (default: {1000000})
+
+    Yields:
+        (tuple): The position of the first row and the slice.
+    """
+    for start in range(0, len(gdf), chunk_size):
+        yield start, gdf[start:start + chunk_size]
+
+
+def bounds(gdf, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Computes the bounds of each geometry of a GeoDataFrame.
+
+    The bounding box columns are read, if available; otherwise geometries are decoded in chunks, to keep memory bounded.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+
+    Keyword Arguments:
+        chunk_size (int): The number of geometries decoded at once (default: {1000000})
+
+    Returns:
+        (ndarray): Array of shape (N, 4) with the bounds of each geometry; NaN for empty geometries.
+    """
+    if all(column in gdf.get_column_names(hidden=True) for column in BBOX_COLUMNS):
+        return np.column_stack([np.asarray(gdf.evaluate(column), dtype=np.float64) for column in BBOX_COLUMNS]).reshape(-1, 4)
+    result = np.empty((len(gdf), 4), dtype=np.float64)
+    for start, chunk in chunks(gdf, chunk_size):
+        result[start:start + len(chunk)] = pg.bounds(to_pygeos(chunk))
+    return result
+
+
+def add_bbox_columns(gdf, bounds):
+    """Adds the bounding box columns to a GeoDataFrame.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        bounds (ndarray): Array of shape (N, 4) with the bounds of each geometry.
+    """
+    for i, column in enumerate(BBOX_COLUMNS):
+        gdf.add_column(column, np.ascontiguousarray(bounds[:, i]))
+
+
+def bbox_mask(gdf, bounds, within=False):
+    """Tests the bounding box columns of a GeoDataFrame against a box, without decoding any geometry.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        bounds (list): The box as [minx, miny, maxx, maxy].
+
+    Keyword Arguments:
+        within (bool): Whether the bounding boxes should lie within the box, instead of intersecting it (default: {False})
+
+    Returns:
+        (ndarray|None): Boolean mask of the rows that pass the test, or None if the columns are not available.
+    """
+    if not all(column in gdf.get_column_names(hidden=True) for column in BBOX_COLUMNS):
+        return None
+    minx, miny, maxx, maxy = (gdf.evaluate(column) for column in BBOX_COLUMNS)
+    if within:
+        return (minx >= bounds[0]) & (miny >= bounds[1]) & (maxx <= bounds[2]) & (maxy <= bounds[3])
+    return (minx <= bounds[2]) & (miny <= bounds[3]) & (maxx >= bounds[0]) & (maxy >= bounds[1])
+
+
+def total_bounds(gdf):
+    """Computes the bounds of all the geometries of a GeoDataFrame.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+
+    Returns:
+        (list): The bounds as [minx, miny, maxx, maxy].
+    """
+    # The bounding box columns, if available, spare decoding the geometries.
+    from .index import total_bounds as total_bounds_
+    if all(column in gdf.get_column_names(hidden=True) for column in BBOX_COLUMNS):
+        return total_bounds_(np.column_stack([gdf.evaluate(column) for column in BBOX_COLUMNS]))
+    return total_bounds_(bounds(gdf))
+
+
+def to_geojson(gdf):
+    """Converts a (small) GeoDataFrame to a GeoJSON FeatureCollection.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+
+    Returns:
+        (dict): The GeoJSON FeatureCollection.
+    """
+    from shapely.wkb import loads
+    from shapely.geometry import mapping
+    columns = [column for column in gdf.get_column_names() if column != 'geometry']
+    data = gdf.to_dict(column_names=columns) if len(columns) > 0 else {}
+    features = []
+    for i, wkb in enumerate(gdf.geometry.to_numpy()):
+        properties = {column: _json_value(values[i]) for column, values in data.items()}
+        geometry = mapping(loads(wkb)) if wkb is not None else None
+        features.append({'type': 'Feature', 'geometry': geometry, 'properties': properties})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def _json_value(value):
+    """Converts a value to a JSON serializable one."""
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def export_arrow(gdf, path):
+    """Writes a GeoDataFrame to an Arrow file, which can be opened with geovaex.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        path (str): The path of the Arrow file.
+    """
+    gdf.export_arrow(path, column_names=gdf.get_column_names(hidden=True))
+
+
+def export(gdf, path, output_format='native', driver=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Exports a GeoDataFrame to a spatial file.
+
+    GeoParquet and Arrow IPC files are written straight from the Arrow buffers, without GDAL; FlatGeobuf files are
+    written by GDAL, along with their spatial index.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        path (str): The path of the file.
+
+    Keyword Arguments:
+        output_format (str): One of 'native' (the given driver), 'geoparquet', 'arrow', 'flatgeobuf' (default: {'native'})
+        driver (str): The GDAL driver for the 'native' format (default: {None})
+        chunk_size (int): The number of rows written at once to GeoParquet files (default: {1000000})
+    """
+    if output_format == 'geoparquet':
+        export_geoparquet(gdf, path, chunk_size=chunk_size)
+    elif output_format == 'arrow':
+        gdf.export_arrow(path)
+    elif output_format == 'flatgeobuf':
+        gdf.export(path, driver='FlatGeobuf')
+    elif output_format == 'native':
+        gdf.export(path, driver=driver)
+    else:
+        raise ValueError("output_format could be one of {formats}.".format(formats=', '.join(['native'] + list(OUTPUT_FORMATS))))
+
+
+def export_geoparquet(gdf, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Writes a GeoDataFrame to a GeoParquet file, in row groups of bounded size.
+
+    The geometries are written as WKB, as stored, and the attributes as they are; the file metadata follows the
+    GeoParquet specification (version 1.0.0).
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        path (str): The path of the GeoParquet file.
+
+    Keyword Arguments:
+        chunk_size (int): The number of rows of each row group (default: {1000000})
+    """
+    import json
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    crs = gdf.geometry.crs
+    geo = {
+        'version': GEOPARQUET_VERSION,
+        'primary_column': 'geometry',
+        'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': [], 'crs': json.loads(crs.to_json()) if crs is not None else None}}
+    }
+    columns = [column for column in gdf.get_column_names() if column != 'geometry']
+    writer = None
+    try:
+        for _, chunk in (chunks(gdf, chunk_size) if len(gdf) > 0 else [(0, gdf)]):
+            arrays = [_arrow_array(chunk.evaluate(column)) for column in columns]
+            arrays.append(pa.array(list(chunk.geometry.to_numpy()), type=pa.binary()))
+            table = pa.Table.from_arrays(arrays, names=columns + ['geometry'])
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema.with_metadata({b'geo': json.dumps(geo).encode()}))
+            else:
+                table = table.cast(writer.schema.remove_metadata())
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _arrow_array(values):
+    """Converts the values of a column to an Arrow array; masked values become nulls."""
+    import pyarrow as pa
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        return values
+    if isinstance(values, np.ma.MaskedArray):
+        return pa.array(values.data, mask=np.ma.getmaskarray(values))
+    return pa.array(values)
+
+
+def concat(paths):
+    """Opens Arrow files with the same columns as a single GeoDataFrame, without loading them.
+
+    Arguments:
+        paths (list): The paths of the Arrow files.
+
+    Returns:
+        (obj): The concatenated GeoDataFrame.
+    """
+    import geovaex as gvx
+    from functools import reduce
+    return reduce(lambda gdf, other: gdf.concat(other), [gvx.open(path) for path in paths])
+
+
+def take(gdf, indices):
+    """Selects rows of a GeoDataFrame by position.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        indices (ndarray): The positions of the rows.
+
+    Returns:
+        (obj): A GeoDataFrame with the selected rows, in the given order.
+    """
+    return gdf.take(np.asarray(indices, dtype=np.int64))
+
+
+def join_frames(left, right, left_rows, right_rows, how='inner', distances=None, lprefix='', rprefix='', lsuffix='', rsuffix=''):
+    """Assembles the result of a spatial join from the row numbers of the joined features.
+
+    The geometry is taken from the left side, or the right one for 'right' joins. The attributes of each side are
+    renamed with its prefix and suffix; attributes of the other side which still collide are suffixed with
+    '_right' (or '_left').
+
+    Arguments:
+        left (obj): The left GeoDataFrame.
+        right (obj): The right GeoDataFrame.
+        left_rows (ndarray): The row numbers of the left features, -1 for a missing one.
+        right_rows (ndarray): The row numbers of the right features, -1 for a missing one.
+
+    Keyword Arguments:
+        how (str): How to join, one of 'left', 'right', 'inner' (default: {'inner'})
+        distances (ndarray): The distance of each pair, added as column *distance* (default: {None})
+        lprefix (str): Prefix for the left attributes (default: {''})
+        rprefix (str): Prefix for the right attributes (default: {''})
+        lsuffix (str): Suffix for the left attributes (default: {''})
+        rsuffix (str): Suffix for the right attributes (default: {''})
+
+    Returns:
+        (obj): The joined GeoDataFrame.
+    """
+    if how == 'right':
+        base, base_rows, base_fix = right, right_rows, (rprefix, rsuffix)
+        other, other_rows, other_fix, side = left, left_rows, (lprefix, lsuffix), '_left'
+    else:
+        base, base_rows, base_fix = left, left_rows, (lprefix, lsuffix)
+        other, other_rows, other_fix, side = right, right_rows, (rprefix, rsuffix), '_right'
+    result, names = _renamed(base, base_rows, *base_fix)
+    other_rows = np.asarray(other_rows, dtype=np.int64)
+    valid = other_rows >= 0
+    matched = take(other, other_rows[valid])
+    for column in other.get_column_names():
+        if column == 'geometry':
+            continue
+        name = other_fix[0] + column + other_fix[1]
+        while name in names:
+            name += side
+        result.add_column(name, _with_missing(matched.evaluate(column), valid))
+        names.add(name)
+    if distances is not None:
+        name = 'distance'
+        while name in names:
+            name += side
+        result.add_column(name, np.asarray(distances, dtype=np.float64))
+    return result
+
+
+def aggregate_frame(left, left_rows, aggregates, lprefix='', rprefix='', lsuffix='', rsuffix=''):
+    """Assembles the result of an aggregate spatial join.
+
+    Arguments:
+        left (obj): The left GeoDataFrame.
+        left_rows (ndarray): The row numbers of the left features.
+        aggregates (dict): The values of each aggregate, for the given left features.
+
+    Keyword Arguments:
+        lprefix (str): Prefix for the left attributes (default: {''})
+        rprefix (str): Prefix for the aggregates (default: {''})
+        lsuffix (str): Suffix for the left attributes (default: {''})
+        rsuffix (str): Suffix for the aggregates (default: {''})
+
+    Returns:
+        (obj): The GeoDataFrame with the left features and their aggregates.
+    """
+    result, names = _renamed(left, left_rows, lprefix, lsuffix)
+    for column, values in aggregates.items():
+        name = rprefix + column + rsuffix
+        while name in names:
+            name += '_right'
+        result.add_column(name, np.asarray(values))
+        names.add(name)
+    return result
+
+
+def _renamed(gdf, rows, prefix, suffix):
+    """Selects rows of a GeoDataFrame and renames its attributes; returns the result and the names of its columns."""
+    result = take(gdf, rows)
+    names = {'geometry'}
+    for column in gdf.get_column_names():
+        if column == 'geometry':
+            continue
+        name = prefix + column + suffix
+        if name != column:
+            result.rename(column, name)
+        names.add(name)
+    return result, names
+
+
+def _with_missing(values, valid):
+    """Expands the values of the matched rows to all rows, with missing values for the rest; missing values of the matched rows are kept."""
+    values = np.ma.asarray(values)
+    if values.dtype.kind in 'biufcmM':
+        if valid.all():
+            return values
+        result = np.ma.masked_all(len(valid), dtype=values.dtype)
+    else:
+        values = np.ma.filled(values.astype(object), None)
+        if valid.all():
+            return values
+        result = np.full(len(valid), None, dtype=object)
+    result[valid] = values
+    return result
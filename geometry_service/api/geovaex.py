@@ -1,15 +1,35 @@
 import geovaex as gvx
 import pygeos as pg
+import numpy as np
 from uuid import uuid4
+from shutil import rmtree
+from functools import reduce
+from concurrent.futures import ThreadPoolExecutor
 import os
 from geometry_service.exceptions import GeometryNotFound, ResultedEmptyDataFrame
+from .cache import ConversionCache
+from .index import SpatialIndex, ChunkIndex, hilbert_keys, total_bounds as index_total_bounds
+from .predicates import PreparedQuery, read_queries
+from .spatial_join import SWAPPED_PREDICATES, join_pairs, nearest_pairs, join_rows, join_out_of_core, estimate_memory, Aggregator, aggregate_values, aggregate_rows
+from .planner import statistics, plan_join, prefilter
+from .chunked import apply as apply_constructive, apply_levels
+from .parallel import parallelism
+from .crs import transform
+from .layers import Pinned
+from .geometries import DEFAULT_CHUNK_SIZE, OUTPUT_FORMATS, export as export_gdf, bounds, take, to_pygeos, to_geojson, total_bounds, export_arrow, add_bbox_columns, bbox_mask, join_frames, aggregate_frame
+
+# How the levels of a multi-resolution simplification are exported.
+PYRAMIDS = ['archive', 'column']
 
 class GeoVaex:
     """Class to interact with geovaex."""
 
-    def __init__(self, path, working_dir, crs=None, read_options={}):
+    def __init__(self, path, working_dir, crs=None, read_options={}, cache=True, arrow_file=None, sort=None, output_format='native', dataset=False):
         """Reads spatial file for further processing.
 
+        The converted Arrow file is looked up in the conversion cache; the spatial file is extracted and converted
+        only in case of a cache miss. An already converted Arrow file (e.g. of a registered dataset) is opened directly.
+
         Arguments:
             path (str): Full path of the spatial file.
             working_dir (str): Full path of the working path.
@@ -17,20 +37,42 @@ class GeoVaex:
         Keyword Arguments:
             crs (str): Native CRS of the spatial file (default: {None})
             read_options (dict): Read options for CSV files (default: {{}})
+            cache (bool): Whether to use the conversion cache (default: {True})
+            arrow_file (str): Full path of the converted file, when the cache is not used (default: {None})
+            sort (bool): Whether to sort the rows along a Hilbert curve during conversion; by default, only cached conversions are sorted, unless environment variable SPATIAL_SORT is false (default: {None})
+            output_format (str): The format of the exported files, one of 'native' (the format of the spatial file), 'geoparquet', 'arrow', 'flatgeobuf' (default: {'native'})
+            dataset (bool): Whether the path is an already converted Arrow file, with its metadata next to it, e.g. of a registered dataset (default: {False})
         """
-        path = self._extract_file(path, working_dir)
-        filename = os.path.splitext(os.path.basename(path))
-        extension = filename[1]
-        filename = filename[0]
-        arrow_file = os.path.join(working_dir, filename + str(uuid4()) + '.arrow')
-        self._gdf = gvx.read_file(path, convert=arrow_file, crs=crs, **read_options)
-        try:
-            self._driver = self._gdf.metadata['driver']
-        except AttributeError:
-            raise GeometryNotFound('Geometry not recognized.')
-        self._filename = filename
-        self._extension = extension
+        if output_format != 'native' and output_format not in OUTPUT_FORMATS:
+            raise ValueError("output_format could be one of {formats}.".format(formats=', '.join(['native'] + list(OUTPUT_FORMATS))))
+        if dataset:
+            arrow_file = path
+            meta = self._read_metadata(arrow_file)
+        else:
+            cache = ConversionCache() if cache else None
+            if cache is not None and cache.enabled:
+                if sort is None:
+                    sort = os.getenv('SPATIAL_SORT', 'true').lower() != 'false'
+                key = cache.key(path, crs=crs, read_options={**read_options, 'sort': sort})
+                entry = cache.lookup(key)
+                if entry is None:
+                    entry = cache.store(key, lambda arrow_file: self._convert(path, arrow_file, working_dir, crs, read_options, sort=sort))
+                arrow_file, meta = entry
+            else:
+                if arrow_file is None:
+                    arrow_file = os.path.join(working_dir, self._split_filename(path)[0] + str(uuid4()) + '.arrow')
+                meta = self._convert(path, arrow_file, working_dir, crs, read_options, sort=bool(sort))
+                self._write_metadata(arrow_file, meta)
+        self._gdf = gvx.open(arrow_file)
+        self._index = SpatialIndex.open(arrow_file)
+        self._chunks = ChunkIndex.open(arrow_file)
+        self._arrow_file = arrow_file
+        self._driver = meta['driver']
+        self._filename = meta['filename']
+        self._extension = meta['extension']
+        self._output_format = output_format
         self._working_dir = working_dir
+        self._plan = None
 
 
     @property
@@ -39,9 +81,43 @@ class GeoVaex:
         return self._gdf
 
 
+    @property
+    def driver(self):
+        """The driver of the source file."""
+        return self._driver
+
+
+    @property
+    def arrow_file(self):
+        """The converted (Arrow) file."""
+        return self._arrow_file
+
+
+    @property
+    def index(self):
+        """The spatial index of the converted file, or None if not available."""
+        return self._index
+
+
+    @property
+    def plan(self):
+        """The plan of the last spatial join, or None."""
+        return self._plan
+
+
+    @property
+    def total_bounds(self):
+        """The bounds of the dataset as [minx, miny, maxx, maxy]."""
+        if self._index is not None:
+            return self._index.total_bounds
+        return total_bounds(self._gdf)
+
+
     def constructive(self, action, *args, **kwargs):
         """Performs a constructive operation and exports to a spatial file.
 
+        Large datasets are processed in parallel chunks (see :mod:`chunked`), using up to the configured parallelism.
+
         Arguments:
             action (str): The constructive operation.
             *args: Additional arguments for the constructive operation.
@@ -50,78 +126,578 @@ class GeoVaex:
         Returns:
             (str): The path of the exported archive.
         """
-        gdf = getattr(self._gdf.constructive, action)(*args, **kwargs)
-        export = os.path.join(self._working_dir, "{filename}_{action}{extension}".format(filename=self._filename, action=action, extension=self._extension))
-        gdf.export(export, driver=self._driver)
+        return self._construct([(action, args, kwargs)], action)
+
+
+    def pipeline(self, steps):
+        """Performs a sequence of constructive operations and exports the final result to a spatial file.
+
+        Arguments:
+            steps (list): The (action, args, kwargs) of each operation (see :func:`chunked.read_steps`).
+
+        Returns:
+            (str): The path of the exported archive.
+        """
+        return self._construct(steps, 'pipeline')
+
+
+    def simplify_levels(self, tolerances, preserve_topology=False, pyramid='archive'):
+        """Simplifies the geometries at several tolerances in a single pass, and exports all the levels.
+
+        Arguments:
+            tolerances (list): The tolerances, in increasing order.
+
+        Keyword Arguments:
+            preserve_topology (bool): Whether to avoid creating invalid geometries (default: {False})
+            pyramid (str): 'archive' exports each level to its own file, named after its index and tolerance, 'column' all the levels to a single file with a *level* column holding the tolerance (default: {'archive'})
+
+        Returns:
+            (str): The path of the exported archive.
+        """
+        if pyramid not in PYRAMIDS:
+            raise ValueError("pyramid could be one of {pyramids}.".format(pyramids=', '.join(PYRAMIDS)))
+        parts_dir = os.path.join(self._working_dir, 'constructive_' + str(uuid4()))
+        try:
+            levels = apply_levels(self._gdf, self._arrow_file, tolerances, parts_dir, preserve_topology=preserve_topology, level_column=pyramid == 'column')
+            if pyramid == 'column':
+                export = os.path.join(self._working_dir, "{filename}_simplify{extension}".format(filename=self._filename, extension=self._output_extension))
+                self._export(reduce(lambda gdf, other: gdf.concat(other), levels), export)
+            else:
+                export = os.path.join(self._working_dir, "{filename}_simplify".format(filename=self._filename))
+                os.makedirs(export, exist_ok=True)
+                # The level index keeps the names unique, since close tolerances may format the same.
+                paths = [os.path.join(export, "{filename}_{level}_{tolerance:g}{extension}".format(filename=self._filename, level=level, tolerance=tolerance, extension=self._output_extension))
+                    for level, tolerance in enumerate(tolerances)]
+                # The levels are written concurrently.
+                with ThreadPoolExecutor(max_workers=min(parallelism(), len(levels))) as executor:
+                    list(executor.map(lambda item: self._export(*item), zip(levels, paths)))
+        finally:
+            rmtree(parts_dir, ignore_errors=True)
 
         return self._compress_files(export)
 
 
-    def filter_(self, action, wkt, **kwargs):
+    def _construct(self, steps, name):
+        """Applies constructive operations, in parallel chunks for large datasets, and exports the result.
+
+        Arguments:
+            steps (list): The (action, args, kwargs) of each operation.
+            name (str): The name of the operation, added to the exported filename.
+
+        Returns:
+            (str): The path of the exported archive.
+        """
+        parts_dir = os.path.join(self._working_dir, 'constructive_' + str(uuid4()))
+        try:
+            gdf = apply_constructive(self._gdf, self._arrow_file, steps, parts_dir)
+            export = os.path.join(self._working_dir, "{filename}_{name}{extension}".format(filename=self._filename, name=name, extension=self._output_extension))
+            self._export(gdf, export)
+        finally:
+            rmtree(parts_dir, ignore_errors=True)
+
+        return self._compress_files(export)
+
+
+    def filter_(self, action, wkt, output='file', limit=10, **kwargs):
         """Performs a filtering predicate operation and export to a spatial file.
 
         Arguments:
             action (str): The filtering action, one of 'nearest', 'within', 'within_buffer'.
             wkt (str): Well-Known Text representation of the geometry.
-            **kwargs: Additional keyword arguments for the filtering operation.
+            **kwargs: Additional keyword arguments for the filtering operation; 'k' and 'maximum_distance' for 'nearest', 'radius' and 'method' for 'within_buffer'.
+
+        Keyword Arguments:
+            output (str): 'file' exports the result, while 'count' and 'summary' only summarize it (default: {'file'})
+            limit (int): The number of features included in the summary (default: {10})
 
         Returns:
-            (str): The path of the exported archive.
+            (str|dict): The path of the exported archive, or the summary of the result.
         """
         gdf = self._gdf
         if action == 'nearest':
-            # k = kwargs.pop('k', 1)
-            # maximum_distance = kwargs.pop('maximum_distance', None)
-            # if maximum_distance is not None:
-            #     buffer = pg.buffer(pg.from_wkt(wkt), maximum_distance)
-            #     gdf = gdf[gdf.predicates.within(buffer)]
-            distance = gdf.measurement.distance(wkt)
+            rows, distance = self._nearest(wkt, k=kwargs.pop('k', None), maximum_distance=kwargs.pop('maximum_distance', None))
+            gdf = take(gdf, rows)
             gdf.add_column('distance', distance, dtype=float)
-            gdf = gdf.sort('distance', ascending=False)
         elif action == 'within':
-            gdf = gdf[gdf.predicates.within(wkt)]
+            gdf = take(gdf, self._within(PreparedQuery(pg.from_wkt(wkt))))
         elif action == 'within_buffer':
             radius = kwargs.pop('radius', 0)
-            buffer = pg.buffer(pg.from_wkt(wkt), radius)
-            gdf = gdf[gdf.predicates.within(buffer)]
+            method = kwargs.pop('method', None) or 'distance'
+            gdf = take(gdf, self._within_buffer(pg.from_wkt(wkt), radius, method=method))
         else:
             raise ValueError("action could be one of 'nearest', 'within', 'within_buffer'.")
+        if output != 'file':
+            return self._summary(gdf, output, limit=limit)
         if len(gdf) == 0:
             raise ResultedEmptyDataFrame("The resulted dataframe is empty.")
-        export = os.path.join(self._working_dir, "{filename}_{action}{extension}".format(filename=self._filename, action=action, extension=self._extension))
-        gdf.export(export, driver=self._driver)
+        export = os.path.join(self._working_dir, "{filename}_{action}{extension}".format(filename=self._filename, action=action, extension=self._output_extension))
+        self._export(gdf, export)
+
+        return self._compress_files(export)
+
+
+    def filter_batch(self, queries, predicate='within', layout='split', output='file', limit=10):
+        """Filters the features against many query geometries in a single pass, and exports to spatial file(s).
+
+        An R-tree is built over the query geometries, and each chunk of candidate features is matched against all
+        of them at once.
+
+        Arguments:
+            queries (str): The query geometries, as a GeoJSON FeatureCollection or a list of Well-Known-Text geometries.
+
+        Keyword Arguments:
+            predicate (str): The predicate that features should satisfy with a query geometry, one of 'within', 'intersects' (default: {'within'})
+            layout (str): 'split' exports one file per query, 'column' exports a single file with the id of the matched query in column *query_id* (default: {'split'})
+            output (str): 'file' exports the result, while 'count' and 'summary' only summarize it, along with the number of features matching each query (default: {'file'})
+            limit (int): The number of features included in the summary (default: {10})
+
+        Returns:
+            (str|dict): The path of the exported archive, or the summary of the result.
+        """
+        import re
+        ids, geometries = read_queries(queries)
+        tree = pg.STRtree(geometries)
+        rows = self._candidate_rows(index_total_bounds(pg.bounds(geometries)), within=predicate == 'within')
+        features, matches = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for start in range(0, len(rows), DEFAULT_CHUNK_SIZE):
+            chunk = rows[start:start + DEFAULT_CHUNK_SIZE]
+            feature, query = tree.query_bulk(to_pygeos(take(self._gdf, chunk)), predicate=predicate)
+            features.append(chunk[feature])
+            matches.append(query)
+        features, matches = np.concatenate(features), np.concatenate(matches)
+        if output != 'file':
+            order = np.lexsort((matches, features))
+            gdf = take(self._gdf, features[order])
+            gdf.add_column('query_id', np.array([str(ids[query]) for query in matches[order]]))
+            summary = self._summary(gdf, output, limit=limit)
+            summary['queries'] = {str(ids[query]): int(count) for query, count in zip(*np.unique(matches, return_counts=True))}
+            return summary
+        if len(features) == 0:
+            raise ResultedEmptyDataFrame("The resulted dataframe is empty.")
+        export = os.path.join(self._working_dir, "{filename}_batch".format(filename=self._filename))
+        if layout == 'column':
+            order = np.lexsort((matches, features))
+            gdf = take(self._gdf, features[order])
+            gdf.add_column('query_id', np.array([str(ids[query]) for query in matches[order]]))
+            export += self._output_extension
+            self._export(gdf, export)
+        else:
+            os.makedirs(export)
+            for query in np.unique(matches):
+                name = re.sub(r'[^\w.-]', '_', str(ids[query]))
+                gdf = take(self._gdf, np.sort(features[matches == query]))
+                self._export(gdf, os.path.join(export, "{filename}_{query}{extension}".format(filename=self._filename, query=name, extension=self._output_extension)))
 
         return self._compress_files(export)
 
 
-    def join(self, other, predicate, crs=None, read_options={}, how="left", **kwargs):
+    def filter_isochrones(self, isochrones, origin_ids, bands, output='file', limit=10):
+        """Classifies the features in travel bands from many origins in a single pass, and exports to a spatial file.
+
+        Each feature lying within an isochrone is assigned, for each origin, the smallest band whose isochrone
+        contains it; a feature reachable from several origins is repeated once per origin.
+
+        Arguments:
+            isochrones (ndarray): Array of shape (origins, bands) with the isochrones, in the CRS of the dataset.
+            origin_ids (list): The id of each origin, stored in column *origin_id*.
+            bands (list): The contour of each band in ascending order, stored in column *band*.
+
+        Keyword Arguments:
+            output (str): 'file' exports the result, while 'count' and 'summary' only summarize it (default: {'file'})
+            limit (int): The number of features included in the summary (default: {10})
+
+        Returns:
+            (str|dict): The path of the exported archive, or the summary of the result.
+        """
+        geometries = np.asarray(isochrones, dtype=object).ravel()
+        tree = pg.STRtree(geometries)
+        rows = self._candidate_rows(index_total_bounds(pg.bounds(geometries)), within=True)
+        features, matches = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for start in range(0, len(rows), DEFAULT_CHUNK_SIZE):
+            chunk = rows[start:start + DEFAULT_CHUNK_SIZE]
+            feature, query = tree.query_bulk(to_pygeos(take(self._gdf, chunk)), predicate='within')
+            features.append(chunk[feature])
+            matches.append(query)
+        features, matches = np.concatenate(features), np.concatenate(matches)
+        origins, bands_ = np.divmod(matches, len(bands))
+        # Keep the smallest band of each (feature, origin) pair.
+        order = np.lexsort((bands_, origins, features))
+        features, origins, bands_ = features[order], origins[order], bands_[order]
+        first = np.ones(len(features), dtype=bool)
+        first[1:] = (features[1:] != features[:-1]) | (origins[1:] != origins[:-1])
+        features, origins, bands_ = features[first], origins[first], bands_[first]
+        gdf = take(self._gdf, features)
+        if len(gdf) > 0:
+            gdf.add_column('origin_id', np.array([str(origin_ids[origin]) for origin in origins]))
+            gdf.add_column('band', np.asarray(bands, dtype=np.float64)[bands_])
+        if output != 'file':
+            return self._summary(gdf, output, limit=limit)
+        if len(gdf) == 0:
+            raise ResultedEmptyDataFrame("The resulted dataframe is empty.")
+        export = os.path.join(self._working_dir, "{filename}_travel{extension}".format(filename=self._filename, extension=self._output_extension))
+        self._export(gdf, export)
+
+        return self._compress_files(export)
+
+
+    def join(self, other, predicate, crs=None, read_options={}, how="left", output='file', limit=10, aggregates=None, dataset=False, **kwargs):
         """Perform a spatial join with the 'other' spatial file.
 
+        The strategy is planned from the statistics of both datasets (see :mod:`planner`), and the plan is kept in
+        :attr:`plan`. Joins estimated to exceed the memory budget (environment variable JOIN_MEMORY_BUDGET) are
+        performed out of core.
+
         Arguments:
-            other (str): Path of the 'other' spatial file.
-            predicate (str): Predicate for the spatial join, one of 'containts', 'within', 'intersects', 'dwithin'.
+            other (str|Pinned): Path of the 'other' spatial file, or a pinned layer.
+            predicate (str): Predicate for the spatial join, one of 'containts', 'within', 'intersects', 'dwithin', 'nearest'.
             **kwargs: Additional keyword arguments for the spatial join.
 
         Keyword Arguments:
             crs (str): Native CRS for the other spatial file (default: {None})
             read_options (dict): Read options in case the 'other' file is CSV (default: {{}})
             how (str): how to join, 'left' keeps all rows on the left, and adds columns (with possible missing values) 'right' is similar with self and other swapped. 'inner' will only return rows which overlap. (default: {"left"})
+            output (str): 'file' exports the result, while 'count' and 'summary' only summarize it (default: {'file'})
+            limit (int): The number of features included in the summary (default: {10})
+            k (int): For 'nearest' joins, the number of nearest right features joined to each left feature, along with their *distance* (default: {1})
+            maximum_distance (float): For 'nearest' joins, the maximum distance of the joined features (default: {None})
+            aggregates (list): The (column, function) pairs of an aggregate join, which returns each left feature with the number of its matches and the aggregates of their columns, instead of one row per pair (default: {None})
+            dataset (bool): Whether the 'other' file is the converted file of a registered dataset (default: {False})
 
         Returns:
-            (str) The path of the exported archive.
+            (str|dict) The path of the exported archive, or the summary of the result.
         """
-        gdf = self._gdf
-        other = GeoVaex(other, self._working_dir, crs=crs, read_options=read_options).gdf
+        pinned = other if isinstance(other, Pinned) else None
+        if pinned is not None:
+            other = GeoVaex(pinned.arrow_file, self._working_dir, dataset=True)
+        else:
+            other = GeoVaex(other, self._working_dir, crs=crs, read_options=read_options, dataset=dataset)
         distance = kwargs.pop('distance', None)
-        gdf = gdf.sjoin(other, how=how, op=predicate, distance=distance, allow_duplication=True, **kwargs)
-        if len(gdf) == 0:
-            raise ResultedEmptyDataFrame("The resulted dataframe is empty.")
-        export = os.path.join(self._working_dir, "{filename}_sjoin_{predicate}{extension}".format(filename=self._filename, predicate=predicate, extension=self._extension))
-        gdf.export(export, driver=self._driver)
+        k = kwargs.pop('k', None) or 1
+        maximum_distance = kwargs.pop('maximum_distance', None)
+        if aggregates is not None:
+            if how == 'right':
+                raise ValueError("Aggregate joins keep the left features; 'how' should be 'left' or 'inner'.")
+            aggregate_values(other.gdf, np.empty(0, dtype=np.int64), [column for column, _ in aggregates])
+        same_crs = self._gdf.geometry.crs == other.gdf.geometry.crs
+        estimate = estimate_memory(self._arrow_file, other.arrow_file) if same_crs and pinned is None and predicate != 'nearest' else 0
+        plan = self._plan = plan_join(statistics(self._gdf, index=self._index), statistics(other.gdf, index=other.index), predicate, distance=distance,
+            pinned=pinned is not None, same_crs=same_crs, aggregate=aggregates is not None, estimate=estimate)
+        spill_dir = None
+        if plan['strategy'] == 'legacy':
+            # The partitioned engine needs both sides in the same CRS.
+            if len(self._gdf) == 0 or len(other.gdf) == 0:
+                if output != 'file':
+                    return self._summary(take(self._gdf, []), output, limit=limit)
+                raise ResultedEmptyDataFrame("The resulted dataframe is empty.")
+            gdf = self._gdf.sjoin(other.gdf, how=how, op=predicate, distance=distance, allow_duplication=True, **kwargs)
+        elif plan['strategy'] == 'out_of_core':
+            # Out-of-core join; the parts of the result are removed once exported.
+            spill_dir = os.path.join(self._working_dir, 'sjoin_' + str(uuid4()))
+            gdf = join_out_of_core(self._gdf, other.gdf, predicate, spill_dir, estimate, how=how, distance=distance, aggregates=aggregates, **kwargs)
+        else:
+            if same_crs:
+                right, right_bounds = pinned or other.arrow_file, None
+            else:
+                right = transform(to_pygeos(other.gdf), other.gdf.geometry.crs, self._gdf.geometry.crs)
+                right_bounds = pg.bounds(right)
+            if plan['strategy'] == 'nearest':
+                left_rows, right_rows, distances = nearest_pairs(self._arrow_file, right, len(self._gdf), k=k, max_distance=maximum_distance)
+            else:
+                broadcast = plan['strategy'] == 'broadcast'
+                left_bounds = prefilter(self._item_bounds(), plan, 'left', distance=distance)
+                if right_bounds is None and pinned is None:
+                    right_bounds = other._item_bounds()
+                right_bounds = prefilter(right_bounds, plan, 'right')
+                if plan['swapped']:
+                    # The pairs of the swapped join are mapped back to the original sides.
+                    right_rows, left_rows = join_pairs(right, self._arrow_file, right_bounds, left_bounds, SWAPPED_PREDICATES[predicate], distance=distance, broadcast=broadcast)
+                    order = np.lexsort((right_rows, left_rows))
+                    left_rows, right_rows = left_rows[order], right_rows[order]
+                else:
+                    left_rows, right_rows = join_pairs(self._arrow_file, right, left_bounds, right_bounds, predicate, distance=distance, broadcast=broadcast)
+                distances = None
+            if aggregates is None:
+                rows = join_rows(left_rows, right_rows, len(self._gdf), len(other.gdf), how=how, distances=distances)
+                gdf = join_frames(self._gdf, other.gdf, rows[0], rows[1], how=how, distances=rows[2] if distances is not None else None, **kwargs)
+            else:
+                aggregator = Aggregator(len(self._gdf), aggregates)
+                aggregator.update(left_rows, aggregate_values(other.gdf, right_rows, aggregator.columns))
+                rows = aggregate_rows(aggregator, how=how)
+                gdf = aggregate_frame(self._gdf, rows, aggregator.result(rows), **kwargs)
+        try:
+            if output != 'file':
+                return self._summary(gdf, output, limit=limit)
+            if len(gdf) == 0:
+                raise ResultedEmptyDataFrame("The resulted dataframe is empty.")
+            export = os.path.join(self._working_dir, "{filename}_sjoin_{predicate}{extension}".format(filename=self._filename, predicate=predicate, extension=self._output_extension))
+            self._export(gdf, export)
+        finally:
+            if spill_dir is not None:
+                rmtree(spill_dir, ignore_errors=True)
 
         return self._compress_files(export)
 
 
+    def _item_bounds(self):
+        """The bounds of each feature, as array of shape (N, 4)."""
+        if self._index is not None:
+            return self._index.item_bounds()
+        return bounds(self._gdf)
+
+
+    @property
+    def _output_extension(self):
+        """The extension of the exported files."""
+        return OUTPUT_FORMATS.get(self._output_format, self._extension)
+
+
+    def _export(self, gdf, path):
+        """Exports a resulted GeoDataFrame in the requested output format."""
+        export_gdf(gdf, path, output_format=self._output_format, driver=self._driver)
+
+
+    @staticmethod
+    def _summary(gdf, output, limit=10):
+        """Summarizes a resulted GeoDataFrame, without exporting it.
+
+        Arguments:
+            gdf (obj): The resulted GeoDataFrame.
+            output (str): 'count' for the number of features and their bounding box, 'summary' to include the first features as well.
+
+        Keyword Arguments:
+            limit (int): The number of features included in the summary (default: {10})
+
+        Returns:
+            (dict): The summary.
+        """
+        summary = {'count': len(gdf), 'bounds': None}
+        if len(gdf) > 0:
+            bounds_ = total_bounds(gdf)
+            if not np.isnan(bounds_).any():
+                summary['bounds'] = [float(value) for value in bounds_]
+        if output == 'summary':
+            summary['features'] = to_geojson(gdf[:limit or 0])
+        return summary
+
+
+    def _candidate_rows(self, bounds, within=False):
+        """Selects the rows of the features whose bounding box intersects (or lies within) the given one.
+
+        The spatial index narrows down the rows to examine, and the bounding box columns are then tested with a
+        vectorized comparison, so that only the surviving geometries need to be decoded and tested exactly.
+
+        Arguments:
+            bounds (list): The bounds as [minx, miny, maxx, maxy].
+
+        Keyword Arguments:
+            within (bool): Whether the bounding boxes should lie within the given one (default: {False})
+
+        Returns:
+            (ndarray): The sorted row numbers of the candidate features.
+        """
+        if self._index is not None:
+            rows = self._index.query(bounds)
+        elif self._chunks is not None:
+            rows = self._chunks.rows(bounds)
+        else:
+            rows = np.arange(len(self._gdf))
+        if len(rows) == 0:
+            return rows
+        mask = bbox_mask(take(self._gdf, rows), bounds, within=within)
+        if mask is not None:
+            rows = rows[np.asarray(mask, dtype=bool)]
+        return rows
+
+
+    def _within(self, query):
+        """Finds the features that lie within a query geometry.
+
+        Arguments:
+            query (PreparedQuery): The prepared query geometry.
+
+        Returns:
+            (ndarray): The sorted row numbers of the features.
+        """
+        rows = self._candidate_rows(pg.bounds(query.geometry), within=True)
+        mask = np.zeros(len(rows), dtype=bool)
+        for start in range(0, len(rows), DEFAULT_CHUNK_SIZE):
+            chunk = rows[start:start + DEFAULT_CHUNK_SIZE]
+            mask[start:start + len(chunk)] = query.within(to_pygeos(take(self._gdf, chunk)))
+        return rows[mask]
+
+
+    def _within_buffer(self, geometry, radius, method='distance'):
+        """Finds the features that lie within a radius from a geometry.
+
+        With the 'buffer' method, the features are tested against the buffer of the geometry. With the 'distance'
+        method, the candidates are selected with the box of the geometry expanded by the radius, and points are
+        tested with their exact distance from the geometry; the buffer is built only if other geometries remain,
+        since containment in the buffer cannot be decided by a single distance.
+
+        Arguments:
+            geometry (obj): The pygeos geometry.
+            radius (float): The radius.
+
+        Keyword Arguments:
+            method (str): One of 'distance', 'buffer' (default: {'distance'})
+
+        Returns:
+            (ndarray): The sorted row numbers of the features.
+        """
+        if method == 'buffer':
+            return self._within(PreparedQuery(pg.buffer(geometry, radius)))
+        if method != 'distance':
+            raise ValueError("method could be one of 'distance', 'buffer'.")
+        rows = self._candidate_rows(pg.bounds(geometry) + np.array([-radius, -radius, radius, radius]), within=True)
+        buffer = None
+        mask = np.zeros(len(rows), dtype=bool)
+        for start in range(0, len(rows), DEFAULT_CHUNK_SIZE):
+            chunk = rows[start:start + DEFAULT_CHUNK_SIZE]
+            geometries = to_pygeos(take(self._gdf, chunk))
+            points = pg.get_type_id(geometries) == 0
+            with np.errstate(invalid='ignore'):
+                mask[start:start + len(chunk)][points] = pg.distance(geometries[points], geometry) <= radius
+            others = np.nonzero(~points & ~pg.is_empty(geometries))[0]
+            if len(others) > 0:
+                if buffer is None:
+                    buffer = PreparedQuery(pg.buffer(geometry, radius))
+                mask[start + others] = buffer.within(geometries[others])
+        return rows[mask]
+
+
+    def _nearest(self, wkt, k=None, maximum_distance=None):
+        """Finds the features nearest to a geometry.
+
+        When k is given, the spatial index is searched best-first, so that only the geometries of a few leaf nodes
+        are decoded; without an index, the k smallest distances are selected with a partial sort.
+
+        Arguments:
+            wkt (str): Well-Known Text representation of the geometry.
+
+        Keyword Arguments:
+            k (int): The number of features to find; all the features if not given (default: {None})
+            maximum_distance (float): The maximum distance of the features (default: {None})
+
+        Returns:
+            (tuple): Two arrays with the row numbers of the features and their distances, in ascending order of distance.
+        """
+        geometry = pg.from_wkt(wkt)
+        if k is not None and self._index is not None:
+            measure = lambda rows: pg.distance(to_pygeos(take(self._gdf, rows)), geometry)
+            return self._index.nearest(pg.bounds(geometry), measure, k=k, max_distance=maximum_distance)
+        if maximum_distance is not None:
+            rows = self._candidate_rows(pg.bounds(geometry) + np.array([-maximum_distance, -maximum_distance, maximum_distance, maximum_distance]))
+        else:
+            rows = np.arange(len(self._gdf))
+        distance = np.asarray(pg.distance(to_pygeos(take(self._gdf, rows)), geometry), dtype=np.float64) if len(rows) > 0 else np.empty(0)
+        keep = ~np.isnan(distance)
+        if maximum_distance is not None:
+            keep &= distance <= maximum_distance
+        rows, distance = rows[keep], distance[keep]
+        if k is not None and k < len(distance):
+            nearest = np.argpartition(distance, k - 1)[:k]
+            rows, distance = rows[nearest], distance[nearest]
+        order = np.argsort(distance, kind='stable')
+        return rows[order], distance[order]
+
+
+    def _convert(self, path, arrow_file, working_dir, crs, read_options, sort=False):
+        """Extracts and converts a spatial file to Arrow.
+
+        The bounding box of each geometry is stored in hidden columns and, along with the Arrow file, the spatial
+        index and the bounds of each chunk of rows are persisted. When requested, the rows are sorted by the Hilbert
+        value of the center of their bounding box, so that spatially close features are stored close together.
+
+        Arguments:
+            path (str): Full path of the spatial file.
+            arrow_file (str): Full path of the resulted Arrow file.
+            working_dir (str): Full path of the working path.
+            crs (str): Native CRS of the spatial file.
+            read_options (dict): Read options for CSV files.
+
+        Keyword Arguments:
+            sort (bool): Whether to sort the rows along a Hilbert curve (default: {False})
+
+        Raises:
+            GeometryNotFound: The geometry was not recognized.
+
+        Returns:
+            (dict): Metadata of the converted file.
+        """
+        filename, extension = self._split_filename(path)
+        path = self._extract_file(path, working_dir)
+        gdf = gvx.read_file(path, convert=arrow_file, crs=crs, **read_options)
+        try:
+            driver = gdf.metadata['driver']
+        except AttributeError:
+            raise GeometryNotFound('Geometry not recognized.')
+        bounds_ = bounds(gdf)
+        add_bbox_columns(gdf, bounds_)
+        if sort and len(gdf) > 1:
+            order = np.argsort(hilbert_keys(bounds_), kind='stable')
+            gdf = take(gdf, order)
+            bounds_ = bounds_[order]
+        temp_file = os.path.join(os.path.dirname(arrow_file), str(uuid4()) + '.arrow')
+        export_arrow(gdf, temp_file)
+        os.replace(temp_file, arrow_file)
+        SpatialIndex.build(bounds_).save(SpatialIndex.sidecar(arrow_file))
+        ChunkIndex.build(bounds_).save(ChunkIndex.sidecar(arrow_file))
+        return {'driver': driver, 'filename': filename, 'extension': extension, 'sorted': bool(sort)}
+
+
+    @staticmethod
+    def _metadata_file(arrow_file):
+        return os.path.splitext(arrow_file)[0] + '.json'
+
+
+    @classmethod
+    def _read_metadata(cls, arrow_file):
+        """Reads the metadata stored along with a converted file.
+
+        Arguments:
+            arrow_file (str): Full path of the converted file.
+
+        Returns:
+            (dict): The metadata.
+        """
+        import json
+        with open(cls._metadata_file(arrow_file)) as f:
+            return json.load(f)
+
+
+    @classmethod
+    def _write_metadata(cls, arrow_file, meta):
+        """Writes the metadata of a converted file.
+
+        Arguments:
+            arrow_file (str): Full path of the converted file.
+            meta (dict): The metadata.
+        """
+        import json
+        with open(cls._metadata_file(arrow_file), 'w') as f:
+            json.dump(meta, f)
+
+
+    @staticmethod
+    def _split_filename(file):
+        """Splits the name of a spatial file to filename and extension.
+
+        Compressed archives are named after the folder they are extracted to.
+
+        Arguments:
+            file (str): The full path of the file.
+
+        Returns:
+            (tuple): The filename and the extension.
+        """
+        import zipfile
+        import tarfile
+        filename = os.path.basename(file)
+        if os.path.isfile(file) and (tarfile.is_tarfile(file) or zipfile.is_zipfile(file)):
+            filename = os.path.splitext(filename)[0]
+        return os.path.splitext(filename)
+
+
     def _extract_file(self, file, extraction_dir):
         """Extracts a compressed archive.
 
@@ -29,6 +29,44 @@ def parse_read_options(form, prefix=''):
     return read_options
 
 
+def get_resource(form, session, field='resource', dataset_field='dataset'):
+    """Resolves the path of the spatial file a request refers to.
+
+    The spatial file could be uploaded (and saved in the session working path), a path relative to the input
+    directory, or a registered dataset.
+
+    Arguments:
+        form (obj): Form object
+        session (dict): Dictionary with session information.
+
+    Keyword Arguments:
+        field (str): The form field of the resource (default: {'resource'})
+        dataset_field (str): The form field of the registered dataset (default: {'dataset'})
+
+    Returns:
+        (tuple): The full path of the spatial file, and whether it is the converted file of a registered dataset.
+    """
+    from flask import request
+    from werkzeug.utils import secure_filename
+    from geometry_service.database.model import Dataset
+    from geometry_service.database.actions import db_add_queue_dataset
+    from geometry_service.exceptions import DBItemNotFound
+    if field in request.files.keys():
+        filename = secure_filename(getattr(form, field).data.filename)
+        file = os.path.join(session['working_path'], filename)
+        getattr(form, field).data.save(file)
+        return file, False
+    dataset_field = getattr(form, dataset_field, None)
+    if dataset_field is not None and dataset_field.data:
+        # The request is recorded as reader before the dataset is looked up, so that it cannot be deleted meanwhile.
+        db_add_queue_dataset(session['ticket'], dataset_field.data)
+        dataset = Dataset().get(key=dataset_field.data)
+        if dataset is None:
+            raise DBItemNotFound("Item with key '{}' not found in table dataset.".format(dataset_field.data))
+        return dataset['path'], True
+    return os.path.join(os.environ['INPUT_DIR'], getattr(form, field).data), False
+
+
 def send_file(file):
     """Create a send file response.
 
@@ -64,3 +102,26 @@ def copy_to_output(file, ticket):
     os.makedirs(full_output, exist_ok=True)
     copyfile(file, os.path.join(full_output, filename))
     return output_file
+
+def save_to_output(data, ticket, filename='result.json'):
+    """Save a JSON serializable result to output dir, after creating the containing path.
+
+    Arguments:
+        data (dict): The result.
+        ticket (str): Request ticket.
+
+    Keyword Arguments:
+        filename (str): The name of the file (default: {'result.json'})
+
+    Returns:
+        (str): Relative to output dir path of the saved file.
+    """
+    import json
+    from datetime import datetime
+    output_path = os.path.join(datetime.now().strftime("%y%m"),ticket)
+    output_file = os.path.join(output_path, filename)
+    full_output = os.path.join(os.environ['OUTPUT_DIR'], output_path)
+    os.makedirs(full_output, exist_ok=True)
+    with open(os.path.join(full_output, filename), 'w') as f:
+        json.dump(data, f)
+    return output_file
@@ -0,0 +1,494 @@
+"""Packed Hilbert R-tree spatial index, persisted next to the converted files.
+
+The index is a static R-tree built bottom-up: the bounding boxes of the features are sorted by the Hilbert value
+of their centers and packed into nodes of fixed size, level by level, up to the root. The whole tree is stored
+in a single ``.npy`` file, so that it can be memory-mapped instead of being read into memory.
+"""
+import os
+import heapq
+import numpy as np
+
+DEFAULT_NODE_SIZE = 16
+
+HILBERT_MAX = (1 << 16) - 1
+
+
+def hilbert_keys(bounds, extent=None):
+    """Computes the Hilbert curve value of the center of bounding boxes.
+
+    Centers are scaled to a 2^16 x 2^16 grid covering the given extent. Empty boxes (NaN bounds) are placed at the
+    end of the curve.
+
+    Arguments:
+        bounds (ndarray): Array of shape (N, 4) with the bounds of the boxes.
+
+    Keyword Arguments:
+        extent (list): The extent of the grid as [minx, miny, maxx, maxy] (default: {None}, the total bounds).
+
+    Returns:
+        (ndarray): The Hilbert values (uint32).
+    """
+    bounds = np.asarray(bounds, dtype=np.float64)
+    if extent is None:
+        extent = total_bounds(bounds)
+    minx, miny, maxx, maxy = extent
+    width = (maxx - minx) or 1.
+    height = (maxy - miny) or 1.
+    with np.errstate(invalid='ignore'):
+        cx = (bounds[:, 0] + bounds[:, 2]) / 2.
+        cy = (bounds[:, 1] + bounds[:, 3]) / 2.
+        x = np.clip(np.floor(HILBERT_MAX * (cx - minx) / width), 0, HILBERT_MAX)
+        y = np.clip(np.floor(HILBERT_MAX * (cy - miny) / height), 0, HILBERT_MAX)
+    empty = np.isnan(x) | np.isnan(y)
+    x = np.where(empty, 0, x).astype(np.uint32)
+    y = np.where(empty, 0, y).astype(np.uint32)
+    keys = _hilbert(x, y)
+    keys[empty] = np.iinfo(np.uint32).max
+    return keys
+
+
+def _hilbert(x, y):
+    """Hilbert curve value of integer coordinates in [0, 2^16).
+
+    Vectorized form of the branch-free algorithm by Fabian Giesen, as used in flatbush.
+    """
+    x = x.astype(np.uint32)
+    y = y.astype(np.uint32)
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+
+    A = a | (b >> 1)
+    B = (a >> 1) ^ a
+    C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+    D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 2)) ^ (b & (b >> 2))
+    B = (a & (b >> 2)) ^ (b & ((a ^ b) >> 2))
+    C = C ^ ((a & (c >> 2)) ^ (b & (d >> 2)))
+    D = D ^ ((b & (c >> 2)) ^ ((a ^ b) & (d >> 2)))
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 4)) ^ (b & (b >> 4))
+    B = (a & (b >> 4)) ^ (b & ((a ^ b) >> 4))
+    C = C ^ ((a & (c >> 4)) ^ (b & (d >> 4)))
+    D = D ^ ((b & (c >> 4)) ^ ((a ^ b) & (d >> 4)))
+
+    a, b, c, d = A, B, C, D
+    C = C ^ ((a & (c >> 8)) ^ (b & (d >> 8)))
+    D = D ^ ((b & (c >> 8)) ^ ((a ^ b) & (d >> 8)))
+
+    a = C ^ (C >> 1)
+    b = D ^ (D >> 1)
+
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+
+    i0 = (i0 | (i0 << 8)) & 0x00FF00FF
+    i0 = (i0 | (i0 << 4)) & 0x0F0F0F0F
+    i0 = (i0 | (i0 << 2)) & 0x33333333
+    i0 = (i0 | (i0 << 1)) & 0x55555555
+
+    i1 = (i1 | (i1 << 8)) & 0x00FF00FF
+    i1 = (i1 | (i1 << 4)) & 0x0F0F0F0F
+    i1 = (i1 | (i1 << 2)) & 0x33333333
+    i1 = (i1 | (i1 << 1)) & 0x55555555
+
+    return ((i1 << 1) | i0).astype(np.uint32)
+
+
+def total_bounds(bounds):
+    """Computes the total bounds of bounding boxes, ignoring empty ones.
+
+    Arguments:
+        bounds (ndarray): Array of shape (N, 4) with the bounds of the boxes.
+
+    Returns:
+        (list): The total bounds as [minx, miny, maxx, maxy], NaN if all boxes are empty.
+    """
+    bounds = np.asarray(bounds, dtype=np.float64)
+    valid = bounds[~np.isnan(bounds).any(axis=1)]
+    if len(valid) == 0:
+        return [np.nan] * 4
+    return [valid[:, 0].min(), valid[:, 1].min(), valid[:, 2].max(), valid[:, 3].max()]
+
+
+def _expand_ranges(starts, ends):
+    """Concatenates the integer ranges [start, end) into a single array."""
+    lengths = ends - starts
+    total = lengths.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.arange(total, dtype=np.int64) - offsets + np.repeat(starts, lengths)
+
+
+class SpatialIndex:
+    """Static packed Hilbert R-tree over the bounding boxes of a dataset.
+
+    The tree is kept in an array of shape (1 + nodes, 5); the first row is a header holding the node size and the
+    number of items, and each subsequent row holds the bounds of a node followed by either the row number of the
+    feature (leaves) or the position of its first child (internal nodes). Leaves come first, followed by each
+    upper level, with the root last.
+    """
+
+    def __init__(self, data):
+        """Wraps the array representation of a tree.
+
+        Arguments:
+            data (ndarray): The array representation of the tree.
+        """
+        self._data = data
+        self.node_size = int(data[0, 0])
+        self.num_items = int(data[0, 1])
+        self._boxes = data[1:, :4]
+        self._indices = data[1:, 4]
+        self._levels = self._level_bounds(self.num_items, self.node_size)
+
+
+    @staticmethod
+    def _level_bounds(num_items, node_size):
+        """Computes the end position of each level of the tree."""
+        levels = []
+        n = num_items
+        end = n
+        levels.append(end)
+        while n > 1:
+            n = int(np.ceil(n / node_size))
+            end += n
+            levels.append(end)
+        return levels
+
+
+    @classmethod
+    def build(cls, bounds, node_size=DEFAULT_NODE_SIZE):
+        """Builds the index.
+
+        Arguments:
+            bounds (ndarray): Array of shape (N, 4) with the bounds of each feature, in row order.
+
+        Keyword Arguments:
+            node_size (int): Maximum number of children of each node (default: {16})
+
+        Returns:
+            (SpatialIndex): The index.
+        """
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        num_items = len(bounds)
+        levels = cls._level_bounds(num_items, node_size)
+        data = np.empty((1 + levels[-1], 5), dtype=np.float64)
+        data[0] = [node_size, num_items, 0, 0, 0]
+        boxes = data[1:, :4]
+        indices = data[1:, 4]
+
+        order = np.argsort(hilbert_keys(bounds), kind='stable')
+        boxes[:num_items] = bounds[order]
+        indices[:num_items] = order
+
+        start = 0
+        for end, parent_end in zip(levels[:-1], levels[1:]):
+            children = boxes[start:end]
+            groups = np.arange(start, end, node_size)
+            with np.errstate(invalid='ignore'):
+                parents = np.column_stack([
+                    np.fmin.reduceat(children[:, 0], groups - start),
+                    np.fmin.reduceat(children[:, 1], groups - start),
+                    np.fmax.reduceat(children[:, 2], groups - start),
+                    np.fmax.reduceat(children[:, 3], groups - start)
+                ])
+            boxes[end:parent_end] = parents
+            indices[end:parent_end] = groups
+            start = end
+
+        return cls(data)
+
+
+    @classmethod
+    def load(cls, file):
+        """Loads a persisted index, memory-mapped.
+
+        Arguments:
+            file (str): The path of the index file.
+
+        Returns:
+            (SpatialIndex): The index.
+        """
+        return cls(np.load(file, mmap_mode='r'))
+
+
+    @classmethod
+    def open(cls, arrow_file):
+        """Loads the index persisted next to a converted file, if any.
+
+        Arguments:
+            arrow_file (str): Full path of the converted file.
+
+        Returns:
+            (SpatialIndex|None): The index, or None if no index has been persisted.
+        """
+        file = cls.sidecar(arrow_file)
+        if not os.path.isfile(file):
+            return None
+        return cls.load(file)
+
+
+    @staticmethod
+    def sidecar(arrow_file):
+        """The path of the index file for a converted file."""
+        return arrow_file + '.index.npy'
+
+
+    def save(self, file):
+        """Persists the index.
+
+        Arguments:
+            file (str): The path of the index file.
+        """
+        with open(file, 'wb') as f:
+            np.save(f, np.asarray(self._data))
+
+
+    def item_bounds(self):
+        """The bounds of each feature, in row order.
+
+        Returns:
+            (ndarray): Array of shape (N, 4).
+        """
+        bounds = np.empty((self.num_items, 4), dtype=np.float64)
+        bounds[self._indices[:self.num_items].astype(np.int64)] = self._boxes[:self.num_items]
+        return bounds
+
+
+    @property
+    def total_bounds(self):
+        """The bounds of the whole dataset as [minx, miny, maxx, maxy]."""
+        if self.num_items == 0:
+            return [np.nan] * 4
+        return self._boxes[self._levels[-1] - 1].tolist()
+
+
+    def query(self, bounds):
+        """Finds the features whose bounding box intersects the given one.
+
+        Arguments:
+            bounds (list): The query box as [minx, miny, maxx, maxy].
+
+        Returns:
+            (ndarray): The sorted row numbers of the candidate features.
+        """
+        queries, items = self.query_bulk(np.asarray(bounds, dtype=np.float64).reshape(1, 4))
+        return np.sort(items)
+
+
+    def query_bulk(self, bounds):
+        """Finds, for each given box, the features whose bounding box intersects it.
+
+        The tree is traversed level by level for all the boxes at once.
+
+        Arguments:
+            bounds (ndarray): Array of shape (M, 4) with the query boxes.
+
+        Returns:
+            (tuple): Two arrays with the positions of the query boxes and the row numbers of the candidate features, respectively.
+        """
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        if self.num_items == 0 or len(bounds) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        levels = self._levels
+        queries = np.arange(len(bounds), dtype=np.int64)
+        nodes = np.full(len(bounds), levels[-1] - 1, dtype=np.int64)
+        for level in range(len(levels) - 1, -1, -1):
+            boxes = self._boxes[nodes]
+            query_boxes = bounds[queries]
+            hit = (boxes[:, 0] <= query_boxes[:, 2]) & (boxes[:, 1] <= query_boxes[:, 3]) & \
+                (boxes[:, 2] >= query_boxes[:, 0]) & (boxes[:, 3] >= query_boxes[:, 1])
+            queries = queries[hit]
+            nodes = nodes[hit]
+            if level == 0:
+                return queries, self._indices[nodes].astype(np.int64)
+            starts = self._indices[nodes].astype(np.int64)
+            ends = np.minimum(starts + self.node_size, levels[level - 1])
+            queries = np.repeat(queries, ends - starts)
+            nodes = _expand_ranges(starts, ends)
+
+
+    def nearest(self, bounds, distance, k=1, max_distance=None):
+        """Finds the k nearest features to a geometry, with a best-first search.
+
+        Nodes are visited in increasing order of the distance between their box and the box of the geometry, which
+        is a lower bound of the distance to any feature below them. The exact distance is computed only for the
+        children of the visited leaf nodes.
+
+        Arguments:
+            bounds (list): The box of the geometry as [minx, miny, maxx, maxy].
+            distance (callable): Function computing the exact distance of the features with the given row numbers (ndarray) from the geometry.
+
+        Keyword Arguments:
+            k (int): The number of features to find (default: {1})
+            max_distance (float): The maximum distance of the features (default: {None})
+
+        Returns:
+            (tuple): Two arrays with the row numbers of the nearest features and their distances, in ascending order of distance.
+        """
+        rows, distances = [], []
+        if self.num_items == 0:
+            return np.array(rows, dtype=np.int64), np.array(distances, dtype=np.float64)
+        bounds = np.asarray(bounds, dtype=np.float64)
+        heap = []
+        self._push(heap, np.array([self._levels[-1] - 1]), bounds, max_distance)
+        while len(heap) > 0 and len(rows) < k:
+            dist, is_item, position = heapq.heappop(heap)
+            if is_item:
+                rows.append(position)
+                distances.append(dist)
+                continue
+            if position < self.num_items:
+                # The root is the single leaf of the tree.
+                children = np.array([position])
+            else:
+                start = int(self._indices[position])
+                end = min(start + self.node_size, self._levels[np.searchsorted(self._levels, start, side='right')])
+                children = np.arange(start, end)
+            if children[0] < self.num_items:
+                items = self._indices[children].astype(np.int64)
+                exact = np.asarray(distance(items), dtype=np.float64)
+                for row, dist in zip(items, exact):
+                    if not np.isnan(dist) and (max_distance is None or dist <= max_distance):
+                        heapq.heappush(heap, (float(dist), True, int(row)))
+            else:
+                self._push(heap, children, bounds, max_distance)
+        return np.array(rows, dtype=np.int64), np.array(distances, dtype=np.float64)
+
+
+    def _push(self, heap, nodes, bounds, max_distance):
+        """Pushes nodes to the search heap, with the distance of their box from the given box as priority."""
+        boxes = self._boxes[nodes]
+        dx = np.maximum(0., np.maximum(boxes[:, 0] - bounds[2], bounds[0] - boxes[:, 2]))
+        dy = np.maximum(0., np.maximum(boxes[:, 1] - bounds[3], bounds[1] - boxes[:, 3]))
+        for node, dist in zip(nodes, np.hypot(dx, dy)):
+            if not np.isnan(dist) and (max_distance is None or dist <= max_distance):
+                heapq.heappush(heap, (float(dist), False, int(node)))
+
+
+DEFAULT_CHUNK_ROWS = 65536
+
+
+class ChunkIndex:
+    """Bounding boxes of consecutive chunks of rows.
+
+    When the rows of a dataset are spatially ordered, the bounds of each chunk are tight, so that scans can skip
+    whole chunks not intersecting a query box. The table is kept in an array of shape (1 + chunks, 4); the first
+    row is a header holding the number of rows of each chunk and the total number of rows.
+    """
+
+    def __init__(self, data):
+        """Wraps the array representation of the table.
+
+        Arguments:
+            data (ndarray): The array representation of the table.
+        """
+        self.chunk_rows = int(data[0, 0])
+        self.num_rows = int(data[0, 1])
+        self._boxes = data[1:]
+
+
+    @classmethod
+    def build(cls, bounds, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """Builds the table.
+
+        Arguments:
+            bounds (ndarray): Array of shape (N, 4) with the bounds of each feature, in row order.
+
+        Keyword Arguments:
+            chunk_rows (int): The number of rows of each chunk (default: {65536})
+
+        Returns:
+            (ChunkIndex): The table.
+        """
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        starts = np.arange(0, len(bounds), chunk_rows)
+        data = np.empty((1 + len(starts), 4), dtype=np.float64)
+        data[0] = [chunk_rows, len(bounds), 0, 0]
+        if len(starts) > 0:
+            with np.errstate(invalid='ignore'):
+                data[1:] = np.column_stack([
+                    np.fmin.reduceat(bounds[:, 0], starts),
+                    np.fmin.reduceat(bounds[:, 1], starts),
+                    np.fmax.reduceat(bounds[:, 2], starts),
+                    np.fmax.reduceat(bounds[:, 3], starts)
+                ])
+        return cls(data)
+
+
+    @classmethod
+    def open(cls, arrow_file):
+        """Loads the table persisted next to a converted file, if any.
+
+        Arguments:
+            arrow_file (str): Full path of the converted file.
+
+        Returns:
+            (ChunkIndex|None): The table, or None if it has not been persisted.
+        """
+        file = cls.sidecar(arrow_file)
+        if not os.path.isfile(file):
+            return None
+        return cls(np.load(file, mmap_mode='r'))
+
+
+    @staticmethod
+    def sidecar(arrow_file):
+        """The path of the chunk table file for a converted file."""
+        return arrow_file + '.chunks.npy'
+
+
+    def save(self, file):
+        """Persists the table.
+
+        Arguments:
+            file (str): The path of the table file.
+        """
+        data = np.vstack([[self.chunk_rows, self.num_rows, 0, 0], np.asarray(self._boxes)])
+        with open(file, 'wb') as f:
+            np.save(f, data)
+
+
+    def ranges(self, bounds):
+        """Finds the chunks that intersect a box.
+
+        Arguments:
+            bounds (list): The query box as [minx, miny, maxx, maxy].
+
+        Returns:
+            (list): The (start, end) row ranges of the intersecting chunks, with adjacent chunks merged.
+        """
+        minx, miny, maxx, maxy = bounds
+        boxes = self._boxes
+        hit = np.nonzero((boxes[:, 0] <= maxx) & (boxes[:, 1] <= maxy) & (boxes[:, 2] >= minx) & (boxes[:, 3] >= miny))[0]
+        ranges = []
+        for chunk in hit:
+            start = int(chunk) * self.chunk_rows
+            end = min(start + self.chunk_rows, self.num_rows)
+            if len(ranges) > 0 and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+
+    def rows(self, bounds):
+        """Finds the rows of the chunks that intersect a box.
+
+        Arguments:
+            bounds (list): The query box as [minx, miny, maxx, maxy].
+
+        Returns:
+            (ndarray): The sorted row numbers.
+        """
+        ranges = self.ranges(bounds)
+        if len(ranges) == 0:
+            return np.empty(0, dtype=np.int64)
+        starts, ends = np.array(ranges, dtype=np.int64).T
+        return _expand_ranges(starts, ends)
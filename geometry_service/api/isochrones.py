@@ -0,0 +1,377 @@
+"""Cache of the isochrones computed by the router.
+
+Travel filters from the same origin, with the same costing and contour, need the same isochrone. The origin is
+snapped to a grid, so that nearby origins share an entry, and the isochrones are kept in a size-bounded LRU cache in
+memory, backed by a persistent tier on disk which is shared among workers and survives restarts. Entries expire
+after a configurable time, since the road network may change.
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from glob import glob
+from time import time
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pygeos as pg
+from geometry_service.loggers import logger
+from .valhalla import get_client
+
+DEFAULT_PRECISION = 4
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_DISK_ENTRIES = 10000
+DEFAULT_TTL = 24 * 3600
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_ORIGINS = 100
+
+
+class IsochroneCache:
+    """Two-tier (memory and disk) LRU cache of isochrones."""
+
+    def __init__(self, path=None, max_entries=None, max_disk_entries=None, ttl=None, precision=None):
+        """Initializes the cache.
+
+        Keyword Arguments:
+            path (str): The directory of the disk tier (default: {None}, environment variable ISOCHRONE_CACHE_DIR, or *isochrones* inside the conversion cache directory).
+            max_entries (int): The maximum number of isochrones kept in memory; zero disables the cache (default: {None}, environment variable ISOCHRONE_CACHE_SIZE).
+            max_disk_entries (int): The maximum number of isochrones kept on disk; zero disables the disk tier (default: {None}, environment variable ISOCHRONE_CACHE_DISK_SIZE).
+            ttl (float): The time in seconds after which an isochrone expires (default: {None}, environment variable ISOCHRONE_CACHE_TTL).
+            precision (int): The number of decimal digits the coordinates of the origin are rounded to (default: {None}, environment variable ISOCHRONE_SNAP).
+        """
+        if path is None:
+            path = os.getenv('ISOCHRONE_CACHE_DIR') or os.path.join(os.getenv('CACHE_DIR') or os.path.join(os.environ['WORKING_DIR'], 'cache'), 'isochrones')
+        if max_entries is None:
+            max_entries = int(os.getenv('ISOCHRONE_CACHE_SIZE', DEFAULT_MAX_ENTRIES))
+        if max_disk_entries is None:
+            max_disk_entries = int(os.getenv('ISOCHRONE_CACHE_DISK_SIZE', DEFAULT_MAX_DISK_ENTRIES))
+        if ttl is None:
+            ttl = float(os.getenv('ISOCHRONE_CACHE_TTL', DEFAULT_TTL))
+        if precision is None:
+            precision = int(os.getenv('ISOCHRONE_SNAP', DEFAULT_PRECISION))
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries if max_entries > 0 else 0
+        self.ttl = ttl
+        self.precision = precision
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if self.max_disk_entries > 0:
+            os.makedirs(self.path, exist_ok=True)
+
+
+    @property
+    def enabled(self):
+        """Whether the cache is enabled."""
+        return self.max_entries > 0
+
+
+    def snap(self, lat, lon):
+        """Snaps the coordinates of an origin to the grid of the cache.
+
+        Arguments:
+            lat (float): The latitude.
+            lon (float): The longitude.
+
+        Returns:
+            (tuple): The snapped latitude and longitude.
+        """
+        return round(float(lat), self.precision), round(float(lon), self.precision)
+
+
+    def key(self, lat, lon, costing, distance=None, time=None):
+        """Computes the cache key of an isochrone request, from the snapped origin.
+
+        Arguments:
+            lat (float): The latitude of the origin.
+            lon (float): The longitude of the origin.
+            costing (str): The costing model.
+
+        Keyword Arguments:
+            distance (float): The distance of the contour (default: {None})
+            time (float): The time of the contour (default: {None})
+
+        Returns:
+            (str): The cache key.
+        """
+        lat, lon = self.snap(lat, lon)
+        payload = json.dumps([lat, lon, costing, distance, time])
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+
+    def get(self, key):
+        """Looks up an isochrone, first in memory and then on disk.
+
+        Arguments:
+            key (str): The cache key.
+
+        Returns:
+            (obj|None): The isochrone as pygeos geometry, or None in case of a miss.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, wkb = entry
+                if time() - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    return pg.from_wkb(wkb)
+                del self._entries[key]
+        entry = self._read(key)
+        if entry is None:
+            return None
+        self._remember(key, *entry)
+        return pg.from_wkb(entry[1])
+
+
+    def put(self, key, isochrone):
+        """Stores an isochrone in both tiers.
+
+        Arguments:
+            key (str): The cache key.
+            isochrone (obj): The isochrone as pygeos geometry.
+        """
+        if not self.enabled:
+            return
+        created, wkb = time(), pg.to_wkb(isochrone)
+        self._remember(key, created, wkb)
+        self._write(key, created, wkb)
+
+
+    def _remember(self, key, created, wkb):
+        with self._lock:
+            self._entries[key] = (created, wkb)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.json')
+
+
+    def _read(self, key):
+        """Reads an entry of the disk tier, removing it if expired; the modification time keeps the LRU order."""
+        if self.max_disk_entries <= 0:
+            return None
+        file = self._file(key)
+        try:
+            with open(file) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time() - entry['created'] > self.ttl:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+        return entry['created'], bytes.fromhex(entry['wkb'])
+
+
+    def _write(self, key, created, wkb):
+        """Writes an entry to the disk tier and evicts the least recently used entries."""
+        if self.max_disk_entries <= 0:
+            return
+        temp_file = os.path.join(self.path, '{key}.{uuid}.tmp'.format(key=key, uuid=uuid4()))
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump({'created': created, 'wkb': wkb.hex()}, f)
+            os.replace(temp_file, self._file(key))
+        except OSError as e:
+            logger.warning('Could not store isochrone in cache [key="%s", error="%s"]', key, e)
+            return
+        files = glob(os.path.join(self.path, '*.json'))
+        if len(files) <= self.max_disk_entries:
+            return
+        entries = []
+        for file in files:
+            try:
+                entries.append((os.path.getmtime(file), file))
+            except OSError:
+                continue
+        for _, file in sorted(entries)[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Returns the isochrone cache of the process."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = IsochroneCache()
+    return _cache
+
+
+def isochrone(lat, lon, distance=None, time=None, costing=None):
+    """Computes an isochrone, unless found in the cache.
+
+    The router is requested for the snapped origin, so that the cached isochrone is exactly the one of the key.
+
+    Arguments:
+        lat (float): The latitude of the origin.
+        lon (float): The longitude of the origin.
+
+    Keyword Arguments:
+        distance (float): The distance of the contour (default: {None})
+        time (float): The time of the contour (default: {None})
+        costing (str): The costing model (default: {None}, i.e. 'auto')
+
+    Returns:
+        (obj): The isochrone as pygeos geometry.
+    """
+    if distance is not None:
+        return origin_isochrones(lat, lon, [distance], kind='distance', costing=costing)[0]
+    return origin_isochrones(lat, lon, [time], kind='time', costing=costing)[0]
+
+
+def origin_isochrones(lat, lon, contours, kind='time', costing=None):
+    """Computes the isochrones of several contours from an origin; the contours not found in the cache are requested together.
+
+    Arguments:
+        lat (float): The latitude of the origin.
+        lon (float): The longitude of the origin.
+        contours (list): The contours, i.e. distances or times.
+
+    Keyword Arguments:
+        kind (str): Whether the contours are 'distance' or 'time' (default: {'time'})
+        costing (str): The costing model (default: {None}, i.e. 'auto')
+
+    Returns:
+        (list): The isochrone of each contour, as pygeos geometry.
+    """
+    cache = get_cache()
+    costing = costing or 'auto'
+    if not cache.enabled:
+        return get_client().isochrones(lat, lon, contours, kind=kind, costing=costing)
+    keys = [cache.key(lat, lon, costing, **{kind: contour}) for contour in contours]
+    result = [cache.get(key) for key in keys]
+    missing = [i for i, polygon in enumerate(result) if polygon is None]
+    if len(missing) < len(contours):
+        logger.debug('Isochrone cache hit [hits=%d, contours=%d]', len(contours) - len(missing), len(contours))
+    if len(missing) == 0:
+        return result
+    lat, lon = cache.snap(lat, lon)
+    polygons = get_client().isochrones(lat, lon, [contours[i] for i in missing], kind=kind, costing=costing)
+    for i, polygon in zip(missing, polygons):
+        cache.put(keys[i], polygon)
+        result[i] = polygon
+    return result
+
+
+def isochrones(origins, contours, kind='time', costing=None, concurrency=None):
+    """Computes the isochrones for many origins and contours, requesting the origins concurrently.
+
+    Arguments:
+        origins (ndarray): Array of shape (N, 2) with the latitude and longitude of each origin.
+        contours (list): The contours, i.e. distances or times.
+
+    Keyword Arguments:
+        kind (str): Whether the contours are 'distance' or 'time' (default: {'time'})
+        costing (str): The costing model (default: {None}, i.e. 'auto')
+        concurrency (int): The maximum number of concurrent requests to the router (default: {None}, environment variable VALHALLA_CONCURRENCY)
+
+    Returns:
+        (ndarray): Array of shape (N, len(contours)) with the isochrones as pygeos geometries.
+    """
+    if concurrency is None:
+        concurrency = int(os.getenv('VALHALLA_CONCURRENCY', DEFAULT_CONCURRENCY))
+    result = np.empty((len(origins), len(contours)), dtype=object)
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        futures = [pool.submit(origin_isochrones, lat, lon, contours, kind=kind, costing=costing) for lat, lon in origins]
+        for i, future in enumerate(futures):
+            for j, polygon in enumerate(future.result()):
+                result[i, j] = polygon
+    return result
+
+
+def max_origins():
+    """The maximum number of origins of a travel filter (environment variable TRAVEL_MAX_ORIGINS)."""
+    return int(os.getenv('TRAVEL_MAX_ORIGINS', DEFAULT_MAX_ORIGINS))
+
+
+def read_origins(text, maximum=None):
+    """Reads a list of origins.
+
+    The origins are given as a JSON array, with each origin either as [lat, lon] or as an object with members
+    *lat*, *lon* and optionally *id*. Each origin is identified by its id, provided that all the origins have a
+    unique id; otherwise by its position.
+
+    Arguments:
+        text (str): The origins.
+
+    Keyword Arguments:
+        maximum (int): The maximum number of origins (default: {None}, see :func:`max_origins`)
+
+    Raises:
+        ValueError: The origins could not be read.
+
+    Returns:
+        (tuple): The list of the origin ids and an array of shape (N, 2) with their latitude and longitude.
+    """
+    try:
+        data = json.loads(text)
+        if not isinstance(data, list) or len(data) == 0:
+            raise ValueError('Expected a non-empty list of origins.')
+        maximum = maximum if maximum is not None else max_origins()
+        if len(data) > maximum:
+            raise ValueError('Too many origins: at most {maximum} allowed.'.format(maximum=maximum))
+        ids, coords = [], []
+        for origin in data:
+            if isinstance(origin, dict):
+                ids.append(origin.get('id'))
+                coords.append([float(origin['lat']), float(origin['lon'])])
+            else:
+                lat, lon = origin
+                ids.append(None)
+                coords.append([float(lat), float(lon)])
+    except (KeyError, TypeError) as e:
+        raise ValueError('Invalid origins: {error}'.format(error=e))
+    coords = np.array(coords, dtype=np.float64)
+    if not (np.isfinite(coords).all() and (np.abs(coords[:, 0]) <= 90).all() and (np.abs(coords[:, 1]) <= 180).all()):
+        raise ValueError('Invalid origins: coordinates out of range.')
+    if None in ids or len(set(map(str, ids))) != len(ids):
+        ids = list(range(len(coords)))
+    return ids, coords
+
+
+def read_contours(text, maximum=None):
+    """Reads a list of contours, given as a JSON array or comma separated values.
+
+    Arguments:
+        text (str): The contours.
+
+    Keyword Arguments:
+        maximum (float): The maximum allowed value (default: {None})
+
+    Raises:
+        ValueError: The contours could not be read.
+
+    Returns:
+        (list): The distinct contours in ascending order.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = text.split(',')
+    if not isinstance(data, list):
+        data = [data]
+    try:
+        contours = sorted(set(float(value) for value in data))
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid contours: {error}'.format(error=e))
+    if len(contours) == 0 or contours[0] <= 0 or (maximum is not None and contours[-1] > maximum):
+        raise ValueError('Invalid contours: values should be positive{limit}.'.format(limit='' if maximum is None else ' and up to {maximum}'.format(maximum=maximum)))
+    return contours
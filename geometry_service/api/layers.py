@@ -0,0 +1,124 @@
+"""Pinned reference layers.
+
+Joins often use the same few datasets as *other* side, e.g. administrative boundaries. These can be pinned by
+name with environment variable PINNED_LAYERS, as comma separated *name=value*, where each value is either the key
+of a registered dataset or a path relative to the input directory. The geometries of a pinned layer are decoded and
+prepared once and, along with its (memory-mapped) spatial index, stay resident in each process using it, so that
+joins against the layer only pay for the left side.
+"""
+import os
+import threading
+from collections import namedtuple
+import numpy as np
+import pygeos as pg
+from geometry_service.loggers import logger
+
+# A pinned layer as a join source; it is passed to the worker processes, which load the layer once.
+Pinned = namedtuple('Pinned', ['name', 'arrow_file'])
+
+
+class Layer:
+    """The resident data of a pinned layer."""
+
+    def __init__(self, name, arrow_file):
+        """Loads a pinned layer.
+
+        Arguments:
+            name (str): The name of the layer.
+            arrow_file (str): The converted (Arrow) file of the layer.
+        """
+        import geovaex as gvx
+        from .index import SpatialIndex
+        from .geometries import to_pygeos, bounds
+        self.name = name
+        self.arrow_file = arrow_file
+        self.gdf = gvx.open(arrow_file)
+        self.geometries = to_pygeos(self.gdf)
+        pg.prepare(self.geometries)
+        index = SpatialIndex.open(arrow_file)
+        self.index = index if index is not None else SpatialIndex.build(bounds(self.gdf))
+
+
+    @classmethod
+    def from_geometries(cls, name, geometries):
+        """Creates a layer from geometries in memory.
+
+        Arguments:
+            name (str): The name of the layer.
+            geometries (ndarray): The pygeos geometries.
+
+        Returns:
+            (Layer): The layer.
+        """
+        from .index import SpatialIndex
+        layer = cls.__new__(cls)
+        layer.name, layer.arrow_file, layer.gdf = name, None, None
+        layer.geometries = np.array(geometries, dtype=object)
+        pg.prepare(layer.geometries)
+        layer.index = SpatialIndex.build(pg.bounds(layer.geometries))
+        return layer
+
+
+def pinned_layers():
+    """The configured pinned layers.
+
+    Returns:
+        (dict): The value (dataset key or path) of each layer, by name.
+    """
+    layers = {}
+    for item in (os.getenv('PINNED_LAYERS') or '').split(','):
+        name, _, value = item.partition('=')
+        if name.strip() != '' and value.strip() != '':
+            layers[name.strip()] = value.strip()
+    return layers
+
+
+_sources = {}
+_layers = {}
+_lock = threading.Lock()
+
+def resolve(name):
+    """Resolves a pinned layer to its converted file, converting it in case of a path.
+
+    Arguments:
+        name (str): The name of the layer.
+
+    Raises:
+        KeyError: The layer is not pinned.
+
+    Returns:
+        (Pinned): The layer as join source.
+    """
+    value = pinned_layers()[name]
+    with _lock:
+        source = _sources.get(name)
+        if source is not None and source.arrow_file is not None and os.path.isfile(source.arrow_file):
+            return source
+        from geometry_service.database.model import Dataset
+        dataset = Dataset().get(key=value)
+        if dataset is not None and dataset['ready']:
+            arrow_file = dataset['path']
+        else:
+            from .geovaex import GeoVaex
+            working_dir = os.path.join(os.environ['WORKING_DIR'], 'layers')
+            os.makedirs(working_dir, exist_ok=True)
+            arrow_file = GeoVaex(os.path.join(os.environ['INPUT_DIR'], value), working_dir).arrow_file
+        source = _sources[name] = Pinned(name, arrow_file)
+    return source
+
+
+def get_layer(source):
+    """Returns the resident data of a pinned layer, loading it once per process.
+
+    Arguments:
+        source (Pinned): The layer.
+
+    Returns:
+        (Layer): The layer.
+    """
+    with _lock:
+        layer = _layers.get(source.name)
+        if layer is None or layer.arrow_file != source.arrow_file:
+            logger.info('Loading pinned layer [name="%s", pid=%d]', source.name, os.getpid())
+            layer = _layers[source.name] = Layer(source.name, source.arrow_file)
+    return layer
@@ -0,0 +1,47 @@
+"""Shared configuration of the parallel operations."""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Operations on fewer rows are run in the calling process, since the overhead of a process pool would dominate.
+DEFAULT_MIN_ROWS = 100000
+
+
+def parallelism():
+    """The number of worker processes available to a single operation.
+
+    Returns:
+        (int): The value of environment variable PARALLELISM, or the number of CPUs.
+    """
+    return max(int(os.getenv('PARALLELISM') or os.cpu_count() or 1), 1)
+
+
+def min_rows():
+    """The minimum number of rows for an operation to run in parallel.
+
+    Returns:
+        (int): The value of environment variable PARALLEL_MIN_ROWS, or 100000.
+    """
+    return int(os.getenv('PARALLEL_MIN_ROWS', DEFAULT_MIN_ROWS))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns the pool of worker processes of the process.
+
+    The pool is created once, with the configured parallelism, and kept, so that data loaded by the workers (e.g.
+    pinned layers) stays resident among operations. Workers are spawned rather than forked, since the service
+    process runs several threads.
+
+    Returns:
+        (ProcessPoolExecutor): The pool.
+    """
+    global _pool
+    with _pool_lock:
+        # A pool is broken once a worker dies abruptly; it is then replaced.
+        if _pool is None or getattr(_pool, '_broken', False):
+            _pool = ProcessPoolExecutor(max_workers=parallelism(), mp_context=multiprocessing.get_context('spawn'))
+        return _pool
@@ -0,0 +1,180 @@
+"""Planning of spatial joins.
+
+The strategy of a join is chosen from statistics that are cheap to obtain for a converted dataset: the number of
+rows and the extent, from the spatial index (or the bounding box columns), and the mean number of vertices, from a
+sample of evenly spaced rows. The plan decides
+
+* the strategy: a small side is *broadcast*, i.e. decoded, prepared and indexed once per worker, while the other
+  side is streamed in batches; otherwise both sides are *partitioned* by a grid (see :mod:`spatial_join`),
+* which side is indexed, swapping the sides (and the predicate) when the other one is better suited,
+* whether the features outside the common extent of the sides are filtered out by their bounds beforehand.
+
+A swapped join finds the same pairs, which are mapped back to the original sides; 'how' then applies as requested.
+"""
+import os
+import numpy as np
+import pygeos as pg
+
+# Number of features sampled to estimate the mean number of vertices.
+VERTEX_SAMPLE_SIZE = 1000
+
+DEFAULT_BROADCAST_ROWS = 50000
+
+# The sides of a partitioned join are swapped when the left geometries are this many times simpler than the right
+# ones, since the R-tree is built over the right geometries, while the left ones are prepared.
+SWAP_RATIO = 2.
+
+# The bounds prefilter is applied to a side when the common extent covers less than this fraction of its extent.
+PREFILTER_RATIO = 0.5
+
+
+def broadcast_rows():
+    """The maximum number of features of a broadcast side.
+
+    Returns:
+        (int): The value of environment variable JOIN_BROADCAST_ROWS, or 50000.
+    """
+    return int(os.getenv('JOIN_BROADCAST_ROWS', DEFAULT_BROADCAST_ROWS))
+
+
+def statistics(gdf, index=None, sample_size=VERTEX_SAMPLE_SIZE):
+    """Collects the statistics of a dataset.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+
+    Keyword Arguments:
+        index (SpatialIndex): The spatial index of the dataset, if available, for its extent (default: {None})
+        sample_size (int): The number of features sampled for the mean number of vertices (default: {1000})
+
+    Returns:
+        (dict): The number of rows, the mean number of vertices and the extent as [minx, miny, maxx, maxy].
+    """
+    from .geometries import take, to_pygeos, total_bounds
+    rows = len(gdf)
+    if rows == 0:
+        return {'rows': 0, 'vertices': 0., 'extent': None}
+    extent = index.total_bounds if index is not None else total_bounds(gdf)
+    # Rows are sorted along a curve, so evenly spaced ones are spatially spread as well.
+    sample = np.unique(np.linspace(0, rows - 1, min(rows, sample_size)).astype(np.int64))
+    vertices = pg.get_num_coordinates(to_pygeos(take(gdf, sample)))
+    return {
+        'rows': rows,
+        'vertices': round(float(np.mean(vertices)), 2),
+        'extent': None if np.isnan(extent).any() else [float(value) for value in extent]
+    }
+
+
+def _area(extent):
+    return max(extent[2] - extent[0], 0.) * max(extent[3] - extent[1], 0.)
+
+
+def overlap(left_extent, right_extent, distance=None):
+    """The common extent of two datasets.
+
+    Arguments:
+        left_extent (list): The left extent as [minx, miny, maxx, maxy], or None if empty.
+        right_extent (list): The right extent, or None if empty.
+
+    Keyword Arguments:
+        distance (float): The distance the left extent is expanded by, for 'dwithin' joins (default: {None})
+
+    Returns:
+        (list): The common extent, or None if the extents are disjoint.
+    """
+    if left_extent is None or right_extent is None:
+        return None
+    left_extent = np.asarray(left_extent, dtype=np.float64) + (np.array([-distance, -distance, distance, distance]) if distance else 0)
+    common = [max(left_extent[0], right_extent[0]), max(left_extent[1], right_extent[1]), min(left_extent[2], right_extent[2]), min(left_extent[3], right_extent[3])]
+    if common[0] > common[2] or common[1] > common[3]:
+        return None
+    return [float(value) for value in common]
+
+
+def _prefilter(left, right, distance=None):
+    """Decides the sides filtered by the common extent."""
+    if left['rows'] == 0 or right['rows'] == 0:
+        return None
+    common = overlap(left['extent'], right['extent'], distance=distance)
+    if common is None:
+        # Nothing matches; every feature is filtered out.
+        return {'bounds': None, 'sides': ['left', 'right']}
+    sides = []
+    left_extent = np.asarray(left['extent']) + (np.array([-distance, -distance, distance, distance]) if distance else 0)
+    for side, extent in [('left', left_extent), ('right', right['extent'])]:
+        if _area(extent) > 0 and _area(common) < PREFILTER_RATIO * _area(extent):
+            sides.append(side)
+    return {'bounds': common, 'sides': sides} if len(sides) > 0 else None
+
+
+def plan_join(left, right, predicate, distance=None, pinned=False, same_crs=True, aggregate=False, estimate=0, budget=None):
+    """Plans a spatial join.
+
+    Arguments:
+        left (dict): The statistics of the left dataset (see :func:`statistics`).
+        right (dict): The statistics of the right dataset.
+        predicate (str): One of 'contains', 'within', 'intersects', 'dwithin', 'nearest'.
+
+    Keyword Arguments:
+        distance (float): The distance for 'dwithin' (default: {None})
+        pinned (bool): Whether the right side is a pinned layer (default: {False})
+        same_crs (bool): Whether both sides are in the same CRS (default: {True})
+        aggregate (bool): Whether this is an aggregate join (default: {False})
+        estimate (int): The estimated size of the join in memory (default: {0})
+        budget (int): The memory budget in bytes (default: {None}, i.e. the configured budget)
+
+    Returns:
+        (dict): The plan, with the strategy (one of 'legacy', 'out_of_core', 'nearest', 'broadcast', 'partition'), the indexed (or broadcast) side, whether the sides are swapped, the bounds prefilter (None, or the common extent and the sides it applies to), the estimate and the statistics of both sides.
+    """
+    from .spatial_join import memory_budget
+    budget = budget if budget is not None else memory_budget()
+    plan = {'strategy': 'partition', 'build': 'right', 'swapped': False, 'prefilter': None, 'estimate': int(estimate), 'left': left, 'right': right}
+    if predicate == 'nearest':
+        plan['strategy'] = 'nearest'
+        return plan
+    if not same_crs and not aggregate:
+        plan['strategy'] = 'legacy'
+        return plan
+    if pinned:
+        plan['strategy'] = 'broadcast'
+    elif estimate > budget:
+        plan['strategy'] = 'out_of_core'
+        return plan
+    elif same_crs and min(left['rows'], right['rows']) <= broadcast_rows():
+        # The smaller side is resident in every worker, where its geometries are prepared and tested.
+        plan['strategy'] = 'broadcast'
+        plan['swapped'] = left['rows'] < right['rows']
+    else:
+        plan['swapped'] = right['vertices'] > SWAP_RATIO * max(left['vertices'], 1.)
+    plan['build'] = 'left' if plan['swapped'] else 'right'
+    # The extents of sides in different CRSs are not comparable, since the statistics are taken in each one's own CRS.
+    if same_crs:
+        plan['prefilter'] = _prefilter(left, right, distance=distance if predicate == 'dwithin' else None)
+    return plan
+
+
+def prefilter(bounds, plan, side, distance=None):
+    """Applies the bounds prefilter of a plan to a side; filtered features get empty (NaN) bounds, so no join engine considers them.
+
+    Arguments:
+        bounds (ndarray): Array of shape (N, 4) with the boxes of the features.
+        plan (dict): The plan (see :func:`plan_join`).
+        side (str): 'left' or 'right'.
+
+    Keyword Arguments:
+        distance (float): The distance the left boxes are expanded by, for 'dwithin' joins (default: {None})
+
+    Returns:
+        (ndarray): The boxes.
+    """
+    if bounds is None or plan['prefilter'] is None or side not in plan['prefilter']['sides']:
+        return bounds
+    bounds = np.array(bounds, dtype=np.float64).reshape(-1, 4)
+    common = plan['prefilter']['bounds']
+    if common is None:
+        bounds[:] = np.nan
+        return bounds
+    expanded = bounds + (np.array([-distance, -distance, distance, distance]) if distance and side == 'left' else 0)
+    outside = (expanded[:, 0] > common[2]) | (expanded[:, 2] < common[0]) | (expanded[:, 1] > common[3]) | (expanded[:, 3] < common[1])
+    bounds[outside] = np.nan
+    return bounds
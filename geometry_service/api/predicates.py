@@ -0,0 +1,172 @@
+"""Spatial predicates against query geometries, evaluated for many features."""
+import os
+import json
+import numpy as np
+import pygeos as pg
+from .index import SpatialIndex
+
+DEFAULT_MAX_VERTICES = 1000
+MAX_DEPTH = 8
+
+# State of each quadtree cell.
+OUTSIDE = 0
+INSIDE = 1
+PARTIAL = 2
+
+
+class PreparedQuery:
+    """A query geometry prepared once, in order to be tested against many features.
+
+    Polygons with many vertices (e.g. isochrones) are additionally split into a quadtree of cells, until the part of
+    the polygon within each cell has at most *max_vertices* vertices. A feature whose bounding box lies strictly
+    inside a cell is decided without any test if the cell is completely inside or outside the polygon, or is tested
+    against the (much smaller) part of the polygon within the cell; the rest of the features are tested against the
+    whole prepared polygon.
+    """
+
+    def __init__(self, geometry, max_vertices=None):
+        """Prepares the query geometry.
+
+        Arguments:
+            geometry (obj): The pygeos geometry.
+
+        Keyword Arguments:
+            max_vertices (int): The maximum number of vertices of a polygon before it is subdivided; zero disables the subdivision (default: {None}, environment variable QUERY_MAX_VERTICES).
+        """
+        if max_vertices is None:
+            max_vertices = int(os.getenv('QUERY_MAX_VERTICES', DEFAULT_MAX_VERTICES))
+        self.geometry = geometry
+        pg.prepare(self.geometry)
+        self._boxes = None
+        if max_vertices > 0 and pg.get_type_id(geometry) in (3, 6) and pg.get_num_coordinates(geometry) > max_vertices:
+            try:
+                self._subdivide(max_vertices)
+            except pg.GEOSException:
+                self._boxes = None
+
+
+    @property
+    def num_cells(self):
+        """The number of quadtree cells; zero if the geometry has not been subdivided."""
+        return 0 if self._boxes is None else len(self._boxes)
+
+
+    def _subdivide(self, max_vertices):
+        """Splits the geometry into quadtree cells.
+
+        Arguments:
+            max_vertices (int): The maximum number of vertices of the part of the geometry within each cell.
+        """
+        boxes, states, pieces = [], [], []
+        stack = [(pg.bounds(self.geometry), self.geometry, 0)]
+        while len(stack) > 0:
+            box, piece, depth = stack.pop()
+            cell = pg.box(*box)
+            if not pg.intersects(piece, cell):
+                state, piece = OUTSIDE, None
+            elif pg.contains(piece, cell):
+                state, piece = INSIDE, None
+            else:
+                piece = pg.intersection(piece, cell)
+                if pg.get_num_coordinates(piece) > max_vertices and depth < MAX_DEPTH:
+                    minx, miny, maxx, maxy = box
+                    midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+                    for child in ([minx, miny, midx, midy], [midx, miny, maxx, midy], [minx, midy, midx, maxy], [midx, midy, maxx, maxy]):
+                        stack.append((np.array(child), piece, depth + 1))
+                    continue
+                state = PARTIAL
+            boxes.append(box)
+            states.append(state)
+            pieces.append(piece)
+        self._boxes = np.array(boxes, dtype=np.float64)
+        self._states = np.array(states, dtype=np.int8)
+        self._pieces = np.array(pieces, dtype=object)
+        pg.prepare(self._pieces[self._states == PARTIAL])
+        self._index = SpatialIndex.build(self._boxes)
+
+
+    def _locate(self, bounds):
+        """Finds the cell that strictly contains the bounding box of each feature.
+
+        Arguments:
+            bounds (ndarray): Array of shape (N, 4) with the bounds of the features.
+
+        Returns:
+            (ndarray): The position of the cell for each feature, or -1 if no cell contains it.
+        """
+        features, cells = self._index.query_bulk(bounds)
+        inner, outer = bounds[features], self._boxes[cells]
+        strict = (inner[:, 0] > outer[:, 0]) & (inner[:, 1] > outer[:, 1]) & (inner[:, 2] < outer[:, 2]) & (inner[:, 3] < outer[:, 3])
+        located = np.full(len(bounds), -1, dtype=np.int64)
+        located[features[strict]] = cells[strict]
+        return located
+
+
+    def within(self, geometries, bounds=None):
+        """Tests whether each geometry lies within the query geometry.
+
+        Arguments:
+            geometries (ndarray): Array of pygeos geometries.
+
+        Keyword Arguments:
+            bounds (ndarray): Array of shape (N, 4) with the bounds of the geometries, if already known (default: {None})
+
+        Returns:
+            (ndarray): Boolean mask.
+        """
+        geometries = np.asarray(geometries, dtype=object)
+        if self._boxes is None:
+            return pg.contains(self.geometry, geometries)
+        if bounds is None:
+            bounds = pg.bounds(geometries)
+        cells = self._locate(np.asarray(bounds, dtype=np.float64).reshape(-1, 4))
+        states = np.where(cells >= 0, self._states[cells], -1)
+        mask = states == INSIDE
+        partial = np.nonzero(states == PARTIAL)[0]
+        if len(partial) > 0:
+            mask[partial] = pg.contains(self._pieces[cells[partial]], geometries[partial])
+        rest = np.nonzero(states == -1)[0]
+        if len(rest) > 0:
+            mask[rest] = pg.contains(self.geometry, geometries[rest])
+        return mask
+
+
+def read_queries(text):
+    """Reads a collection of query geometries.
+
+    The geometries could be given as a GeoJSON FeatureCollection, a JSON array of Well-Known-Text geometries, or
+    Well-Known-Text geometries in separate lines. The ids of the GeoJSON features are used as the ids of the queries,
+    provided that all the features have a unique id; otherwise each query is identified by its position.
+
+    Arguments:
+        text (str): The query geometries.
+
+    Raises:
+        ValueError: The geometries could not be read.
+
+    Returns:
+        (tuple): The list of query ids and the array of pygeos geometries.
+    """
+    from shapely.geometry import shape
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = [line for line in text.splitlines() if line.strip() != '']
+    try:
+        if isinstance(data, dict) and data.get('type') == 'FeatureCollection':
+            features = data['features']
+            wkt = [shape(feature['geometry']).to_wkt() for feature in features]
+            ids = [feature.get('id') for feature in features]
+        elif isinstance(data, list) and all(isinstance(item, str) for item in data):
+            wkt = data
+            ids = [None] * len(wkt)
+        else:
+            raise ValueError('Expected a GeoJSON FeatureCollection or a list of Well-Known-Text geometries.')
+        geometries = pg.from_wkt(wkt)
+    except (KeyError, TypeError, AttributeError, pg.GEOSException) as e:
+        raise ValueError('Invalid query geometries: {error}'.format(error=e))
+    if len(geometries) == 0:
+        raise ValueError('No query geometries given.')
+    if None in ids or len(set(ids)) != len(ids):
+        ids = list(range(len(geometries)))
+    return ids, geometries
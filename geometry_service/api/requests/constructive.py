@@ -1,13 +1,14 @@
 import os
+from functools import partial
 from flask import Blueprint, make_response, g, request
-from werkzeug.utils import secure_filename
 from flask_executor import Executor
 from geometry_service.database.actions import db_update_queue_status
 from geometry_service.loggers import logger
-from ..forms.constructive import ConstructiveFileForm, ConstructivePathForm, SimplifyFileForm, SimplifyPathForm
+from ..forms.constructive import ConstructiveFileForm, ConstructivePathForm, SimplifyFileForm, SimplifyPathForm, PipelineFileForm, PipelinePathForm
 from ..context import get_session
 from ..async_ import constructive_process, async_callback
-from ..helpers import parse_read_options, send_file, copy_to_output
+from ..chunked import read_steps, read_tolerances
+from ..helpers import parse_read_options, get_resource, send_file, copy_to_output
 
 def _before_requests():
     """Executed before each request for this blueprint.
@@ -20,6 +21,8 @@ def _before_requests():
     logger.info('API request [endpoint: "%s"]', request.endpoint)
     if request.endpoint == 'constructive.simplify':
         form = SimplifyFileForm() if 'resource' in request.files.keys() else SimplifyPathForm()
+    elif request.endpoint == 'constructive.pipeline':
+        form = PipelineFileForm() if 'resource' in request.files.keys() else PipelinePathForm()
     else:
         form = ConstructiveFileForm() if 'resource' in request.files.keys() else ConstructivePathForm()
     if not form.validate_on_submit():
@@ -27,19 +30,13 @@ def _before_requests():
 
     session = get_session()
 
-    if 'resource' in request.files.keys():
-        src_filename = secure_filename(form.resource.data.filename)
-        src_file = os.path.join(session['working_path'], src_filename)
-        form.resource.data.save(src_file)
-    else:
-        src_file = os.path.join(os.environ['INPUT_DIR'], form.resource.data)
-    g.src_file = src_file
+    g.src_file, dataset = get_resource(form, session)
     g.form = form
     g.session = session
 
     read_options = parse_read_options(form)
     crs = form.crs.data if form.crs.data != '' else None
-    g.parameters = {'crs': crs, 'read_options': read_options}
+    g.parameters = {'crs': crs, 'read_options': read_options, 'output_format': form.output_format.data or 'native', 'dataset': dataset}
 
 
 def _constructive(action, *args, **kwargs):
@@ -71,7 +68,7 @@ def _constructive(action, *args, **kwargs):
 
     # Deferred Response
     future = executor.submit(constructive_process, g.session, g.src_file, action, *args, **kwargs)
-    future.add_done_callback(async_callback)
+    future.add_done_callback(partial(async_callback, working_path=g.session['working_path']))
     ticket = g.session['ticket']
     return make_response({'type': 'deferred', 'ticket': ticket, 'statusUri': "/jobs/status?ticket={ticket}".format(ticket=ticket)}, 202)
 
@@ -146,7 +143,7 @@ def simplify():
     ---
     post:
         summary: Simplify geometries.
-        description: Create a new spatial file with simplified geometries.
+        description: Create a new spatial file with simplified geometries. Given several tolerances, the file is read once and simplified at each one, at its full tolerance; the levels are exported either to one file each, in a single archive, or to a single file with a *level* column.
         tags:
             - Constructive
         parameters:
@@ -163,4 +160,35 @@ def simplify():
             202: deferredResponse
             400: validationErrorResponse
     """
-    return _constructive('simplify', g.form.tolerance.data, preserve_topology=g.form.preserve_topology.data, **g.parameters)
+    tolerances = read_tolerances(g.form.tolerance.data)
+    if len(tolerances) == 1:
+        return _constructive('simplify', tolerances[0], preserve_topology=g.form.preserve_topology.data, **g.parameters)
+    return _constructive('simplify_levels', tolerances, preserve_topology=g.form.preserve_topology.data, pyramid=g.form.pyramid.data or 'archive', **g.parameters)
+
+
+@bp.route('/pipeline', methods=['POST'])
+def pipeline():
+    """**Flask POST rule**.
+
+    Create a new spatial file with geometries constructed by a sequence of operations.
+    ---
+    post:
+        summary: Apply a sequence of constructive operations.
+        description: Create a new spatial file with the geometries constructed by applying the given steps in turn; the file is read once and the result is exported once.
+        tags:
+            - Constructive
+        parameters:
+            - idempotencyKey
+        requestBody:
+            required: true
+            content:
+                application/x-www-form-urlencoded:
+                    schema: pipelineConstructiveForm
+                multipart/form-data:
+                    schema: pipelineConstructiveFormMultipart
+        responses:
+            200: promptResultResponse
+            202: deferredResponse
+            400: validationErrorResponse
+    """
+    return _constructive('pipeline', steps=read_steps(g.form.steps.data), **g.parameters)
@@ -0,0 +1,255 @@
+import os
+from shutil import rmtree
+from flask import Blueprint, make_response, request, jsonify
+from flask_executor import Executor
+from geometry_service.database.model import Dataset
+from geometry_service.database.actions import db_update_queue_status, db_create_dataset, db_update_dataset, db_delete_dataset, db_get_datasets, db_get_dataset_jobs
+from geometry_service.loggers import logger
+from ..forms.datasets import DatasetFileForm, DatasetPathForm
+from ..context import get_session
+from ..async_ import dataset_process, dataset_callback
+from ..helpers import parse_read_options, get_resource
+
+
+def _dataset_info(dataset):
+    """Prepares the public details of a dataset.
+
+    Arguments:
+        dataset (dict): The dataset record.
+
+    Returns:
+        (dict): The dataset details.
+    """
+    return {
+        "key": dataset['key'],
+        "name": dataset['name'],
+        "ready": dataset['ready'],
+        "driver": dataset['driver'],
+        "crs": dataset['crs'],
+        "rows": dataset['rows'],
+        "bounds": dataset['bounds'],
+        "created": dataset['created']
+    }
+
+
+# FLASK ROUTES
+
+executor = Executor()
+bp = Blueprint('datasets', __name__, url_prefix='/datasets')
+
+@bp.route('', methods=['POST'])
+def register():
+    """**Flask POST rule**.
+
+    Register a dataset.
+    ---
+    post:
+        summary: Register a dataset.
+        description: Upload or point to a spatial file once, in order to use it in several operations. The spatial file is converted once, and the returned dataset key can be given as *dataset* (or *other_dataset*) in place of *resource* (or *other*) to all the operations.
+        tags:
+            - Datasets
+        parameters:
+            - idempotencyKey
+        requestBody:
+            required: true
+            content:
+                application/x-www-form-urlencoded:
+                    schema: datasetForm
+                multipart/form-data:
+                    schema: datasetFormMultipart
+        responses:
+            200:
+                description: The dataset was registered.
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            properties:
+                                type:
+                                    type: string
+                                    description: Request type.
+                                    enum:
+                                        - prompt
+                                dataset: datasetInfo
+            202:
+                description: Request accepted for process.
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            properties:
+                                type:
+                                    type: string
+                                    description: Request type.
+                                    enum:
+                                        - deferred
+                                ticket:
+                                    type: string
+                                    description: The unique ticket assigned to the request.
+                                    example: caff960ab6f1627c11b0de3c6406a140
+                                statusUri:
+                                    type: string
+                                    description: The URI to poll for the status of the request.
+                                    example: /jobs/status?ticket=caff960ab6f1627c11b0de3c6406a140
+                                dataset:
+                                    type: string
+                                    description: The key of the dataset; it can be used once the process has been completed.
+                                    example: 3ba6a8b5ecea27db3c5f4e0159c63283
+            400: validationErrorResponse
+    """
+    logger.info('API request [endpoint: "%s"]', request.endpoint)
+    form = DatasetFileForm() if 'resource' in request.files.keys() else DatasetPathForm()
+    if not form.validate_on_submit():
+        return make_response(form.errors, 400)
+
+    session = get_session()
+    src_file, _ = get_resource(form, session)
+    read_options = parse_read_options(form)
+    crs = form.crs.data if form.crs.data != '' else None
+    dataset = db_create_dataset(name=os.path.basename(src_file), ticket=session['ticket'])
+    key = dataset['key']
+
+    # Prompt Response
+    if form.response.data == 'prompt':
+        ticket, dataset, success, error_msg = dataset_process(session, src_file, key, crs=crs, read_options=read_options)
+        dataset.pop('key')
+        if not success:
+            db_delete_dataset(key)
+            db_update_queue_status(ticket, completed=True, success=False, error_msg=error_msg)
+            return make_response({'error': error_msg}, 500)
+        db_update_dataset(key, ready=True, **dataset)
+        db_update_queue_status(ticket, completed=True, success=True)
+        return make_response({'type': 'prompt', 'dataset': _dataset_info(Dataset().get(key=key))}, 200)
+
+    # Deferred Response
+    future = executor.submit(dataset_process, session, src_file, key, crs=crs, read_options=read_options)
+    future.add_done_callback(dataset_callback)
+    ticket = session['ticket']
+    return make_response({'type': 'deferred', 'ticket': ticket, 'statusUri': "/jobs/status?ticket={ticket}".format(ticket=ticket), 'dataset': key}, 202)
+
+
+@bp.route('', methods=['GET'])
+def info():
+    """**Flask GET rule**.
+
+    Get the registered datasets.
+    ---
+    get:
+        summary: Get the registered datasets.
+        tags:
+            - Datasets
+        responses:
+            200:
+                description: The list of the registered datasets.
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items: datasetInfo
+    """
+    logger.info('API request [endpoint: "%s"]', request.endpoint)
+    datasets = [_dataset_info(dataset) for dataset in db_get_datasets()]
+    return make_response(jsonify(datasets), 200)
+
+
+@bp.route('/<key>', methods=['GET'])
+def get(key):
+    """**Flask GET rule**.
+
+    Get the details of a registered dataset.
+    ---
+    get:
+        summary: Get the details of a registered dataset.
+        tags:
+            - Datasets
+        parameters:
+            -
+                name: key
+                in: path
+                schema:
+                    type: string
+                description: The dataset key.
+        responses:
+            200:
+                description: The dataset details.
+                content:
+                    application/json:
+                        schema: datasetInfo
+            404:
+                description: Dataset not found.
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            properties:
+                                status:
+                                    type: string
+                                    description: Error message
+                                    example: Dataset not found.
+    """
+    logger.info('API request [endpoint: "%s", key: "%s"]', request.endpoint, key)
+    dataset = Dataset().get(key=key)
+    if dataset is None:
+        return make_response({"status": "Dataset not found."}, 404)
+    return make_response(_dataset_info(dataset), 200)
+
+
+@bp.route('/<key>', methods=['DELETE'])
+def delete(key):
+    """**Flask DELETE rule**.
+
+    Delete a registered dataset.
+    ---
+    delete:
+        summary: Delete a registered dataset.
+        description: A dataset cannot be deleted while it is being registered, or while unfinished jobs read it.
+        tags:
+            - Datasets
+        parameters:
+            -
+                name: key
+                in: path
+                schema:
+                    type: string
+                description: The dataset key.
+        responses:
+            204:
+                description: The dataset was deleted.
+            404:
+                description: Dataset not found.
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            properties:
+                                status:
+                                    type: string
+                                    description: Error message
+                                    example: Dataset not found.
+            409:
+                description: The dataset is in use.
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            properties:
+                                status:
+                                    type: string
+                                    description: Error message
+                                    example: Dataset is in use by unfinished jobs.
+                                tickets:
+                                    type: array
+                                    description: The tickets of the unfinished jobs.
+                                    items:
+                                        type: string
+    """
+    logger.info('API request [endpoint: "%s", key: "%s"]', request.endpoint, key)
+    dataset = Dataset().get(key=key)
+    if dataset is None:
+        return make_response({"status": "Dataset not found."}, 404)
+    tickets = db_get_dataset_jobs(key)
+    if len(tickets) > 0:
+        return make_response({"status": "Dataset is in use by unfinished jobs.", "tickets": tickets}, 409)
+    db_delete_dataset(key)
+    rmtree(os.path.join(os.environ['DATASET_DIR'], key), ignore_errors=True)
+    return make_response('', 204)
@@ -1,13 +1,13 @@
 import os
+from functools import partial
 from flask import Blueprint, make_response, g, request
-from werkzeug.utils import secure_filename
 from flask_executor import Executor
 from geometry_service.database.actions import db_update_queue_status
 from geometry_service.loggers import logger
-from ..forms.filter_ import FilterFileForm, FilterPathForm, BufferFileForm, BufferPathForm, TravelDistanceFileForm, TravelDistancePathForm, TravelTimeFileForm, TravelTimePathForm
+from ..forms.filter_ import FilterFileForm, FilterPathForm, NearestFileForm, NearestPathForm, BufferFileForm, BufferPathForm, BatchFileForm, BatchPathForm, TravelDistanceFileForm, TravelDistancePathForm, TravelTimeFileForm, TravelTimePathForm
 from ..context import get_session
 from ..async_ import filter_process, async_callback
-from ..helpers import parse_read_options, send_file, copy_to_output
+from ..helpers import parse_read_options, get_resource, send_file, copy_to_output
 
 def _before_requests():
     """Executed before each request for this blueprint.
@@ -18,7 +18,11 @@ def _before_requests():
         None|Response: In case of validation error, returns a Flask response, None otherwise.
     """
     logger.info('API request [endpoint: "%s"]', request.endpoint)
-    if request.endpoint == 'filter.within_buffer':
+    if request.endpoint == 'filter.nearest':
+        form = NearestFileForm() if 'resource' in request.files.keys() else NearestPathForm()
+    elif request.endpoint == 'filter.batch':
+        form = BatchFileForm() if 'resource' in request.files.keys() else BatchPathForm()
+    elif request.endpoint == 'filter.within_buffer':
         form = BufferFileForm() if 'resource' in request.files.keys() else BufferPathForm()
     elif request.endpoint == 'filter.travel_dist':
         form = TravelDistanceFileForm() if 'resource' in request.files.keys() else TravelDistancePathForm()
@@ -31,19 +35,13 @@ def _before_requests():
 
     session = get_session()
 
-    if 'resource' in request.files.keys():
-        src_filename = secure_filename(form.resource.data.filename)
-        src_file = os.path.join(session['working_path'], src_filename)
-        form.resource.data.save(src_file)
-    else:
-        src_file = os.path.join(os.environ['INPUT_DIR'], form.resource.data)
-    g.src_file = src_file
+    g.src_file, dataset = get_resource(form, session)
     g.form = form
     g.session = session
 
     read_options = parse_read_options(form)
     crs = form.crs.data if form.crs.data != '' else None
-    g.parameters = {'crs': crs, 'read_options': read_options}
+    g.parameters = {'crs': crs, 'read_options': read_options, 'output': form.output.data or 'file', 'limit': form.limit.data, 'output_format': form.output_format.data or 'native', 'dataset': dataset}
 
 
 def _filter(action, **kwargs):
@@ -59,7 +57,10 @@ def _filter(action, **kwargs):
         (str): JSONified flask response depending on the requested response type.
     """
     # Prompt Response
-    wkt = g.form.wkt.data if action[0:6] != 'travel' else [g.form.point_lat.data, g.form.point_lon.data]
+    if action == 'batch':
+        wkt = g.form.queries.data
+    else:
+        wkt = g.form.wkt.data if action[0:6] != 'travel' else [g.form.point_lat.data, g.form.point_lon.data]
     if g.form.response.data == 'prompt':
         ticket, export, success, error_msg = filter_process(g.session, g.src_file, action, wkt, **kwargs)
         if not success:
@@ -67,6 +68,9 @@ def _filter(action, **kwargs):
             return make_response({'error': error_msg}, 500)
         elif export is None:
             return make_response({}, 204)
+        elif isinstance(export, dict):
+            db_update_queue_status(ticket, completed=True, success=True)
+            return make_response({'type': 'prompt', 'result': export}, 200)
         if g.form.download.data:
             db_update_queue_status(ticket, completed=True, success=True)
             return send_file(export)
@@ -77,7 +81,7 @@ def _filter(action, **kwargs):
 
     # Deferred Response
     future = executor.submit(filter_process, g.session, g.src_file, action, wkt, **kwargs)
-    future.add_done_callback(async_callback)
+    future.add_done_callback(partial(async_callback, working_path=g.session['working_path']))
     ticket = g.session['ticket']
     return make_response({'type': 'deferred', 'ticket': ticket, 'statusUri': "/jobs/status?ticket={ticket}".format(ticket=ticket)}, 202)
 
@@ -92,11 +96,11 @@ bp.before_request(_before_requests)
 def nearest():
     """**Flask POST rule.**
 
-    Create a new spatial file sorted by the nearest geometries.
+    Create a new spatial file with the nearest geometries, sorted by distance.
     ---
     post:
         summary: Find the nearest geometries.
-        description: Create a new spatial file sorted by the nearest geometries. A new column *distance* is added to the attribute table with the distance specified in the CRS units.
+        description: Create a new spatial file with the *k* geometries nearest to the given one (all the geometries if *k* is not given), optionally within a maximum distance, in ascending order of distance. A new column *distance* is added to the attribute table with the distance specified in the CRS units.
         tags:
             - Filter
         parameters:
@@ -105,16 +109,16 @@ def nearest():
             required: true
             content:
                 application/x-www-form-urlencoded:
-                    schema: filterForm
+                    schema: nearestFilterForm
                 multipart/form-data:
-                    schema: filterFormMultipart
+                    schema: nearestFilterFormMultipart
         responses:
             200: promptResultResponse
             202: deferredResponse
             204: noContentResponse
             400: validationErrorResponse
     """
-    return _filter('nearest', **g.parameters)
+    return _filter('nearest', k=g.form.k.data, maximum_distance=g.form.maximum_distance.data, **g.parameters)
 
 @bp.route('/within', methods=['POST'])
 def within():
@@ -170,7 +174,35 @@ def within_buffer():
             204: noContentResponse
             400: validationErrorResponse
     """
-    return _filter('within_buffer', radius=g.form.radius.data, **g.parameters)
+    return _filter('within_buffer', radius=g.form.radius.data, method=g.form.method.data, **g.parameters)
+
+@bp.route('/batch', methods=['POST'])
+def batch():
+    """**Flask POST rule.**
+
+    Filter the spatial file with many query geometries at once.
+    ---
+    post:
+        summary: Apply a filter with many query geometries.
+        description: Filter the spatial file with many query geometries (e.g. one per district) in a single pass. Each feature is matched against all the query geometries; the result consists of one spatial file per query geometry, or a single spatial file with the id of the matched query geometry in the new column *query_id*, where features matching several query geometries are repeated.
+        tags:
+            - Filter
+        parameters:
+            - idempotencyKey
+        requestBody:
+            required: true
+            content:
+                application/x-www-form-urlencoded:
+                    schema: batchFilterForm
+                multipart/form-data:
+                    schema: batchFilterFormMultipart
+        responses:
+            200: promptResultResponse
+            202: deferredResponse
+            204: noContentResponse
+            400: validationErrorResponse
+    """
+    return _filter('batch', predicate=g.form.predicate.data or 'within', layout=g.form.layout.data or 'split', **g.parameters)
 
 @bp.route('/travel_distance', methods=['POST'])
 def travel_dist():
@@ -180,7 +212,7 @@ def travel_dist():
     ---
     post:
         summary: Within travel distance.
-        description: Create a new spatial file, subset of the source, with the condition that each feature in this dataset is within a given travel distance from a source point.
+        description: Create a new spatial file, subset of the source, with the condition that each feature in this dataset is within a given travel distance from a source point. When several origins (*origins*) or distances (*distances*) are given, the features are classified in one pass; each feature is repeated for every origin it is reachable from, with the id of the origin in the new column *origin_id* and the smallest distance that reaches it in the new column *band*.
         tags:
             - Filter
         parameters:
@@ -198,7 +230,7 @@ def travel_dist():
             204: noContentResponse
             400: validationErrorResponse
     """
-    return _filter('travel_distance', distance=g.form.distance.data, costing=g.form.costing.data, **g.parameters)
+    return _filter('travel_distance', distance=g.form.distance.data, costing=g.form.costing.data, origins=g.form.origins.data, contours=g.form.distances.data, **g.parameters)
 
 @bp.route('/travel_time', methods=['POST'])
 def travel_time():
@@ -208,7 +240,7 @@ def travel_time():
     ---
     post:
         summary: Within travel time.
-        description: Create a new spatial file, subset of the source, with the condition that each feature in this dataset is within a given travel time from a source point.
+        description: Create a new spatial file, subset of the source, with the condition that each feature in this dataset is within a given travel time from a source point. When several origins (*origins*) or times (*times*) are given, the features are classified in one pass; each feature is repeated for every origin it is reachable from, with the id of the origin in the new column *origin_id* and the smallest time that reaches it in the new column *band*.
         tags:
             - Filter
         parameters:
@@ -226,4 +258,4 @@ def travel_time():
             204: noContentResponse
             400: validationErrorResponse
     """
-    return _filter('travel_time', time=g.form.time.data, costing=g.form.costing.data, **g.parameters)
+    return _filter('travel_time', time=g.form.time.data, costing=g.form.costing.data, origins=g.form.origins.data, contours=g.form.times.data, **g.parameters)
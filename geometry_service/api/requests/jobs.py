@@ -1,4 +1,5 @@
 import os
+import json
 from flask import Blueprint, make_response, request, jsonify
 from geometry_service.database.model import Queue
 from geometry_service.database.actions import db_get_active_jobs
@@ -129,6 +130,40 @@ def status():
                                             type: string
                                             description: The relative path of the resource resulted from an export request in the output directory; null for any other type of request or if copy to the output directory was not requested.
                                             example: 2102/{token}/caff960ab6f1627c11b0de3c6406a140/my_dataset.tar.gz
+                                plan:
+                                    type: object
+                                    description: The plan chosen for a spatial join from the statistics of the datasets; null for any other type of request.
+                                    properties:
+                                        strategy:
+                                            type: string
+                                            enum:
+                                                - broadcast
+                                                - partition
+                                                - out_of_core
+                                                - nearest
+                                                - legacy
+                                            description: The join strategy; *broadcast* keeps the smaller side resident in every worker, *partition* partitions both sides by a grid, *out_of_core* spills the partitions to disk, *legacy* is used for datasets in different CRS.
+                                        build:
+                                            type: string
+                                            enum:
+                                                - left
+                                                - right
+                                            description: The side indexed (or broadcast).
+                                        swapped:
+                                            type: boolean
+                                            description: Whether the sides were swapped, along with the predicate.
+                                        prefilter:
+                                            type: object
+                                            description: The common extent of the datasets, and the sides whose features outside of it were filtered out by their bounds; null if not applied.
+                                        estimate:
+                                            type: integer
+                                            description: The estimated memory of the join in bytes.
+                                        left:
+                                            type: object
+                                            description: The statistics of the left dataset, i.e. the number of *rows*, the mean number of *vertices* and the *extent*.
+                                        right:
+                                            type: object
+                                            description: The statistics of the right dataset.
             400:
                 description: Both query parameters are missing.
                 content:
@@ -176,6 +211,7 @@ def status():
         "completed": queue['completed'],
         "success": queue['success'],
         "errorMessage": queue['error_msg'],
-        "resource": resource
+        "resource": resource,
+        "plan": json.loads(queue['plan']) if queue['plan'] is not None else None
     }
     return make_response(info, 200)
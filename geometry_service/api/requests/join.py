@@ -1,13 +1,16 @@
 import os
+from functools import partial
 from flask import Blueprint, make_response, g, request
-from werkzeug.utils import secure_filename
 from flask_executor import Executor
 from geometry_service.database.actions import db_update_queue_status
 from geometry_service.loggers import logger
-from ..forms.join import JoinFileForm, JoinPathForm, JoinDWithinFileForm, JoinDWithinPathForm
+from ..forms.join import JoinFileForm, JoinResourceFileForm, JoinOtherFileForm, JoinPathForm, JoinDWithinFileForm, JoinDWithinResourceFileForm, JoinDWithinOtherFileForm, JoinDWithinPathForm, \
+    JoinNearestFileForm, JoinNearestResourceFileForm, JoinNearestOtherFileForm, JoinNearestPathForm
 from ..context import get_session
 from ..async_ import join_process, async_callback
-from ..helpers import parse_read_options, send_file, copy_to_output
+from ..spatial_join import read_aggregates
+from ..layers import resolve as resolve_layer
+from ..helpers import parse_read_options, get_resource, send_file, copy_to_output
 
 def _before_requests():
     """Executed before each request for this blueprint.
@@ -19,35 +22,33 @@ def _before_requests():
     """
     logger.info('API request [endpoint: "%s"]', request.endpoint)
     file_keys = request.files.keys()
+    forms = {
+        'join.join_dwithin': (JoinDWithinFileForm, JoinDWithinResourceFileForm, JoinDWithinOtherFileForm, JoinDWithinPathForm),
+        'join.join_nearest': (JoinNearestFileForm, JoinNearestResourceFileForm, JoinNearestOtherFileForm, JoinNearestPathForm),
+    }.get(request.endpoint, (JoinFileForm, JoinResourceFileForm, JoinOtherFileForm, JoinPathForm))
     if 'resource' in file_keys and 'other' in file_keys:
-        form = JoinDWithinFileForm() if request.endpoint == 'join.join_dwithin' else JoinFileForm()
+        form = forms[0]()
     elif 'resource' in file_keys:
-        form = JoinDWithinResourceFileForm() if request.endpoint == 'join.join_dwithin' else JoinResourceFileForm()
+        form = forms[1]()
     elif 'other' in file_keys:
-        form = JoinDWithinOtherFileForm() if request.endpoint == 'join.join_dwithin' else JoinOtherFileForm()
+        form = forms[2]()
     else:
-        form = JoinDWithinPathForm() if request.endpoint == 'join.join_dwithin' else JoinPathForm()
+        form = forms[3]()
     if not form.validate_on_submit():
         return make_response(form.errors, 400)
 
     session = get_session()
 
-    if 'resource' in request.files.keys():
-        left_filename = secure_filename(form.resource.data.filename)
-        left_file = os.path.join(session['working_path'], left_filename)
-        form.resource.data.save(left_file)
+    g.left_file, left_dataset = get_resource(form, session)
+    right_dataset = False
+    if form.other_layer.data and 'other' not in file_keys:
+        try:
+            g.right_file = resolve_layer(form.other_layer.data)
+        except Exception as e:
+            logger.error('Could not load pinned layer [name="%s", error="%s"]', form.other_layer.data, e)
+            return make_response({'error': 'Could not load pinned layer.'}, 500)
     else:
-        left_file = os.path.join(os.environ['INPUT_DIR'], form.resource.data)
-
-    if 'other' in request.files.keys():
-        right_filename = secure_filename(form.other.data.filename)
-        right_file = os.path.join(session['working_path'], right_filename)
-        form.other.data.save(right_file)
-    else:
-        right_file = os.path.join(os.environ['INPUT_DIR'], form.other.data)
-
-    g.left_file = left_file
-    g.right_file = right_file
+        g.right_file, right_dataset = get_resource(form, session, field='other', dataset_field='other_dataset')
     g.form = form
     g.session = session
 
@@ -55,7 +56,11 @@ def _before_requests():
     left_crs = form.crs.data if form.crs.data != '' else None
     right_read_options = parse_read_options(form, prefix="other_")
     right_crs = form.other_crs.data if form.other_crs.data != '' else None
-    g.parameters = {'left_crs': left_crs, 'left_read_options': left_read_options, 'right_crs': right_crs, 'right_read_options': right_read_options}
+    g.parameters = {'left_crs': left_crs, 'left_read_options': left_read_options, 'right_crs': right_crs, 'right_read_options': right_read_options, 'output': form.output.data or 'file', 'limit': form.limit.data, 'output_format': form.output_format.data or 'native', 'left_dataset': left_dataset, 'right_dataset': right_dataset}
+    if form.aggregate.data:
+        if form.how.data == 'right':
+            return make_response({'how': ["Aggregate joins keep the left features; must be 'left' or 'inner'."]}, 400)
+        g.parameters['aggregates'] = read_aggregates(form.aggregates.data)
 
 
 def _join(predicate, **kwargs):
@@ -83,6 +88,9 @@ def _join(predicate, **kwargs):
             return make_response({'error': error_msg}, 500)
         elif export is None:
             return make_response({}, 204)
+        elif isinstance(export, dict):
+            db_update_queue_status(ticket, completed=True, success=True)
+            return make_response({'type': 'prompt', 'result': export}, 200)
         if g.form.download.data:
             db_update_queue_status(ticket, completed=True, success=True)
             return send_file(export)
@@ -93,7 +101,7 @@ def _join(predicate, **kwargs):
 
     # Deferred Response
     future = executor.submit(join_process, g.session, g.left_file, g.right_file, predicate, how=g.form.how.data, **column_fix, **kwargs)
-    future.add_done_callback(async_callback)
+    future.add_done_callback(partial(async_callback, working_path=g.session['working_path']))
     ticket = g.session['ticket']
     return make_response({'type': 'deferred', 'ticket': ticket, 'statusUri': "/jobs/status?ticket={ticket}".format(ticket=ticket)}, 202)
 
@@ -231,3 +239,35 @@ def join_dwithin():
             400: validationErrorResponse
     """
     return _join('dwithin', distance=g.form.distance.data, **g.parameters)
+
+@bp.route('/nearest', methods=['POST'])
+def join_nearest():
+    """**Flask POST rule.**
+
+    Spatial join on two spatial files drived by nearest relationship.
+    ---
+    post:
+        summary: Spatial join on two spatial files drived by nearest relationship.
+        description: Create a new spatial file joining each feature of the **resource** dataset with its *k* nearest features of the **other**, optionally up to a maximum distance. The new file contains attributes from both datasets, prefixed and suffixed according to the given parameters, the *distance* of the joined features, and geometry from the *resource* dataset.
+        tags:
+            - Join
+        parameters:
+            - idempotencyKey
+        requestBody:
+            required: true
+            content:
+                application/x-www-form-urlencoded:
+                    schema: nearestJoinForm
+                multipart/form-data:
+                    schema:
+                        oneOf:
+                            - $ref: "#/components/schemas/nearestJoinFormMultipartBoth"
+                            - $ref: "#/components/schemas/nearestJoinFormMultipartResource"
+                            - $ref: "#/components/schemas/nearestJoinFormMultipartOther"
+        responses:
+            200: promptResultResponse
+            202: deferredResponse
+            204: noContentResponse
+            400: validationErrorResponse
+    """
+    return _join('nearest', k=g.form.k.data, maximum_distance=g.form.maximum_distance.data, **g.parameters)
@@ -0,0 +1,832 @@
+"""Partitioned, parallel spatial join engine.
+
+Both sides are partitioned by a grid over their bounding boxes, with the grid lines placed at quantiles of the box
+centers so that partitions are balanced. A feature is assigned to every cell its box overlaps, and each cell is
+joined independently (in a pool of worker processes) with an R-tree over its right features. A pair of features
+that overlap several cells is found in all of them; it is kept only in the cell containing its reference point,
+i.e. the lower left corner of the intersection of their boxes, so that each pair is reported exactly once.
+
+When the inputs would not fit in memory, the same partitioning is applied out of core: each side is streamed in
+chunks and spilled to on-disk buckets, one per cell, the buckets are joined one at a time per worker, and the
+result is written in parts which are exported without being loaded.
+"""
+import os
+import numpy as np
+import pygeos as pg
+from uuid import uuid4
+from collections import OrderedDict
+from .parallel import parallelism, min_rows, get_pool
+from .layers import Pinned, Layer, get_layer
+
+PREDICATES = ['contains', 'within', 'intersects', 'dwithin']
+
+AGGREGATE_FUNCTIONS = ['sum', 'mean', 'min', 'max']
+
+# Number of partitions per worker, so that uneven partitions are balanced among the workers.
+PARTITIONS_PER_WORKER = 4
+
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3
+
+# Decoded geometries and the R-trees over them take several times the size of the encoded features.
+MEMORY_FACTOR = 4
+
+# Number of left features of each batch of a nearest join.
+DEFAULT_BATCH_SIZE = 10000
+
+# Number of features per side sampled to place the grid lines of an out-of-core join.
+SAMPLE_SIZE = 100000
+
+
+def grid(bounds, partitions):
+    """Places the grid lines at quantiles of the box centers.
+
+    Arguments:
+        bounds (ndarray): Array of shape (N, 4) with the boxes of both sides, without empty ones.
+        partitions (int): The (approximate) number of cells.
+
+    Returns:
+        (tuple): The inner grid lines along x and y.
+    """
+    n = int(np.ceil(np.sqrt(max(partitions, 1))))
+    if n <= 1 or len(bounds) == 0:
+        return np.empty(0), np.empty(0)
+    quantiles = np.arange(1, n) / n
+    xsplits = np.unique(np.quantile((bounds[:, 0] + bounds[:, 2]) / 2, quantiles))
+    ysplits = np.unique(np.quantile((bounds[:, 1] + bounds[:, 3]) / 2, quantiles))
+    return xsplits, ysplits
+
+
+def assign(bounds, xsplits, ysplits):
+    """Assigns each box to all the grid cells it overlaps.
+
+    Arguments:
+        bounds (ndarray): Array of shape (N, 4) with the boxes.
+        xsplits (ndarray): The inner grid lines along x.
+        ysplits (ndarray): The inner grid lines along y.
+
+    Returns:
+        (tuple): Two arrays with the positions of the boxes and the cells, respectively; empty boxes are not assigned.
+    """
+    valid = np.nonzero(~np.isnan(bounds).any(axis=1))[0]
+    bounds = bounds[valid]
+    ix0, ix1 = np.searchsorted(xsplits, bounds[:, 0], side='right'), np.searchsorted(xsplits, bounds[:, 2], side='right')
+    iy0, iy1 = np.searchsorted(ysplits, bounds[:, 1], side='right'), np.searchsorted(ysplits, bounds[:, 3], side='right')
+    nx = ix1 - ix0 + 1
+    counts = nx * (iy1 - iy0 + 1)
+    items = np.repeat(np.arange(len(bounds)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = ix0[items] + offsets % nx[items]
+    cy = iy0[items] + offsets // nx[items]
+    return valid[items], cy * (len(xsplits) + 1) + cx
+
+
+def partition(left_bounds, right_bounds, partitions, distance=None):
+    """Partitions the features of both sides.
+
+    Arguments:
+        left_bounds (ndarray): Array of shape (N, 4) with the boxes of the left features.
+        right_bounds (ndarray): Array of shape (M, 4) with the boxes of the right features.
+        partitions (int): The (approximate) number of partitions.
+
+    Keyword Arguments:
+        distance (float): The distance the left boxes are expanded by, for 'dwithin' joins (default: {None})
+
+    Returns:
+        (tuple): The inner grid lines along x and y, and a list of (cell, left rows, right rows) for each non-empty partition.
+    """
+    left_bounds = np.asarray(left_bounds, dtype=np.float64).reshape(-1, 4)
+    right_bounds = np.asarray(right_bounds, dtype=np.float64).reshape(-1, 4)
+    if distance:
+        left_bounds = left_bounds + np.array([-distance, -distance, distance, distance])
+    both = np.concatenate([left_bounds, right_bounds])
+    xsplits, ysplits = grid(both[~np.isnan(both).any(axis=1)], partitions)
+    groups = []
+    for bounds in (left_bounds, right_bounds):
+        items, cells = assign(bounds, xsplits, ysplits)
+        order = np.argsort(cells, kind='stable')
+        items, cells = items[order], cells[order]
+        keys, starts = np.unique(cells, return_index=True)
+        groups.append(dict(zip(keys.tolist(), np.split(items, starts[1:]))))
+    left_groups, right_groups = groups
+    tasks = [(cell, left_groups[cell], right_groups[cell]) for cell in sorted(set(left_groups) & set(right_groups))]
+    return xsplits, ysplits, tasks
+
+
+def match(left, right, predicate, distance=None):
+    """Finds the pairs of geometries that satisfy a predicate.
+
+    Arguments:
+        left (ndarray): The left pygeos geometries.
+        right (ndarray): The right pygeos geometries.
+        predicate (str): One of 'contains', 'within', 'intersects' (of the left geometry against the right one), 'dwithin'.
+
+    Keyword Arguments:
+        distance (float): The distance for 'dwithin' (default: {None})
+
+    Returns:
+        (tuple): Two arrays with the positions of the matching left and right geometries.
+    """
+    tree = pg.STRtree(right)
+    if predicate == 'dwithin':
+        boxes = pg.bounds(left) + np.array([-distance, -distance, distance, distance])
+        li, ri = tree.query_bulk(pg.box(boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]))
+        keep = pg.distance(left[li], right[ri]) <= distance
+        return li[keep], ri[keep]
+    return tree.query_bulk(left, predicate=predicate)
+
+
+# Arrow files (and their indices) opened by a process; the workers of the pool are long-lived, so only the most
+# recently used ones are kept.
+MAX_OPEN_FILES = 16
+
+_frames = OrderedDict()
+_indices = OrderedDict()
+
+def _cached(cache, key, load):
+    if key in cache:
+        cache.move_to_end(key)
+    else:
+        cache[key] = load()
+        while len(cache) > MAX_OPEN_FILES:
+            cache.popitem(last=False)
+    return cache[key]
+
+
+def _open(file):
+    """Opens an Arrow file, once per process."""
+    import geovaex as gvx
+    return _cached(_frames, file, lambda: gvx.open(file))
+
+
+def _load(source, rows):
+    """Loads the geometries of some rows.
+
+    Arguments:
+        source (str|Pinned|ndarray): An Arrow file, a pinned layer, or an array with all the geometries.
+        rows (ndarray): The row numbers.
+
+    Returns:
+        (ndarray): The pygeos geometries.
+    """
+    if isinstance(source, Pinned):
+        return get_layer(source).geometries[rows]
+    if not isinstance(source, str):
+        return np.asarray(source, dtype=object)[rows]
+    from .geometries import to_pygeos, take
+    return to_pygeos(take(_open(source), rows))
+
+
+def _index(source):
+    """The spatial index of a source (see :func:`_load`); the persisted index of an Arrow file is used, if available."""
+    from .index import SpatialIndex
+    if isinstance(source, Pinned):
+        return get_layer(source).index
+    if not isinstance(source, str):
+        return SpatialIndex.build(pg.bounds(np.asarray(source, dtype=object)))
+    def load():
+        from .geometries import bounds
+        index = SpatialIndex.open(source)
+        return index if index is not None else SpatialIndex.build(bounds(_open(source)))
+    return _cached(_indices, source, load)
+
+
+def join_partition(task):
+    """Joins the features of a single partition.
+
+    Arguments:
+        task (tuple): The left and right sources (see :func:`_load`), the cell, the left and right rows, the inner grid lines along x and y, the predicate and the distance.
+
+    Returns:
+        (tuple): Two arrays with the row numbers of the matching left and right features.
+    """
+    left_source, right_source, cell, left_rows, right_rows, xsplits, ysplits, predicate, distance = task
+    left, right = _load(left_source, left_rows), _load(right_source, right_rows)
+    return _join_cell(left, right, left_rows, right_rows, cell, xsplits, ysplits, predicate, distance)
+
+
+def _join_cell(left, right, left_rows, right_rows, cell, xsplits, ysplits, predicate, distance):
+    """Joins the geometries of a grid cell, keeping the pairs whose reference point lies in the cell."""
+    li, ri = match(left, right, predicate, distance=distance)
+    if len(xsplits) > 0 or len(ysplits) > 0:
+        left_bounds, right_bounds = pg.bounds(left[li]), pg.bounds(right[ri])
+        if distance:
+            left_bounds = left_bounds + np.array([-distance, -distance, distance, distance])
+        x = np.maximum(left_bounds[:, 0], right_bounds[:, 0])
+        y = np.maximum(left_bounds[:, 1], right_bounds[:, 1])
+        reference = np.searchsorted(ysplits, y, side='right') * (len(xsplits) + 1) + np.searchsorted(xsplits, x, side='right')
+        keep = reference == cell
+        li, ri = li[keep], ri[keep]
+    return left_rows[li], right_rows[ri]
+
+
+# The predicates with swapped arguments, so that the prepared geometries of a resident side are tested.
+SWAPPED_PREDICATES = {'contains': 'within', 'within': 'contains', 'intersects': 'intersects', 'dwithin': 'dwithin'}
+
+# Number of broadcast sides kept resident by a process, besides the pinned layers.
+MAX_RESIDENT = 4
+
+_residents = OrderedDict()
+
+def _resident(source):
+    """The resident data (see :class:`layers.Layer`) of a broadcast side, loaded once per process.
+
+    Arguments:
+        source (str|Pinned|Layer|ndarray): An Arrow file, a pinned layer, a layer built from an array (identified by its name), or an array with all the geometries.
+
+    Returns:
+        (Layer): The prepared geometries and their index.
+    """
+    if isinstance(source, Pinned):
+        return get_layer(source)
+    if not isinstance(source, (str, Layer)):
+        return Layer.from_geometries(None, source)
+    key = source if isinstance(source, str) else source.name
+    if key in _residents:
+        _residents.move_to_end(key)
+    else:
+        if isinstance(source, str):
+            layer = Layer(source, source)
+        else:
+            # Prepared geometries are not pickled, so a layer passed to a worker process is prepared once there.
+            pg.prepare(source.geometries)
+            layer = source
+        _residents[key] = layer
+        while len(_residents) > MAX_RESIDENT:
+            _residents.popitem(last=False)
+    return _residents[key]
+
+
+def join_broadcast_batch(task):
+    """Joins a batch of left features with a resident (broadcast) right side, through its index and prepared geometries.
+
+    Arguments:
+        task (tuple): The left and right sources (see :func:`_load`), the left rows and their boxes, the predicate and the distance.
+
+    Returns:
+        (tuple): Two arrays with the row numbers of the matching left and right features.
+    """
+    left_source, right_source, left_rows, boxes, predicate, distance = task
+    layer = _resident(right_source)
+    if distance:
+        boxes = boxes + np.array([-distance, -distance, distance, distance])
+    queries, rows = layer.index.query_bulk(boxes)
+    # Only the left features with a candidate are decoded.
+    candidates, inverse = np.unique(queries, return_inverse=True)
+    left = _load(left_source, left_rows[candidates])[inverse]
+    right = layer.geometries[rows]
+    if predicate == 'dwithin':
+        keep = pg.distance(left, right) <= distance
+    else:
+        keep = getattr(pg, SWAPPED_PREDICATES[predicate])(right, left)
+    return left_rows[queries[keep]], rows[keep]
+
+
+def join_pairs(left, right, left_bounds, right_bounds, predicate, distance=None, workers=None, broadcast=False):
+    """Finds all the pairs of left and right features that satisfy a predicate.
+
+    Arguments:
+        left (str|ndarray): The left Arrow file, or an array with the left geometries.
+        right (str|Pinned|ndarray): The right Arrow file, a pinned layer, or an array with the right geometries.
+        left_bounds (ndarray): Array of shape (N, 4) with the boxes of the left features; features with empty (NaN) boxes are not joined.
+        right_bounds (ndarray): Array of shape (M, 4) with the boxes of the right features; ignored for a broadcast side.
+        predicate (str): One of 'contains', 'within', 'intersects', 'dwithin'.
+
+    Keyword Arguments:
+        distance (float): The distance for 'dwithin' (default: {None})
+        workers (int): The number of workers, used to size the partitions; with one worker, or for small joins, the join runs in the calling process (default: {None}, i.e. the configured parallelism)
+        broadcast (bool): Whether the right side is broadcast, i.e. resident in every worker, instead of partitioned; a pinned layer is always broadcast (default: {False})
+
+    Returns:
+        (tuple): Two arrays with the row numbers of the matching left and right features, sorted by left and then right row.
+    """
+    if predicate not in PREDICATES:
+        raise ValueError("predicate could be one of {predicates}.".format(predicates=', '.join(PREDICATES)))
+    workers = workers if workers is not None else parallelism()
+    left_bounds = np.asarray(left_bounds, dtype=np.float64).reshape(-1, 4)
+    resident = None
+    if broadcast or isinstance(right, Pinned):
+        # The right side is resident in every worker, so only the left side is split, in batches.
+        if len(left_bounds) < min_rows():
+            workers = 1
+        if not isinstance(right, (str, Pinned)):
+            # An array is prepared and indexed once, instead of once per batch.
+            right = resident = Layer.from_geometries(str(uuid4()), right)
+        valid = np.flatnonzero(~np.isnan(left_bounds).any(axis=1))
+        batch_size = DEFAULT_BATCH_SIZE * PARTITIONS_PER_WORKER
+        tasks = [(left, right, valid[start:start + batch_size], left_bounds[valid[start:start + batch_size]], predicate, distance)
+            for start in range(0, len(valid), batch_size)]
+        function = join_broadcast_batch
+    else:
+        if len(left_bounds) + len(right_bounds) < min_rows():
+            workers = 1
+        partitions = 1 if workers == 1 else workers * PARTITIONS_PER_WORKER
+        xsplits, ysplits, tasks = partition(left_bounds, right_bounds, partitions, distance=distance)
+        tasks = [(left, right, cell, left_rows, right_rows, xsplits, ysplits, predicate, distance) for cell, left_rows, right_rows in tasks]
+        function = join_partition
+    try:
+        if workers == 1 or len(tasks) <= 1:
+            results = [function(task) for task in tasks]
+        else:
+            results = list(get_pool().map(function, tasks))
+    finally:
+        if resident is not None:
+            _residents.pop(resident.name, None)
+    left_rows = np.concatenate([np.empty(0, dtype=np.int64)] + [result[0] for result in results]).astype(np.int64)
+    right_rows = np.concatenate([np.empty(0, dtype=np.int64)] + [result[1] for result in results]).astype(np.int64)
+    order = np.lexsort((right_rows, left_rows))
+    return left_rows[order], right_rows[order]
+
+
+def nearest_batch(task):
+    """Finds the k nearest right features of a batch of left features.
+
+    The boxes of all the left features are expanded by a search radius and looked up at once in the index of the
+    right side; since every feature within the radius is a candidate, a left feature with at least k features
+    within the radius is resolved. The radius of the rest is doubled, until it exceeds the maximum distance or the
+    expanded box covers the whole right side; then all the right features are candidates, so the k nearest of them
+    are kept, however far.
+
+    Arguments:
+        task (tuple): The left and right sources (see :func:`_load`), the left rows, k, the maximum distance (or None), the initial radius and the index of the right side (or None, for the index of the source).
+
+    Returns:
+        (tuple): Three arrays with the left and right row numbers and the distance of each pair.
+    """
+    left_source, right_source, left_rows, k, max_distance, radius, index = task
+    index = index if index is not None else _index(right_source)
+    left = _load(left_source, left_rows)
+    left_bounds = pg.bounds(left)
+    pending = np.flatnonzero(~np.isnan(left_bounds).any(axis=1))
+    result = ([], [], [])
+    extent = np.asarray(index.total_bounds, dtype=np.float64)
+    if index.num_items == 0 or np.isnan(extent).any():
+        pending = pending[:0]
+    radii = np.full(len(pending), radius if max_distance is None else min(radius, max_distance))
+    while len(pending) > 0:
+        boxes = left_bounds[pending] + np.column_stack([-radii, -radii, radii, radii])
+        queries, rows = index.query_bulk(boxes)
+        unique, inverse = np.unique(rows, return_inverse=True)
+        covers = (boxes[:, 0] <= extent[0]) & (boxes[:, 1] <= extent[1]) & (boxes[:, 2] >= extent[2]) & (boxes[:, 3] >= extent[3])
+        # Features beyond the radius could be farther than others outside the box, unless the box covers the extent.
+        limits = np.where(covers, np.inf if max_distance is None else max_distance, radii)
+        with np.errstate(invalid='ignore'):
+            distances = pg.distance(left[pending[queries]], _load(right_source, unique)[inverse])
+            keep = distances <= limits[queries]
+        queries, rows, distances = queries[keep], rows[keep], distances[keep]
+        resolved = (np.bincount(queries, minlength=len(pending)) >= k) | covers
+        if max_distance is not None:
+            resolved |= radii >= max_distance
+        order = np.lexsort((rows, distances, queries))
+        queries, rows, distances = queries[order], rows[order], distances[order]
+        starts = np.searchsorted(queries, queries)
+        keep = resolved[queries] & (np.arange(len(queries)) - starts < k)
+        result[0].append(left_rows[pending[queries[keep]]])
+        result[1].append(rows[keep])
+        result[2].append(distances[keep])
+        pending, radii = pending[~resolved], radii[~resolved] * 2
+        if max_distance is not None:
+            radii = np.minimum(radii, max_distance)
+    return tuple(np.concatenate([np.empty(0, dtype=dtype)] + values).astype(dtype) for values, dtype in zip(result, [np.int64, np.int64, np.float64]))
+
+
+def nearest_pairs(left, right, num_left, k=1, max_distance=None, workers=None, batch_size=None):
+    """Finds the k nearest right features of each left feature.
+
+    The left features are processed in batches, in parallel.
+
+    Arguments:
+        left (str|ndarray): The left Arrow file, or an array with the left geometries.
+        right (str|Pinned|ndarray): The right Arrow file, a pinned layer, or an array with the right geometries.
+        num_left (int): The number of left features.
+
+    Keyword Arguments:
+        k (int): The number of nearest features (default: {1})
+        max_distance (float): The maximum distance of the features (default: {None})
+        workers (int): The number of workers; with one worker, or for small joins, the join runs in the calling process (default: {None}, i.e. the configured parallelism)
+        batch_size (int): The number of left features of each batch (default: {None}, i.e. the default batch size)
+
+    Returns:
+        (tuple): Three arrays with the left and right row numbers and the distance of each pair, sorted by left row and distance.
+    """
+    index = _index(right)
+    workers = workers if workers is not None else parallelism()
+    if num_left + index.num_items < min_rows():
+        workers = 1
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    # The initial radius is the one expected to enclose k features, if they were uniformly spread.
+    minx, miny, maxx, maxy = index.total_bounds if index.num_items > 0 else [0.] * 4
+    diagonal = np.hypot(maxx - minx, maxy - miny)
+    radius = np.sqrt(k * (maxx - minx) * (maxy - miny) / (np.pi * max(index.num_items, 1)))
+    radius = float(max(radius, k * diagonal / max(index.num_items, 1), 1e-9)) if np.isfinite(radius) else 1.
+    # The index of an array is built once here, instead of once per batch; the index of a file is cached by each worker.
+    shared = index if not isinstance(right, (str, Pinned)) else None
+    tasks = [(left, right, np.arange(start, min(start + batch_size, num_left)), k, max_distance, radius, shared) for start in range(0, num_left, batch_size)]
+    if workers == 1 or len(tasks) <= 1:
+        results = [nearest_batch(task) for task in tasks]
+    else:
+        results = list(get_pool().map(nearest_batch, tasks))
+    left_rows = np.concatenate([np.empty(0, dtype=np.int64)] + [result[0] for result in results]).astype(np.int64)
+    right_rows = np.concatenate([np.empty(0, dtype=np.int64)] + [result[1] for result in results]).astype(np.int64)
+    distances = np.concatenate([np.empty(0)] + [result[2] for result in results]).astype(np.float64)
+    order = np.lexsort((distances, left_rows))
+    return left_rows[order], right_rows[order], distances[order]
+
+
+def join_rows(left_rows, right_rows, num_left, num_right, how='inner', distances=None):
+    """Adds the unmatched features to the matching pairs, according to the type of the join.
+
+    Arguments:
+        left_rows (ndarray): The row numbers of the matching left features.
+        right_rows (ndarray): The row numbers of the matching right features.
+        num_left (int): The number of left features.
+        num_right (int): The number of right features.
+
+    Keyword Arguments:
+        how (str): 'left' keeps all the left features, 'right' all the right features, 'inner' only the matching ones (default: {'inner'})
+        distances (ndarray): The distance of each pair, which is carried along (default: {None})
+
+    Returns:
+        (tuple): The left and right row numbers of the result, with -1 for a missing feature, followed by the distances (NaN for a missing feature) if given.
+    """
+    if distances is None:
+        distances_ = np.full(len(left_rows), np.nan)
+    else:
+        distances_ = np.asarray(distances, dtype=np.float64)
+    if how == 'left':
+        unmatched = np.setdiff1d(np.arange(num_left), left_rows)
+        left_rows = np.concatenate([left_rows, unmatched])
+        right_rows = np.concatenate([right_rows, np.full(len(unmatched), -1, dtype=np.int64)])
+        order = np.argsort(left_rows, kind='stable')
+    elif how == 'right':
+        unmatched = np.setdiff1d(np.arange(num_right), right_rows)
+        left_rows = np.concatenate([left_rows, np.full(len(unmatched), -1, dtype=np.int64)])
+        right_rows = np.concatenate([right_rows, unmatched])
+        order = np.lexsort((left_rows, right_rows))
+    else:
+        unmatched = []
+        order = np.arange(len(left_rows))
+    distances_ = np.concatenate([distances_, np.full(len(unmatched), np.nan)])[order]
+    if distances is None:
+        return left_rows[order], right_rows[order]
+    return left_rows[order], right_rows[order], distances_
+
+
+def memory_budget():
+    """The memory a spatial join may use.
+
+    Returns:
+        (int): The value of environment variable JOIN_MEMORY_BUDGET in bytes, or 2 GiB.
+    """
+    return int(os.getenv('JOIN_MEMORY_BUDGET', DEFAULT_MEMORY_BUDGET))
+
+
+def estimate_memory(*files):
+    """Estimates the memory needed to join datasets in memory.
+
+    Arguments:
+        *files (str): The Arrow files of the datasets.
+
+    Returns:
+        (int): The estimated size in bytes.
+    """
+    return MEMORY_FACTOR * sum(os.path.getsize(file) for file in files)
+
+
+def _bucket(directory, side, cell):
+    return os.path.join(directory, '{side}_{cell}'.format(side=side, cell=cell))
+
+
+def _append_bucket(prefix, rows, wkb):
+    """Appends features to an on-disk bucket.
+
+    Arguments:
+        prefix (str): The path of the bucket files, without extension.
+        rows (ndarray): The row numbers of the features.
+        wkb (ndarray): The geometries as WKB.
+    """
+    with open(prefix + '.rows', 'ab') as f:
+        np.asarray(rows, dtype=np.int64).tofile(f)
+    with open(prefix + '.len', 'ab') as f:
+        np.array([len(value) for value in wkb], dtype=np.int64).tofile(f)
+    with open(prefix + '.wkb', 'ab') as f:
+        f.write(b''.join(wkb))
+
+
+def _read_bucket(prefix):
+    """Reads and removes an on-disk bucket.
+
+    Arguments:
+        prefix (str): The path of the bucket files, without extension.
+
+    Returns:
+        (tuple): The row numbers and the pygeos geometries of the features.
+    """
+    rows = np.fromfile(prefix + '.rows', dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(np.fromfile(prefix + '.len', dtype=np.int64))])
+    with open(prefix + '.wkb', 'rb') as f:
+        data = f.read()
+    wkb = np.empty(len(rows), dtype=object)
+    wkb[:] = [data[offsets[i]:offsets[i + 1]] for i in range(len(rows))]
+    _remove_bucket(prefix)
+    return rows, pg.from_wkb(wkb)
+
+
+def _remove_bucket(prefix):
+    for extension in ['.rows', '.len', '.wkb']:
+        try:
+            os.remove(prefix + extension)
+        except OSError:
+            pass
+
+
+def _sample_bounds(gdf, size=SAMPLE_SIZE):
+    """The bounds of evenly spaced features, which are spatially spread since the rows are sorted along a curve."""
+    from .geometries import bounds, take
+    if len(gdf) == 0:
+        return np.empty((0, 4))
+    return bounds(take(gdf, np.unique(np.linspace(0, len(gdf) - 1, min(len(gdf), size)).astype(np.int64))))
+
+
+def spill(gdf, directory, side, xsplits, ysplits, distance=None, chunk_size=None):
+    """Streams the features of one side into on-disk buckets, one per grid cell they overlap.
+
+    Arguments:
+        gdf (obj): The GeoDataFrame.
+        directory (str): The directory of the buckets.
+        side (str): 'left' or 'right'.
+        xsplits (ndarray): The inner grid lines along x.
+        ysplits (ndarray): The inner grid lines along y.
+
+    Keyword Arguments:
+        distance (float): The distance the boxes are expanded by, for 'dwithin' joins (default: {None})
+        chunk_size (int): The number of features read at once (default: {None}, i.e. the default chunk size)
+
+    Returns:
+        (dict): The number of features of each non-empty bucket.
+    """
+    from .geometries import DEFAULT_CHUNK_SIZE, chunks, bounds as bounds_
+    counts = {}
+    for start, chunk in chunks(gdf, chunk_size or DEFAULT_CHUNK_SIZE):
+        wkb = chunk.geometry.to_numpy()
+        bounds = bounds_(chunk)
+        if distance:
+            bounds = bounds + np.array([-distance, -distance, distance, distance])
+        items, cells = assign(bounds, xsplits, ysplits)
+        order = np.argsort(cells, kind='stable')
+        items, cells = items[order], cells[order]
+        keys, starts = np.unique(cells, return_index=True)
+        for cell, positions in zip(keys.tolist(), np.split(items, starts[1:])):
+            _append_bucket(_bucket(directory, side, cell), positions + start, wkb[positions])
+            counts[cell] = counts.get(cell, 0) + len(positions)
+    return counts
+
+
+def join_bucket(task):
+    """Joins the on-disk buckets of a grid cell, and writes the pairs found to disk.
+
+    Arguments:
+        task (tuple): The directory of the buckets, the cell, the inner grid lines along x and y, the predicate and the distance.
+
+    Returns:
+        (tuple): The file with the pairs, as array of shape (N, 2) with the left and right row numbers, and their number.
+    """
+    directory, cell, xsplits, ysplits, predicate, distance = task
+    left_rows, left = _read_bucket(_bucket(directory, 'left', cell))
+    right_rows, right = _read_bucket(_bucket(directory, 'right', cell))
+    left_rows, right_rows = _join_cell(left, right, left_rows, right_rows, cell, xsplits, ysplits, predicate, distance)
+    file = os.path.join(directory, 'pairs_{cell}.npy'.format(cell=cell))
+    np.save(file, np.column_stack([left_rows, right_rows]).astype(np.int64))
+    return file, len(left_rows)
+
+
+def join_out_of_core(left, right, predicate, directory, estimate, how='inner', distance=None, aggregates=None, budget=None, workers=None, chunk_size=None, **kwargs):
+    """Joins datasets that do not fit in memory, spilling to disk.
+
+    The grid is sized so that the buckets joined concurrently by the workers fit in the memory budget. The result
+    is written in Arrow parts of bounded size, which are opened (not loaded) as a single GeoDataFrame; its rows are
+    grouped by partition rather than sorted.
+
+    Arguments:
+        left (obj): The left GeoDataFrame.
+        right (obj): The right GeoDataFrame.
+        predicate (str): One of 'contains', 'within', 'intersects', 'dwithin'.
+        directory (str): The directory for the buckets and the parts of the result; it should outlive the result.
+        estimate (int): The estimated size of the join in memory (see :func:`estimate_memory`).
+        **kwargs: The prefixes and suffixes of the attributes (see :func:`geometries.join_frames`).
+
+    Keyword Arguments:
+        how (str): How to join, one of 'left', 'right', 'inner' (default: {'inner'})
+        distance (float): The distance for 'dwithin' (default: {None})
+        aggregates (list): The (column, function) pairs of an aggregate join, which returns each left feature with its aggregates instead of the pairs (default: {None})
+        budget (int): The memory budget in bytes (default: {None}, i.e. the configured budget)
+        workers (int): The number of workers, used to size the buckets; with one worker, the join runs in the calling process (default: {None}, i.e. the configured parallelism)
+        chunk_size (int): The number of features read, or written, at once (default: {None}, i.e. the default chunk size)
+
+    Returns:
+        (obj): The joined GeoDataFrame.
+    """
+    from .geometries import DEFAULT_CHUNK_SIZE, join_frames, aggregate_frame, export_arrow, concat
+    if predicate not in PREDICATES:
+        raise ValueError("predicate could be one of {predicates}.".format(predicates=', '.join(PREDICATES)))
+    budget = budget if budget is not None else memory_budget()
+    workers = workers if workers is not None else parallelism()
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    os.makedirs(directory, exist_ok=True)
+    buckets = max(workers * PARTITIONS_PER_WORKER, int(np.ceil(estimate * workers / max(budget, 1))))
+    sample = np.concatenate([
+        _sample_bounds(left) + (np.array([-distance, -distance, distance, distance]) if distance else 0),
+        _sample_bounds(right)
+    ])
+    xsplits, ysplits = grid(sample[~np.isnan(sample).any(axis=1)], buckets)
+    left_counts = spill(left, directory, 'left', xsplits, ysplits, distance=distance, chunk_size=chunk_size)
+    right_counts = spill(right, directory, 'right', xsplits, ysplits, chunk_size=chunk_size)
+    cells = sorted(set(left_counts) & set(right_counts))
+    for side, counts in [('left', left_counts), ('right', right_counts)]:
+        for cell in set(counts) - set(cells):
+            _remove_bucket(_bucket(directory, side, cell))
+    tasks = [(directory, cell, xsplits, ysplits, predicate, distance) for cell in cells]
+    if workers == 1 or len(tasks) <= 1:
+        results = [join_bucket(task) for task in tasks]
+    else:
+        results = list(get_pool().map(join_bucket, tasks))
+
+    parts = []
+    def write(gdf):
+        part = os.path.join(directory, 'part_{index}.arrow'.format(index=len(parts)))
+        export_arrow(gdf, part)
+        parts.append(part)
+
+    if aggregates is not None:
+        aggregator = Aggregator(len(left), aggregates)
+        for file, count in results:
+            pairs = np.load(file)
+            os.remove(file)
+            if count > 0:
+                aggregator.update(pairs[:, 0], aggregate_values(right, pairs[:, 1], aggregator.columns))
+        rows = aggregate_rows(aggregator, how=how)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            write(aggregate_frame(left, chunk, aggregator.result(chunk), **kwargs))
+        if len(parts) == 0:
+            return aggregate_frame(left, rows, aggregator.result(rows), **kwargs)
+        return concat(parts)
+
+    def write_pairs(left_rows, right_rows):
+        for start in range(0, len(left_rows), chunk_size):
+            write(join_frames(left, right, left_rows[start:start + chunk_size], right_rows[start:start + chunk_size], how=how, **kwargs))
+
+    matched = np.zeros(len(right) if how == 'right' else len(left), dtype=bool) if how in ['left', 'right'] else None
+    for file, count in results:
+        pairs = np.load(file)
+        os.remove(file)
+        if count == 0:
+            continue
+        if matched is not None:
+            matched[pairs[:, 1] if how == 'right' else pairs[:, 0]] = True
+        write_pairs(pairs[:, 0], pairs[:, 1])
+    if matched is not None:
+        unmatched = np.nonzero(~matched)[0]
+        missing = np.full(len(unmatched), -1, dtype=np.int64)
+        write_pairs(*((missing, unmatched) if how == 'right' else (unmatched, missing)))
+    if len(parts) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return join_frames(left, right, empty, empty, how=how, **kwargs)
+    return concat(parts)
+
+
+def read_aggregates(text):
+    """Reads the aggregates of an aggregate join, given as comma separated *column:function* pairs.
+
+    Arguments:
+        text (str): The aggregates, e.g. 'population:sum,price:mean'; empty for the count only.
+
+    Raises:
+        ValueError: The aggregates could not be read.
+
+    Returns:
+        (list): The (column, function) pairs.
+    """
+    aggregates = []
+    for item in (text or '').split(','):
+        if item.strip() == '':
+            continue
+        column, _, function = item.strip().rpartition(':')
+        if column == '' or function not in AGGREGATE_FUNCTIONS:
+            raise ValueError('Invalid aggregate "{item}": expected column:function, with function one of {functions}.'.format(item=item.strip(), functions=', '.join(AGGREGATE_FUNCTIONS)))
+        if (column, function) not in aggregates:
+            aggregates.append((column, function))
+    return aggregates
+
+
+class Aggregator:
+    """Aggregates the right features matching each left feature, with vectorized group-by over the matching pairs.
+
+    The pairs may be given in several batches, e.g. one per partition of an out-of-core join.
+    """
+
+    def __init__(self, size, aggregates):
+        """Initializes the aggregates.
+
+        Arguments:
+            size (int): The number of left features.
+            aggregates (list): The (column, function) pairs, with function one of 'sum', 'mean', 'min', 'max'.
+        """
+        self.size = size
+        self.aggregates = list(aggregates)
+        self.columns = sorted(set(column for column, _ in self.aggregates))
+        self.count = np.zeros(size, dtype=np.int64)
+        self._sums = {column: np.zeros(size) for column, function in self.aggregates if function in ['sum', 'mean']}
+        self._counts = {column: np.zeros(size, dtype=np.int64) for column, function in self.aggregates if function == 'mean'}
+        self._mins = {column: np.full(size, np.nan) for column, function in self.aggregates if function == 'min'}
+        self._maxs = {column: np.full(size, np.nan) for column, function in self.aggregates if function == 'max'}
+
+
+    def update(self, rows, values):
+        """Adds a batch of matching pairs.
+
+        Arguments:
+            rows (ndarray): The left row number of each pair.
+            values (dict): The values of each aggregated column, for the right feature of each pair.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        self.count += np.bincount(rows, minlength=self.size)
+        values = {column: np.asarray(values[column], dtype=np.float64) for column in self.columns}
+        for column in self._sums:
+            valid = ~np.isnan(values[column])
+            self._sums[column] += np.bincount(rows[valid], weights=values[column][valid], minlength=self.size)
+            if column in self._counts:
+                self._counts[column] += np.bincount(rows[valid], minlength=self.size)
+        if len(self._mins) + len(self._maxs) == 0:
+            return
+        order = np.argsort(rows, kind='stable')
+        rows = rows[order]
+        starts = np.flatnonzero(np.concatenate([[True], rows[1:] != rows[:-1]]))
+        groups = rows[starts]
+        # fmin and fmax ignore missing values.
+        for column in self._mins:
+            self._mins[column][groups] = np.fmin(self._mins[column][groups], np.fmin.reduceat(values[column][order], starts))
+        for column in self._maxs:
+            self._maxs[column][groups] = np.fmax(self._maxs[column][groups], np.fmax.reduceat(values[column][order], starts))
+
+
+    def result(self, rows):
+        """The aggregates of some left features.
+
+        Arguments:
+            rows (ndarray): The left row numbers.
+
+        Returns:
+            (dict): The values of 'count' and of each aggregate, named *column_function*.
+        """
+        result = {'count': self.count[rows]}
+        for column, function in self.aggregates:
+            if function == 'sum':
+                values = self._sums[column][rows]
+            elif function == 'mean':
+                counts = self._counts[column][rows]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    values = np.where(counts > 0, self._sums[column][rows] / counts, np.nan)
+            elif function == 'min':
+                values = self._mins[column][rows]
+            else:
+                values = self._maxs[column][rows]
+            result['{column}_{function}'.format(column=column, function=function)] = values
+        return result
+
+
+def aggregate_values(right, right_rows, columns):
+    """Reads the values of the aggregated columns for the matching right features.
+
+    Arguments:
+        right (obj): The right GeoDataFrame.
+        right_rows (ndarray): The right row number of each pair.
+        columns (list): The aggregated columns.
+
+    Raises:
+        ValueError: A column is missing or not numeric.
+
+    Returns:
+        (dict): The values of each column, as floats with NaN for missing values.
+    """
+    from .geometries import take
+    missing = [column for column in columns if column not in right.get_column_names()]
+    if len(missing) > 0:
+        raise ValueError('Aggregated columns not found in the other dataset: {columns}.'.format(columns=', '.join(missing)))
+    matched = take(right, right_rows)
+    values = {}
+    for column in columns:
+        value = np.ma.asarray(matched.evaluate(column))
+        if value.dtype.kind not in 'biuf':
+            raise ValueError('Aggregated column "{column}" is not numeric.'.format(column=column))
+        # Missing values of masked columns become NaN, which the aggregates ignore.
+        values[column] = np.ma.filled(value.astype(np.float64), np.nan)
+    return values
+
+
+def aggregate_rows(aggregator, how='inner'):
+    """The left features of an aggregate join: all for 'left' joins, otherwise those with at least one match."""
+    if how == 'left':
+        return np.arange(aggregator.size)
+    return np.flatnonzero(aggregator.count > 0)
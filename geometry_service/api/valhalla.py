@@ -1,26 +1,209 @@
 import os
-import json
+import threading
+from time import monotonic
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from shapely.geometry import shape
 import pygeos as pg
+from geometry_service.loggers import logger
+
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+DEFAULT_MAX_CONTOURS = 4
 
 class ValhallaException(Exception):
     """Raised when Valhalla service returns error."""
 
+class ValhallaUnavailable(ValhallaException):
+    """Raised when Valhalla service could not be reached, or has been failing."""
+
+
+class CircuitBreaker:
+    """Stops requesting a failing service for a while.
+
+    After *threshold* consecutive failures the circuit opens, and requests fail immediately; once *reset_timeout*
+    seconds have elapsed, a single trial request is allowed, which closes the circuit if it succeeds.
+    """
+
+    def __init__(self, threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """Whether the circuit is open."""
+        return self._opened is not None
+
+    def allow(self):
+        """Whether a request is allowed."""
+        with self._lock:
+            if self._opened is None:
+                return True
+            if not self._trial and monotonic() - self._opened >= self.reset_timeout:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        """Records a successful request."""
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+
+    def failure(self):
+        """Records a failed request."""
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                if self._opened is None:
+                    logger.warning('Valhalla circuit opened [failures=%d]', self._failures)
+                self._opened = monotonic()
+            self._trial = False
+
+
 class Valhalla:
+    """Client of the Valhalla routing service.
+
+    The client keeps a pool of persistent connections and retries failed requests with exponential backoff; use
+    :func:`get_client` to share one client per process.
+    """
+
+    def __init__(self, url=None, connect_timeout=None, read_timeout=None, retries=None, backoff=None, breaker=None, max_contours=None):
+        """Initializes the client.
+
+        Keyword Arguments:
+            url (str): The service endpoint (default: {None}, environment variable VALHALLA_URL)
+            connect_timeout (float): The connect timeout in seconds (default: {None}, environment variable VALHALLA_CONNECT_TIMEOUT)
+            read_timeout (float): The read timeout in seconds (default: {None}, environment variable VALHALLA_READ_TIMEOUT)
+            retries (int): The maximum number of retries (default: {None}, environment variable VALHALLA_RETRIES)
+            backoff (float): The backoff factor between retries (default: {None}, environment variable VALHALLA_BACKOFF)
+            breaker (CircuitBreaker): The circuit breaker (default: {None}, i.e. a new one)
+            max_contours (int): The maximum number of contours per isochrone request (default: {None}, environment variable VALHALLA_MAX_CONTOURS)
+        """
+        self.url = (url if url is not None else os.environ['VALHALLA_URL']).rstrip('/')
+        self.timeout = (
+            float(connect_timeout if connect_timeout is not None else os.getenv('VALHALLA_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)),
+            float(read_timeout if read_timeout is not None else os.getenv('VALHALLA_READ_TIMEOUT', DEFAULT_READ_TIMEOUT))
+        )
+        retries = int(retries if retries is not None else os.getenv('VALHALLA_RETRIES', DEFAULT_RETRIES))
+        backoff = float(backoff if backoff is not None else os.getenv('VALHALLA_BACKOFF', DEFAULT_BACKOFF))
+        self.max_contours = max(int(max_contours if max_contours is not None else os.getenv('VALHALLA_MAX_CONTOURS', DEFAULT_MAX_CONTOURS)), 1)
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(max_retries=self._retry(retries, backoff))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @staticmethod
+    def _retry(retries, backoff):
+        """Retry policy for connection errors and transient server errors; requests to the router are idempotent."""
+        options = dict(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+            status_forcelist=[429, 502, 503, 504], raise_on_status=False)
+        try:
+            return Retry(allowed_methods=['GET', 'POST'], **options)
+        except TypeError:
+            # urllib3 < 1.26
+            return Retry(method_whitelist=['GET', 'POST'], **options)
+
+    def _post(self, action, payload):
+        """Posts a request to the service.
 
-    def __init__(self, url=None):
-        self.url = url if url is not None else os.environ['VALHALLA_URL']
+        Arguments:
+            action (str): The service action, e.g. 'isochrone'.
+            payload (dict): The request body.
+
+        Raises:
+            ValhallaUnavailable: The service could not be reached, or the circuit is open.
+
+        Returns:
+            (obj): The response.
+        """
+        if not self.breaker.allow():
+            raise ValhallaUnavailable('Valhalla service is unavailable.')
+        try:
+            r = self.session.post(self.url + '/' + action, json=payload, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self.breaker.failure()
+            raise ValhallaUnavailable('Valhalla service is unavailable: {error}'.format(error=e))
+        if r.status_code >= 500 or r.status_code == 429:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        return r
 
     def isochrone(self, lat, lon, distance=None, time=None, costing="auto"):
-        contours = [{"distance": distance}] if distance is not None else [{"time": time}]
+        if distance is not None:
+            return self.isochrones(lat, lon, [distance], kind='distance', costing=costing)[0]
+        return self.isochrones(lat, lon, [time], kind='time', costing=costing)[0]
+
+    def isochrones(self, lat, lon, contours, kind='time', costing="auto"):
+        """Computes the isochrones of several contours from the same origin.
+
+        The contours are sent together, in as few requests as the limit of contours per request allows.
+
+        Arguments:
+            lat (float): The latitude of the origin.
+            lon (float): The longitude of the origin.
+            contours (list): The contours, i.e. distances or times.
+
+        Keyword Arguments:
+            kind (str): Whether the contours are 'distance' or 'time' (default: {'time'})
+            costing (str): The costing model (default: {'auto'})
+
+        Raises:
+            ValhallaException: The service returned an error.
+
+        Returns:
+            (list): The isochrone of each contour, as pygeos geometry.
+        """
+        result = []
+        for start in range(0, len(contours), self.max_contours):
+            result.extend(self._isochrones(lat, lon, contours[start:start + self.max_contours], kind, costing))
+        return result
+
+    def _isochrones(self, lat, lon, contours, kind, costing):
         locations = [{"lat": lat, "lon": lon}]
-        request_json = {"locations": locations, "polygons": True, "costing": costing, "contours": contours}
-        request_json = json.dumps(request_json)
-        r = requests.get(self.url + '/isochrone?json=' + request_json)
-        geom = r.json()
+        request_json = {"locations": locations, "polygons": True, "costing": costing, "contours": [{kind: contour} for contour in contours]}
+        r = self._post('isochrone', request_json)
         try:
-            wkt = shape(geom['features'][0]['geometry']).to_wkt()
-        except KeyError:
-            raise ValhallaException(geom['error'])
-        return pg.from_wkt(wkt)
+            geom = r.json()
+        except ValueError:
+            raise ValhallaException('Invalid response from Valhalla service [status={status}].'.format(status=r.status_code))
+        try:
+            features = geom['features']
+            # The service returns the features in descending order of contour, each with a *contour* property.
+            by_contour = {float(feature['properties']['contour']): feature for feature in features}
+            wkts = [shape(by_contour[float(contour)]['geometry']).to_wkt() for contour in contours]
+        except (KeyError, TypeError, ValueError):
+            raise ValhallaException(geom.get('error', 'Isochrone not found.') if isinstance(geom, dict) else 'Isochrone not found.')
+        return [pg.from_wkt(wkt) for wkt in wkts]
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(url=None):
+    """Returns the client of the process for a service endpoint, so that connections are reused among requests.
+
+    Keyword Arguments:
+        url (str): The service endpoint (default: {None}, environment variable VALHALLA_URL)
+
+    Returns:
+        (Valhalla): The client.
+    """
+    url = url if url is not None else os.environ['VALHALLA_URL']
+    key = (os.getpid(), url)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = Valhalla(url)
+        return _clients[key]
@@ -4,8 +4,15 @@ import click
 @app.cli.command()
 def init_db():
 	"""Initialize database."""
+	from sqlalchemy import inspect
 	from geometry_service.database import db
 	db.create_all()
+	# Columns added after the table was created.
+	columns = [column['name'] for column in inspect(db.engine).get_columns('queue')]
+	if 'plan' not in columns:
+		db.engine.execute('ALTER TABLE queue ADD COLUMN plan TEXT')
+	if 'datasets' not in columns:
+		db.engine.execute('ALTER TABLE queue ADD COLUMN datasets TEXT')
 
 @app.cli.command()
 @click.argument("path")
@@ -20,3 +27,53 @@ def create_doc(path):
     with open(path, 'w') as specfile:
         json.dump(spec.to_dict(), specfile)
     print("Wrote OpenAPI specification to {path}.".format(path=path))
+
+@app.cli.command()
+@click.option("--workers", type=int, default=None, help="Number of parallel conversions (default: number of cores).")
+@click.option("--watch", is_flag=True, default=False, help="Keep watching the input directory for new or changed files.")
+@click.option("--interval", type=float, default=30., help="Seconds between successive scans when watching.")
+def warm_cache(workers, watch, interval):
+    """Convert the spatial files of the input directory ahead of time.
+
+    Every spatial file (including zip and tar archives of spatial files) found in the input directory is
+    converted and stored in the conversion cache, so that requests for these files do not pay the conversion cost.
+    JSON files are considered only if they are GeoJSON.
+    """
+    import os
+    import time
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from geometry_service.api.cache import ConversionCache, find_spatial_files, warm
+    if not ConversionCache().enabled:
+        raise click.ClickException("Conversion cache is disabled [CACHE_MAX_SIZE=0].")
+    input_dir = os.environ['INPUT_DIR']
+    converted = {}
+    previous = None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            current = {}
+            for file in find_spatial_files(input_dir):
+                try:
+                    stat = os.stat(file)
+                except OSError:
+                    continue
+                current[file] = (stat.st_mtime_ns, stat.st_size)
+            # While watching, a file is converted only once its modification time and size have been the same for
+            # a whole interval, so that files still being written (even at startup) are not converted.
+            pending = [file for file, fingerprint in current.items() if converted.get(file) != fingerprint and (not watch or (previous is not None and previous.get(file) == fingerprint))]
+            if len(pending) > 0:
+                print("Converting {count} file(s) from {path}.".format(count=len(pending), path=input_dir))
+                failed = 0
+                start = time.time()
+                futures = [pool.submit(warm, file) for file in pending]
+                for i, future in enumerate(as_completed(futures), 1):
+                    file, success, error_msg = future.result()
+                    converted[file] = current[file]
+                    if not success:
+                        failed += 1
+                    status = 'OK' if success else 'FAILED ({error})'.format(error=error_msg)
+                    print("[{i}/{total}] {file}: {status}".format(i=i, total=len(futures), file=os.path.relpath(file, input_dir), status=status))
+                print("Converted {count} file(s) in {time:.1f}s, {failed} failed.".format(count=len(futures) - failed, time=time.time() - start, failed=failed))
+            if not watch:
+                break
+            previous = current
+            time.sleep(interval)
@@ -55,3 +55,94 @@ def db_get_active_jobs():
         .all()
 
     return [dict(zip(['ticket', 'idempotencyKey', 'requestType', 'initiated'], job)) for job in jobs]
+
+def db_add_queue_dataset(ticket, key):
+    """Records that a request reads a registered dataset.
+
+    Arguments:
+        ticket (str): Request ticket.
+        key (str): Dataset key.
+
+    Raises:
+        DBItemNotFound -- Ticket not found in table.
+    """
+    elem = Queue.query.filter_by(ticket=ticket).first()
+    if elem is None:
+        raise DBItemNotFound("Item with ticket '{}' not found in table queue.".format(ticket))
+    keys = elem.datasets.split(',') if elem.datasets else []
+    if key not in keys:
+        elem.datasets = ','.join(keys + [key])
+        db.session.add(elem)
+        db.session.commit()
+
+def db_get_dataset_jobs(key):
+    """Returns the active jobs that read a registered dataset, including its registration.
+
+    Arguments:
+        key (str): Dataset key.
+
+    Returns:
+        (list): The tickets of the active jobs.
+    """
+    dataset = Dataset.query.filter_by(key=key).first()
+    condition = Queue.datasets.contains(key)
+    if dataset is not None and dataset.ticket is not None:
+        condition = condition | (Queue.ticket == dataset.ticket)
+    jobs = Queue.query.with_entities(Queue.ticket).filter(Queue.completed==False).filter(condition).all()
+    return [job[0] for job in jobs]
+
+def db_create_dataset(**data):
+    """Add a record to dataset table.
+
+    Arguments:
+        **data: The dataset record data.
+
+    Returns:
+        (dict): The inserted dataset record.
+    """
+    assert 'name' in data.keys()
+    dataset = Dataset(**data)
+    db.session.add(dataset)
+    db.session.commit()
+    return dict(dataset)
+
+def db_update_dataset(key, **data):
+    """Update a dataset record.
+
+    Arguments:
+        key (str): Dataset key.
+        **data: Data to update.
+
+    Raises:
+        DBItemNotFound -- Dataset not found in table.
+    """
+    elem = Dataset.query.filter_by(key=key).first()
+    if elem is None:
+        raise DBItemNotFound("Item with key '{}' not found in table dataset.".format(key))
+    for field in data.keys():
+        setattr(elem, field, data[field])
+    db.session.add(elem)
+    db.session.commit()
+
+def db_delete_dataset(key):
+    """Delete a dataset record.
+
+    Arguments:
+        key (str): Dataset key.
+
+    Raises:
+        DBItemNotFound -- Dataset not found in table.
+    """
+    elem = Dataset.query.filter_by(key=key).first()
+    if elem is None:
+        raise DBItemNotFound("Item with key '{}' not found in table dataset.".format(key))
+    db.session.delete(elem)
+    db.session.commit()
+
+def db_get_datasets():
+    """Returns a list with all the registered datasets.
+
+    Returns:
+        (list): A list with the details of each dataset.
+    """
+    return [dict(dataset) for dataset in Dataset.query.order_by(Dataset.created).all()]
@@ -1 +1,2 @@
 from .queue import Queue
+from .dataset import Dataset
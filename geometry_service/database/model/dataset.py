@@ -0,0 +1,55 @@
+from sqlalchemy.sql import expression
+from sqlalchemy.sql import func
+from geometry_service.database import db
+import uuid
+from hashlib import md5
+
+class Dataset(db.Model):
+    """Dataset Model
+
+    A spatial file registered once and converted ahead of time, so that it can be used in several requests.
+
+    Extends:
+        db.Model
+
+    Attributes:
+        id (int): Primary Key.
+        key (str): The unique key assigned to the dataset.
+        ticket (str): The ticket of the registration request.
+        name (str): The name of the source file.
+        path (str): The path of the converted (Arrow) file.
+        driver (str): The driver of the source file.
+        crs (str): The CRS of the geometries.
+        rows (int): The number of features.
+        minx (float): Minimum x of the dataset bounds.
+        miny (float): Minimum y of the dataset bounds.
+        maxx (float): Maximum x of the dataset bounds.
+        maxy (float): Maximum y of the dataset bounds.
+        created (datetime): The timestamp of the registration.
+        ready (bool): Whether the conversion has been completed.
+    """
+    id = db.Column(db.BigInteger(), primary_key=True)
+    key = db.Column(db.String(511), default=lambda: md5(str(uuid.uuid4()).encode()).hexdigest(), nullable=False, unique=True)
+    ticket = db.Column(db.String(511), nullable=True)
+    name = db.Column(db.String(511), nullable=False)
+    path = db.Column(db.Text(), nullable=True)
+    driver = db.Column(db.String(511), nullable=True)
+    crs = db.Column(db.Text(), nullable=True)
+    rows = db.Column(db.BigInteger(), nullable=True)
+    minx = db.Column(db.Float(), nullable=True)
+    miny = db.Column(db.Float(), nullable=True)
+    maxx = db.Column(db.Float(), nullable=True)
+    maxy = db.Column(db.Float(), nullable=True)
+    created = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    ready = db.Column(db.Boolean(), server_default=expression.false(), nullable=False)
+
+    def __iter__(self):
+        for key in ['key', 'ticket', 'name', 'path', 'driver', 'crs', 'rows', 'created', 'ready']:
+            yield (key, getattr(self, key))
+        yield ('bounds', [self.minx, self.miny, self.maxx, self.maxy] if self.minx is not None else None)
+
+    def get(self, **kwargs):
+        dataset = self.query.filter_by(**kwargs).first()
+        if dataset is None:
+            return None
+        return dict(dataset)
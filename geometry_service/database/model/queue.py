@@ -24,6 +24,8 @@ class Queue(db.Model):
         success (bool): The status of the process.
         error_msg (str): The error message in case of failure.
         result (str): The path of the result.
+        plan (str): The plan of a spatial join, as JSON.
+        datasets (str): The keys of the registered datasets read by the request, comma separated.
     """
     id = db.Column(db.BigInteger(), primary_key=True)
     ticket = db.Column(db.String(511), default=lambda: md5(str(uuid.uuid4()).encode()).hexdigest(), nullable=False, unique=True)
@@ -35,9 +37,11 @@ class Queue(db.Model):
     success = db.Column(db.Boolean(), nullable=True)
     error_msg = db.Column(db.Text(), nullable=True)
     result = db.Column(db.Text(), nullable=True)
+    plan = db.Column(db.Text(), nullable=True)
+    datasets = db.Column(db.Text(), nullable=True)
 
     def __iter__(self):
-        for key in ['ticket', 'idempotency_key', 'request', 'initiated', 'execution_time', 'completed', 'success', 'error_msg', 'result']:
+        for key in ['ticket', 'idempotency_key', 'request', 'initiated', 'execution_time', 'completed', 'success', 'error_msg', 'result', 'plan', 'datasets']:
             yield (key, getattr(self, key))
 
     def get(self, **kwargs):
@@ -1,6 +1,6 @@
 import logging
 import json
-from os import path, environ, listdir
+from os import path, environ, listdir, makedirs
 from time import sleep
 from uuid import uuid4
 
@@ -118,6 +118,11 @@ def test_endpoints_1():
         }
         res = client.post('/constructive/centroid', data=data)
         assert res.status_code == 200
+        for output_format in ['geoparquet', 'arrow', 'flatgeobuf']:
+            res = client.post('/constructive/centroid', data={**data, 'output_format': output_format})
+            assert res.status_code == 200
+        res = client.post('/constructive/centroid', data={**data, 'output_format': 'xlsx'})
+        assert res.status_code == 400
 
 def test_endpoints_2():
     """Functional - Test endpoints: constructive convex_hull"""
@@ -143,6 +148,18 @@ def test_endpoints_3():
         }
         res = client.post('/constructive/simplify', data=data)
         assert res.status_code == 200
+        for pyramid in ['archive', 'column']:
+            res = client.post('/constructive/simplify', data={**data, 'tolerance': '1,5,10', 'pyramid': pyramid})
+            assert res.status_code == 200
+        res = client.post('/constructive/simplify', data={**data, 'tolerance': '1,-5'})
+        assert res.status_code == 400
+        del data['tolerance']
+        data['steps'] = json.dumps([{'action': 'simplify', 'tolerance': 1.}, {'action': 'buffer', 'distance': 10.}, {'action': 'reproject', 'crs': 'EPSG:4326'}])
+        res = client.post('/constructive/pipeline', data=data)
+        assert res.status_code == 200
+        data['steps'] = json.dumps([{'action': 'buffer'}])
+        res = client.post('/constructive/pipeline', data=data)
+        assert res.status_code == 400
 
 def test_endpoints_4():
     """Functional - Test endpoints: filter nearest"""
@@ -155,7 +172,7 @@ def test_endpoints_4():
         res = client.post('/filter/nearest', data=data)
         assert res.status_code == 200
 
-def test_endpoints_4():
+def test_endpoints_filter_within():
     """Functional - Test endpoints: filter within"""
     with app.test_client() as client:
         data = {
@@ -165,8 +182,19 @@ def test_endpoints_4():
         }
         res = client.post('/filter/within', data=data)
         assert res.status_code == 200
+        data['output'] = 'count'
+        res = client.post('/filter/within', data=data)
+        assert res.status_code == 200
+        r = res.get_json()
+        assert r['result']['count'] > 0
+        assert len(r['result']['bounds']) == 4
+        data['output'] = 'summary'
+        data['limit'] = 1
+        res = client.post('/filter/within', data=data)
+        assert res.status_code == 200
+        assert len(res.get_json()['result']['features']['features']) == 1
 
-def test_endpoints_4():
+def test_endpoints_filter_within_buffer():
     """Functional - Test endpoints: filter within_buffer"""
     with app.test_client() as client:
         data = {
@@ -177,6 +205,64 @@ def test_endpoints_4():
         }
         res = client.post('/filter/within_buffer', data=data)
         assert res.status_code == 200
+        data['method'] = 'buffer'
+        res = client.post('/filter/within_buffer', data=data)
+        assert res.status_code == 200
+
+def test_endpoints_filter_batch():
+    """Functional - Test endpoints: filter batch"""
+    with app.test_client() as client:
+        data = {
+            'resource': 'test_data/geo.json',
+            'response': 'prompt',
+            'queries': json.dumps(['POLYGON((47.4 0.5, 50. 1.5, 47.1 1.8, 47.4 0.5))', 'POLYGON((47. 0., 50. 0., 50. 2., 47. 2., 47. 0.))'])
+        }
+        res = client.post('/filter/batch', data=data)
+        assert res.status_code == 200
+        data['layout'] = 'column'
+        res = client.post('/filter/batch', data=data)
+        assert res.status_code == 200
+
+def test_endpoints_filter_travel():
+    """Functional - Test endpoints: travel filters with many origins and contours, against a stub router"""
+    from geometry_service.api import isochrones
+    from ..valhalla_stub import StubRouter
+    url, cache = environ.get('VALHALLA_URL'), isochrones._cache
+    isochrones._cache = isochrones.IsochroneCache(max_entries=0)
+    try:
+        with StubRouter(size=0.01) as router, app.test_client() as client:
+            environ['VALHALLA_URL'] = router.url
+            data = {
+                'resource': 'test_data/geo.json',
+                'response': 'prompt',
+                'output': 'summary',
+                'limit': 10,
+                'origins': json.dumps([{'id': 'A', 'lat': 0.25, 'lon': 48.1}, {'id': 'B', 'lat': 1.1, 'lon': 49.2}]),
+                'times': '5,10'
+            }
+            res = client.post('/filter/travel_time', data=data)
+            assert res.status_code == 200
+            # One request per origin, with both contours.
+            assert router.requests == 2
+            features = res.get_json()['result']['features']['features']
+            found = sorted((feature['properties']['origin_id'], feature['properties']['band']) for feature in features)
+            assert found == [('A', 5.), ('B', 5.)]
+            del data['times']
+            data['distances'] = '1'
+            res = client.post('/filter/travel_distance', data=data)
+            assert res.status_code == 200
+            assert router.requests == 4
+            environ['TRAVEL_MAX_ORIGINS'] = '1'
+            res = client.post('/filter/travel_distance', data=data)
+            assert res.status_code == 400
+            assert router.requests == 4
+    finally:
+        environ.pop('TRAVEL_MAX_ORIGINS', None)
+        if url is None:
+            environ.pop('VALHALLA_URL', None)
+        else:
+            environ['VALHALLA_URL'] = url
+        isochrones._cache = cache
 
 def test_endpoints_5():
     """Functional - Test endpoints: join contains"""
@@ -213,6 +299,16 @@ def test_endpoints_7():
         }
         res = client.post('/join/intersects', data=data)
         assert res.status_code == 200
+        data['aggregate'] = 'true'
+        data['how'] = 'left'
+        data['output'] = 'summary'
+        res = client.post('/join/intersects', data=data)
+        assert res.status_code == 200
+        r = res.get_json()
+        assert all(feature['properties']['r_count'] >= 1 for feature in r['result']['features']['features'])
+        data['how'] = 'right'
+        res = client.post('/join/intersects', data=data)
+        assert res.status_code == 400
 
 def test_endpoints_8():
     """Functional - Test endpoints: join dwithin"""
@@ -227,6 +323,23 @@ def test_endpoints_8():
         res = client.post('/join/dwithin', data=data)
         assert res.status_code == 200
 
+def test_endpoints_9():
+    """Functional - Test endpoints: join nearest"""
+    with app.test_client() as client:
+        data = {
+            'resource': 'test_data/geo.zip',
+            'response': 'prompt',
+            'other': 'test_data/geo.tar.gz',
+            'rprefix': 'r_',
+            'k': 2,
+            'output': 'summary'
+        }
+        res = client.post('/join/nearest', data=data)
+        assert res.status_code == 200
+        r = res.get_json()
+        assert r['result']['count'] > 0
+        assert all(feature['properties']['distance'] >= 0 for feature in r['result']['features']['features'])
+
 def test_working_path_clean_1():
     """Functional - Test clean of working path: prompt"""
     with app.test_client() as client:
@@ -440,3 +553,96 @@ def test_join_with_reprojection_1():
         }
         res = client.post('/join/intersects', data=data)
         assert res.status_code == 200
+
+def test_join_with_reprojection_2():
+    """Functional - Test aggregate join with reprojection"""
+    with app.test_client() as client:
+        data = {
+            'resource': 'test_data/geo.tar.gz',
+            'other': 'test_data/geo.csv',
+            'other_geom': 'WKT',
+            'other_crs': 'EPSG:3857',
+            'response': 'prompt',
+            'rprefix': 'r_',
+            'distance': 100.,
+            'aggregate': 'true',
+            'how': 'left',
+            'output': 'summary'
+        }
+        # Every pair lies within the distance, although the extents in the native CRSs are disjoint.
+        res = client.post('/join/dwithin', data=data)
+        assert res.status_code == 200
+        features = res.get_json()['result']['features']['features']
+        assert len(features) == 3
+        assert all(feature['properties']['r_count'] == 3 for feature in features)
+
+def test_datasets_1():
+    """Functional - Test registered datasets"""
+    with app.test_client() as client:
+        data = {
+            'resource': 'test_data/geo.json',
+            'response': 'prompt'
+        }
+        res = client.post('/datasets', data=data)
+        assert res.status_code == 200
+        dataset = res.get_json().get('dataset')
+        assert dataset['ready']
+        assert dataset['rows'] == 3
+        key = dataset['key']
+        data = {
+            'dataset': key,
+            'response': 'prompt',
+            'wkt': 'POLYGON((47.4 0.5, 50. 1.5, 47.1 1.8, 47.4 0.5))'
+        }
+        res = client.post('/filter/within', data=data)
+        assert res.status_code == 200
+        data = {
+            'dataset': key,
+            'other_dataset': key,
+            'response': 'prompt',
+            'rprefix': 'r_'
+        }
+        res = client.post('/join/intersects', data=data)
+        assert res.status_code == 200
+        res = client.get('/datasets/' + key)
+        assert res.status_code == 200
+        # A dataset read by an unfinished job cannot be deleted.
+        from geometry_service.database.actions import db_queue, db_add_queue_dataset, db_update_queue_status
+        with app.app_context():
+            ticket = db_queue(request='filter.within')['ticket']
+            db_add_queue_dataset(ticket, key)
+        res = client.delete('/datasets/' + key)
+        assert res.status_code == 409
+        assert res.get_json()['tickets'] == [ticket]
+        with app.app_context():
+            db_update_queue_status(ticket, completed=True, success=True)
+        res = client.delete('/datasets/' + key)
+        assert res.status_code == 204
+        res = client.get('/datasets/' + key)
+        assert res.status_code == 404
+
+def test_warm_cache_1():
+    """Functional - Test warming the conversion cache from the command line"""
+    from shutil import copy, rmtree
+    input_dir = path.join(environ['WORKING_DIR'], 'warm_input')
+    cache_dir = path.join(environ['WORKING_DIR'], 'warm_cache')
+    makedirs(input_dir, exist_ok=True)
+    copy(geojson_sample, input_dir)
+    with open(path.join(input_dir, 'package.json'), 'w') as f:
+        json.dump({'name': 'not spatial'}, f)
+    saved = {name: environ.get(name) for name in ['INPUT_DIR', 'CACHE_DIR']}
+    environ.update(INPUT_DIR=input_dir, CACHE_DIR=cache_dir)
+    try:
+        result = app.test_cli_runner().invoke(args=['warm-cache', '--workers', '1'])
+        assert result.exit_code == 0, result.output
+        assert 'Converting 1 file(s)' in result.output
+        assert 'geo.json: OK' in result.output
+        assert len([file for file in listdir(cache_dir) if file.endswith('.arrow')]) == 1
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                environ.pop(name, None)
+            else:
+                environ[name] = value
+        rmtree(input_dir, ignore_errors=True)
+        rmtree(cache_dir, ignore_errors=True)
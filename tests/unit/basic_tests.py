@@ -2,6 +2,7 @@ import logging
 import json
 import os
 from shutil import rmtree
+from uuid import uuid4
 
 # Setup/Teardown
 def setup_module():
@@ -78,4 +79,642 @@ def test_geovaex_1():
     gvx = GeoVaex(path, working_path)
     assert len(gvx.gdf) == 3
     assert gvx.gdf.geometry.crs.to_epsg() == 4326
+    # A converted file, e.g. of a registered dataset, is opened directly.
+    converted = GeoVaex(gvx.arrow_file, working_path, dataset=True)
+    assert len(converted.gdf) == 3 and converted.driver == gvx.driver
+    rmtree(working_path)
+
+def test_cache_1():
+    """Unit - Test conversion cache lookup and eviction"""
+    from geometry_service.api.cache import ConversionCache
+    path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    source = os.path.join(path, 'test_data', 'geo.json')
+    cache_dir = os.path.join(os.environ['WORKING_DIR'], 'cache_test')
+    cache = ConversionCache(path=cache_dir, max_size=15)
+    def convert(arrow_file):
+        with open(arrow_file, 'wb') as f:
+            f.write(b'0' * 10)
+        return {'driver': 'GeoJSON'}
+    key1 = cache.key(source)
+    key2 = cache.key(source, crs='EPSG:4326')
+    assert key1 == cache.key(source)
+    assert key1 != key2
+    assert cache.lookup(key1) is None
+    arrow_file, meta = cache.store(key1, convert)
+    assert os.path.isfile(arrow_file)
+    assert cache.lookup(key1) == (arrow_file, meta)
+    assert meta['driver'] == 'GeoJSON'
+    # The temporary files of a conversion in progress are not evicted.
+    temp_file = os.path.join(cache_dir, '{key}.{uuid}.tmp.arrow'.format(key=key1, uuid=uuid4()))
+    open(temp_file, 'wb').close()
+    cache.store(key2, convert)
+    assert cache.lookup(key1) is None
+    assert cache.lookup(key2) is not None
+    assert os.path.isfile(temp_file)
+    # A directory is identified by the files it contains.
+    directory = os.path.join(os.environ['WORKING_DIR'], 'cache_test_dir')
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'geo.csv'), 'w') as f:
+        f.write('id,WKT\n1,"POINT (0 0)"\n')
+    key = cache.key(directory)
+    with open(os.path.join(directory, 'geo.csv'), 'w') as f:
+        f.write('id,WKT\n1,"POINT (1 1)"\n')
+    assert cache.key(directory) != key
+    rmtree(directory)
+    rmtree(cache_dir)
+
+def test_index_1():
+    """Unit - Test spatial index queries against brute force"""
+    import numpy as np
+    from geometry_service.api.index import SpatialIndex
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0, 100, (1000, 2))
+    size = rng.uniform(0, 2, (1000, 2))
+    bounds = np.hstack([xy, xy + size])
+    bounds[10] = np.nan
+    index = SpatialIndex.build(bounds)
+    file = os.path.join(os.environ['WORKING_DIR'], 'test_index.npy')
+    index.save(file)
+    index = SpatialIndex.load(file)
+    assert np.allclose(index.item_bounds(), bounds, equal_nan=True)
+    queries = np.array([[10., 10., 20., 20.], [50., 50., 50.5, 50.5], [-5., -5., -1., -1.]])
+    rows, items = index.query_bulk(queries)
+    for i, (minx, miny, maxx, maxy) in enumerate(queries):
+        expected = np.nonzero((bounds[:, 0] <= maxx) & (bounds[:, 1] <= maxy) & (bounds[:, 2] >= minx) & (bounds[:, 3] >= miny))[0]
+        assert np.array_equal(np.sort(items[rows == i]), expected)
+        assert np.array_equal(index.query(queries[i]), expected)
+    os.remove(file)
+
+def test_index_3():
+    """Unit - Test k nearest neighbours search against brute force"""
+    import numpy as np
+    from geometry_service.api.index import SpatialIndex
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0, 100, (1000, 2))
+    bounds = np.hstack([xy, xy])
+    bounds[10] = np.nan
+    index = SpatialIndex.build(bounds)
+    point = np.array([40., 60.])
+    distances = np.hypot(xy[:, 0] - point[0], xy[:, 1] - point[1])
+    distances[10] = np.nan
+    measure = lambda rows: distances[rows]
+    rows, dist = index.nearest([40., 60., 40., 60.], measure, k=10)
+    expected = np.argsort(np.where(np.isnan(distances), np.inf, distances))[:10]
+    assert np.array_equal(rows, expected)
+    assert np.allclose(dist, distances[expected])
+    rows, dist = index.nearest([40., 60., 40., 60.], measure, k=10, max_distance=3.)
+    assert (dist <= 3.).all()
+    assert np.array_equal(rows, expected[distances[expected] <= 3.])
+
+def test_index_2():
+    """Unit - Test chunk bounds of Hilbert sorted boxes"""
+    import numpy as np
+    from geometry_service.api.index import ChunkIndex, hilbert_keys
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0, 100, (10000, 2))
+    bounds = np.hstack([xy, xy])
+    bounds = bounds[np.argsort(hilbert_keys(bounds), kind='stable')]
+    chunks = ChunkIndex.build(bounds, chunk_rows=100)
+    query = [10., 10., 20., 20.]
+    rows = chunks.rows(query)
+    expected = np.nonzero((bounds[:, 0] <= 20.) & (bounds[:, 1] <= 20.) & (bounds[:, 2] >= 10.) & (bounds[:, 3] >= 10.))[0]
+    assert np.isin(expected, rows).all()
+    assert len(rows) < len(bounds) / 10
+
+def test_predicates_1():
+    """Unit - Test within against a prepared and subdivided query polygon"""
+    import numpy as np
+    import pygeos as pg
+    from geometry_service.api.predicates import PreparedQuery
+    rng = np.random.default_rng(0)
+    angles = np.linspace(0, 2 * np.pi, 5000, endpoint=False)
+    radii = 0.5 + 0.3 * np.sin(7 * angles) + 0.05 * rng.random(5000)
+    coords = np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])
+    polygon = pg.polygons(np.vstack([coords, coords[:1]]))
+    xy = rng.uniform(-1, 1, (5000, 2))
+    geometries = np.concatenate([pg.points(xy[:4000]), pg.buffer(pg.points(xy[4000:]), 0.02)])
+    expected = pg.within(geometries, polygon)
+    query = PreparedQuery(pg.from_wkb(pg.to_wkb(polygon)), max_vertices=100)
+    assert query.num_cells > 1
+    assert np.array_equal(query.within(geometries), expected)
+    query = PreparedQuery(pg.from_wkb(pg.to_wkb(polygon)), max_vertices=0)
+    assert query.num_cells == 0
+    assert np.array_equal(query.within(geometries), expected)
+
+def test_predicates_2():
+    """Unit - Test reading query geometries"""
+    import json
+    from geometry_service.api.predicates import read_queries
+    polygon = {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 0]]]}
+    collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': 'a', 'geometry': polygon, 'properties': {}},
+        {'type': 'Feature', 'id': 'b', 'geometry': polygon, 'properties': {}}
+    ]}
+    ids, geometries = read_queries(json.dumps(collection))
+    assert ids == ['a', 'b'] and len(geometries) == 2
+    ids, geometries = read_queries(json.dumps(['POINT(0 0)', 'POINT(1 1)', 'POINT(2 2)']))
+    assert ids == [0, 1, 2] and len(geometries) == 3
+    ids, geometries = read_queries('POINT(0 0)\nPOINT(1 1)\n')
+    assert ids == [0, 1]
+    try:
+        read_queries('{"type": "Point"}')
+        assert False
+    except ValueError:
+        pass
+
+def test_predicates_3():
+    """Unit - Test the distance and buffer methods of the within buffer filter near the radius"""
+    import numpy as np
+    import pygeos as pg
+    from geometry_service.api.geovaex import GeoVaex
+    working_path = os.path.join(os.environ['WORKING_DIR'], 'session', 'within_buffer')
+    os.makedirs(working_path, exist_ok=True)
+    angles = np.linspace(0, 2 * np.pi, 24, endpoint=False)
+    # Points and small boxes just inside and just outside the radius, beyond the deviation of the buffer polygon.
+    distances = np.array([5., 9.8, 10.2, 15.])
+    centers = (distances[:, np.newaxis, np.newaxis] * np.stack([np.cos(angles), np.sin(angles)], axis=-1)).reshape(-1, 2)
+    points = pg.points(centers)
+    boxes = pg.box(centers[:, 0] - 0.05, centers[:, 1] - 0.05, centers[:, 0] + 0.05, centers[:, 1] + 0.05)
+    path = os.path.join(working_path, 'features.csv')
+    with open(path, 'w') as f:
+        f.write('id,WKT\n')
+        for i, wkt in enumerate(pg.to_wkt(np.concatenate([points, boxes]))):
+            f.write('{id},"{wkt}"\n'.format(id=i, wkt=wkt))
+    gvx = GeoVaex(path, working_path, crs='EPSG:3857', read_options={'geom': 'WKT'}, cache=False)
+    center = pg.points(0., 0.)
+    rows = gvx._within_buffer(center, 10., method='distance')
+    assert np.array_equal(rows, gvx._within_buffer(center, 10., method='buffer'))
+    ids = np.asarray(gvx.gdf.evaluate('id'))[rows]
+    expected = np.flatnonzero(np.tile(np.repeat(distances < 10., len(angles)), 2))
+    assert np.array_equal(np.sort(ids), expected)
+    try:
+        gvx._within_buffer(center, 10., method='nearest')
+        assert False
+    except ValueError:
+        pass
+    rmtree(working_path)
+
+def test_isochrones_1():
+    """Unit - Test isochrone cache snapping, tiers and expiration"""
+    from time import sleep
+    from uuid import uuid4
+    import pygeos as pg
+    from geometry_service.api.isochrones import IsochroneCache
+    path = os.path.join(os.environ['WORKING_DIR'], 'isochrones_' + str(uuid4()))
+    cache = IsochroneCache(path=path, max_entries=1, max_disk_entries=2, ttl=1, precision=3)
+    polygon = pg.box(0, 0, 1, 1)
+    assert cache.key(37.96831, 23.72221, 'auto', distance=1) == cache.key(37.96829, 23.72219, 'auto', distance=1)
+    assert cache.key(37.968, 23.722, 'auto', distance=1) != cache.key(37.968, 23.722, 'auto', time=1)
+    cache.put('a', polygon)
+    cache.put('b', polygon)
+    assert pg.equals(cache.get('a'), polygon)
+    assert IsochroneCache(path=path, max_entries=1, max_disk_entries=2, ttl=1).get('b') is not None
+    cache.put('c', polygon)
+    assert len(os.listdir(path)) == 2
+    sleep(1.1)
+    assert cache.get('c') is None
+    rmtree(path)
+
+def test_valhalla_1():
+    """Unit - Test Valhalla client against a stub router: retries and circuit breaker"""
+    import pygeos as pg
+    from geometry_service.api.valhalla import Valhalla, CircuitBreaker, ValhallaException, ValhallaUnavailable
+    from ..valhalla_stub import StubRouter
+    with StubRouter(size=0.01) as router:
+        client = Valhalla(router.url, retries=2, backoff=0, breaker=CircuitBreaker(threshold=2, reset_timeout=60))
+        polygon = client.isochrone(37.97, 23.72, distance=1)
+        assert pg.contains(polygon, pg.points(23.72, 37.97))
+        inner, outer = client.isochrones(37.97, 23.72, [5, 10], kind='time')
+        assert pg.contains(outer, inner) and not pg.equals(outer, inner)
+        assert router.requests == 2
+        router.failures = 2
+        assert client.isochrone(37.97, 23.72, time=5) is not None
+        assert router.requests == 5
+        try:
+            client.isochrone(None, None, time=5)
+            assert False
+        except ValhallaException as e:
+            assert not isinstance(e, ValhallaUnavailable)
+        router.failures = 6
+        for _ in range(2):
+            try:
+                client.isochrone(37.97, 23.72, time=5)
+                assert False
+            except ValhallaException:
+                pass
+        assert client.breaker.is_open
+        requests = router.requests
+        try:
+            client.isochrone(37.97, 23.72, time=5)
+            assert False
+        except ValhallaUnavailable:
+            pass
+        assert router.requests == requests
+
+def test_isochrones_2():
+    """Unit - Test reading travel origins and contours"""
+    from geometry_service.api.isochrones import read_origins, read_contours
+    ids, coords = read_origins('[{"id": "A", "lat": 37.9, "lon": 23.7}, {"id": "B", "lat": 38.0, "lon": 23.8}]')
+    assert ids == ['A', 'B'] and coords.shape == (2, 2)
+    ids, coords = read_origins('[[37.9, 23.7], [38.0, 23.8], [38.1, 23.9]]')
+    assert ids == [0, 1, 2] and coords[2, 1] == 23.9
+    for invalid in ['[]', '[[37.9]]', '[{"lat": 91, "lon": 0}]', '{"lat": 37.9, "lon": 23.7}']:
+        try:
+            read_origins(invalid)
+            assert False
+        except ValueError:
+            pass
+    try:
+        read_origins('[[37.9, 23.7], [38.0, 23.8], [38.1, 23.9]]', maximum=2)
+        assert False
+    except ValueError:
+        pass
+    assert read_contours('15,5,10,5') == [5., 10., 15.]
+    assert read_contours('[30, 60]', maximum=60) == [30., 60.]
+    for invalid in ['0,5', '5,abc', '[150]']:
+        try:
+            read_contours(invalid, maximum=120)
+            assert False
+        except ValueError:
+            pass
+
+def test_isochrones_3():
+    """Unit - Test classifying features in travel bands of many origins"""
+    import numpy as np
+    import pygeos as pg
+    from geometry_service.api.geovaex import GeoVaex
+    working_path = os.path.join(os.environ['WORKING_DIR'], 'session', 'isochrones')
+    os.makedirs(working_path, exist_ok=True)
+    path = os.path.join(working_path, 'features.csv')
+    with open(path, 'w') as f:
+        f.write('id,WKT\n')
+        for i, x in enumerate([-2.5, -0.5, 0.5, 1.5, 2.5, 3.5, 5.5, 9.]):
+            f.write('{id},"POINT ({x} 0.25)"\n'.format(id=i, x=x))
+    gvx = GeoVaex(path, working_path, crs='EPSG:4326', read_options={'geom': 'WKT'}, cache=False)
+    # Nested square contours around two origins, with overlapping outer bands.
+    bands = [1., 2., 3.]
+    isochrones = np.array([[pg.box(x - band, -band, x + band, band) for band in bands] for x in [0., 4.]], dtype=object)
+    result = gvx.filter_isochrones(isochrones, ['A', 'B'], bands, output='summary', limit=100)
+    found = [(feature['properties']['id'], feature['properties']['origin_id'], feature['properties']['band']) for feature in result['features']['features']]
+    assert result['count'] == len(found)
+    assert sorted(found) == [(0, 'A', 3.), (1, 'A', 1.), (2, 'A', 1.), (3, 'A', 2.), (3, 'B', 3.), (4, 'A', 3.), (4, 'B', 2.), (5, 'B', 1.), (6, 'B', 2.)]
+    far = np.array([[pg.box(100., 100., 101., 101.)]], dtype=object)
+    assert gvx.filter_isochrones(far, ['C'], [1.], output='count')['count'] == 0
+    rmtree(working_path)
+
+def test_crs_1():
+    """Unit - Test cached CRS objects and vectorized transformation"""
+    import numpy as np
+    import pygeos as pg
+    import pyproj
+    from geometry_service.api.crs import get_crs, get_transformer, to_epsg, transform
+    assert get_crs('EPSG:3857') is get_crs('EPSG:3857')
+    assert get_transformer('EPSG:4326', get_crs('EPSG:3857')) is get_transformer('EPSG:4326', 'EPSG:3857')
+    assert get_transformer(4326, 3857) is get_transformer('EPSG:4326', 'EPSG:3857')
+    assert to_epsg(get_crs('EPSG:2100')) == 2100
+    geometries = np.array([pg.points(23.7, 37.9), pg.box(23., 37., 24., 38.), None], dtype=object)
+    transformed = transform(geometries, 'EPSG:4326', 'EPSG:3857')
+    assert transformed[2] is None and pg.equals(geometries[0], pg.points(23.7, 37.9))
+    x, y = pyproj.Transformer.from_crs('EPSG:4326', 'EPSG:3857', always_xy=True).transform(23.7, 37.9)
+    assert np.allclose(pg.get_coordinates(transformed[0]), [[x, y]])
+    assert pg.equals(transform(pg.points(23.7, 37.9), 'EPSG:4326', 'EPSG:3857'), transformed[0])
+
+def test_spatial_join_1():
+    """Unit - Test partitioned spatial join against brute force"""
+    import numpy as np
+    import pygeos as pg
+    from geometry_service.api.spatial_join import partition, join_partition, join_rows
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(0, 100, size=(2, 300, 2))
+    sizes = rng.uniform(0, 15, size=(2, 300, 2))
+    left = pg.box(corners[0, :, 0], corners[0, :, 1], corners[0, :, 0] + sizes[0, :, 0], corners[0, :, 1] + sizes[0, :, 1])
+    right = pg.points(corners[1])
+    right[:100] = pg.box(corners[1, :100, 0], corners[1, :100, 1], corners[1, :100, 0] + sizes[1, :100, 0], corners[1, :100, 1] + sizes[1, :100, 1])
+    right[5] = None
+    for predicate, distance in [('intersects', None), ('contains', None), ('dwithin', 3.)]:
+        xsplits, ysplits, tasks = partition(pg.bounds(left), pg.bounds(right), 16, distance=distance)
+        assert len(xsplits) == 3 and len(tasks) > 1
+        pairs = [join_partition((left, right, cell, l, r, xsplits, ysplits, predicate, distance)) for cell, l, r in tasks]
+        found = list(zip(np.concatenate([p[0] for p in pairs]).tolist(), np.concatenate([p[1] for p in pairs]).tolist()))
+        assert len(found) == len(set(found))
+        li, ri = np.meshgrid(np.arange(len(left)), np.arange(len(right)), indexing='ij')
+        li, ri = li.ravel(), ri.ravel()
+        if predicate == 'dwithin':
+            mask = pg.distance(left[li], right[ri]) <= distance
+        else:
+            mask = getattr(pg, predicate)(left[li], right[ri])
+        assert set(found) == set(zip(li[mask].tolist(), ri[mask].tolist()))
+    left_rows, right_rows = join_rows(np.array([0, 2, 2]), np.array([1, 0, 3]), 4, 5, how='left')
+    assert left_rows.tolist() == [0, 1, 2, 2, 3] and right_rows.tolist() == [1, -1, 0, 3, -1]
+    left_rows, right_rows = join_rows(np.array([0, 2, 2]), np.array([1, 0, 3]), 4, 5, how='right')
+    assert right_rows.tolist() == [0, 1, 2, 3, 4] and left_rows.tolist() == [2, 0, -1, 2, -1]
+
+def test_spatial_join_2():
+    """Unit - Test joining spilled buckets"""
+    import numpy as np
+    import pygeos as pg
+    from tempfile import mkdtemp
+    from geometry_service.api.spatial_join import grid, assign, join_bucket, _append_bucket, _bucket
+    directory = mkdtemp()
+    rng = np.random.default_rng(1)
+    left = pg.buffer(pg.points(rng.uniform(0, 100, size=(200, 2))), 4)
+    right = pg.points(rng.uniform(0, 100, size=(500, 2)))
+    xsplits, ysplits = grid(np.concatenate([pg.bounds(left), pg.bounds(right)]), 9)
+    cells = set()
+    for side, geometries in [('left', left), ('right', right)]:
+        # Two chunks per side, appended to the same buckets.
+        for start in [0, len(geometries) // 2]:
+            chunk = geometries[start:start + len(geometries) // 2]
+            items, cells_ = assign(pg.bounds(chunk), xsplits, ysplits)
+            for cell in np.unique(cells_).tolist():
+                positions = items[cells_ == cell]
+                _append_bucket(_bucket(directory, side, cell), positions + start, pg.to_wkb(chunk[positions]))
+                cells.add(cell)
+    found = []
+    for cell in sorted(cells):
+        if not all(os.path.exists(_bucket(directory, side, cell) + '.rows') for side in ['left', 'right']):
+            continue
+        file, count = join_bucket((directory, cell, xsplits, ysplits, 'contains', None))
+        pairs = np.load(file)
+        assert len(pairs) == count and not os.path.exists(_bucket(directory, 'left', cell) + '.wkb')
+        found += [tuple(pair) for pair in pairs.tolist()]
+    li, ri = pg.STRtree(right).query_bulk(left, predicate='contains')
+    assert sorted(found) == sorted(zip(li.tolist(), ri.tolist()))
+    rmtree(directory)
+
+def test_spatial_join_3():
+    """Unit - Test aggregates of an aggregate join"""
+    import numpy as np
+    import vaex
+    from geometry_service.api.spatial_join import Aggregator, aggregate_rows, aggregate_values, read_aggregates
+    assert read_aggregates('population:sum, price:mean,population:sum') == [('population', 'sum'), ('price', 'mean')]
+    assert read_aggregates('') == []
+    for invalid in ['population', 'population:median', ':sum']:
+        try:
+            read_aggregates(invalid)
+            assert False
+        except ValueError:
+            pass
+    aggregates = [('a', 'sum'), ('a', 'mean'), ('a', 'min'), ('a', 'max')]
+    aggregator = Aggregator(4, aggregates)
+    # Two batches of pairs, as given by the partitions of an out-of-core join.
+    aggregator.update(np.array([2, 0, 2]), {'a': np.array([5., 1., np.nan])})
+    aggregator.update(np.array([2, 0]), {'a': np.array([-1., 3.])})
+    aggregator.update(np.array([], dtype=np.int64), {'a': np.array([])})
+    result = aggregator.result(np.arange(4))
+    assert result['count'].tolist() == [2, 0, 3, 0]
+    assert result['a_sum'].tolist() == [4., 0., 4., 0.]
+    assert result['a_mean'][[0, 2]].tolist() == [2., 2.] and np.isnan(result['a_mean'][[1, 3]]).all()
+    assert result['a_min'][[0, 2]].tolist() == [1., -1.] and np.isnan(result['a_min'][1])
+    assert result['a_max'][[0, 2]].tolist() == [3., 5.]
+    assert aggregate_rows(aggregator, how='inner').tolist() == [0, 2]
+    assert aggregate_rows(aggregator, how='left').tolist() == [0, 1, 2, 3]
+    # Missing values of a masked column are ignored.
+    right = vaex.from_arrays(a=np.ma.array([4, 7, 2], mask=[False, True, False]), name=np.array(['x', 'y', 'z']))
+    values = aggregate_values(right, np.array([0, 1, 2, 1]), ['a'])
+    assert values['a'][[0, 2]].tolist() == [4., 2.] and np.isnan(values['a'][[1, 3]]).all()
+    aggregator = Aggregator(1, aggregates)
+    aggregator.update(np.zeros(4, dtype=np.int64), values)
+    result = aggregator.result(np.arange(1))
+    assert result['count'].tolist() == [4]
+    assert [result['a_' + function][0] for function in ['sum', 'mean', 'min', 'max']] == [6., 3., 2., 4.]
+    try:
+        aggregate_values(right, np.array([0]), ['name'])
+        assert False
+    except ValueError:
+        pass
+
+def test_spatial_join_4():
+    """Unit - Test batched nearest neighbour join against brute force"""
+    import numpy as np
+    import pygeos as pg
+    from geometry_service.api.spatial_join import nearest_pairs, join_rows
+    rng = np.random.default_rng(2)
+    left = pg.points(rng.uniform(0, 100, size=(300, 2)))
+    left[7] = None
+    right = pg.points(rng.uniform(0, 100, size=(400, 2)))
+    right[:50] = pg.buffer(right[:50], 2)
+    # Right features clustered in a corner of their extent, far from the left features in the center.
+    clustered = pg.points(np.vstack([[[0., 0.]], rng.uniform(90, 100, size=(60, 2))]))
+    center = pg.points(rng.uniform(40, 60, size=(30, 2)))
+    for left_, right_, cases in [(left, right, [(1, None), (3, None), (4, 5.)]), (center, clustered, [(1, None), (3, None), (2, 60.)])]:
+        distances = pg.distance(left_[:, np.newaxis], right_[np.newaxis, :])
+        for k, max_distance in cases:
+            left_rows, right_rows, found = nearest_pairs(left_, right_, len(left_), k=k, max_distance=max_distance, batch_size=64)
+            for row in range(len(left_)):
+                expected = np.sort(distances[row])[:k] if left_[row] is not None else np.array([])
+                if max_distance is not None:
+                    expected = expected[expected <= max_distance]
+                mask = left_rows == row
+                assert np.allclose(found[mask], expected)
+                assert np.allclose(distances[row, right_rows[mask]], found[mask])
+    left_rows, right_rows, found = nearest_pairs(left, right, len(left), k=4, max_distance=5., batch_size=64)
+    rows = join_rows(left_rows, right_rows, len(left), len(right), how='left', distances=found)
+    assert len(rows) == 3 and (rows[1] == -1).sum() == (np.isnan(rows[2])).sum() > 0
+
+def test_spatial_join_5():
+    """Unit - Test missing attributes of joined features"""
+    import numpy as np
+    import vaex
+    from geometry_service.api.geometries import join_frames
+    left = vaex.from_arrays(id=np.arange(3))
+    right = vaex.from_arrays(value=np.ma.array([1., 2., 3.], mask=[False, True, False]), name=np.array(['a', 'b', 'c'], dtype=object))
+    for how, left_rows, right_rows, masked, names in [
+        ('inner', [0, 1], [1, 0], [True, False], ['b', 'a']),
+        ('left', [0, 1, 2], [1, 0, -1], [True, False, True], ['b', 'a', None])
+    ]:
+        result = join_frames(left, right, np.array(left_rows), np.array(right_rows), how=how, rprefix='r_')
+        values = np.ma.asarray(result.evaluate('r_value'))
+        assert np.ma.getmaskarray(values).tolist() == masked
+        assert values[~np.ma.getmaskarray(values)].tolist() == [1.]
+        assert np.ma.filled(np.ma.asarray(result.evaluate('r_name')).astype(object), None).tolist() == names
+
+def test_layers_1():
+    """Unit - Test joins against a pinned layer"""
+    import numpy as np
+    import pygeos as pg
+    from geometry_service.api import layers
+    from geometry_service.api.spatial_join import join_pairs
+    os.environ['PINNED_LAYERS'] = 'admin=3ba6a8b5ecea27db3c5f4e0159c63283, landuse = landuse/landuse.zip,invalid'
+    try:
+        assert layers.pinned_layers() == {'admin': '3ba6a8b5ecea27db3c5f4e0159c63283', 'landuse': 'landuse/landuse.zip'}
+    finally:
+        del os.environ['PINNED_LAYERS']
+    rng = np.random.default_rng(3)
+    # A resident layer, as loaded from a converted file.
+    layer = layers.Layer.from_geometries('test', pg.buffer(pg.points(rng.uniform(0, 100, size=(50, 2))), 10))
+    layer.arrow_file = 'test.arrow'
+    layers._layers['test'] = layer
+    left = pg.points(rng.uniform(0, 100, size=(500, 2)))
+    left[3] = None
+    for predicate, distance in [('within', None), ('intersects', None), ('dwithin', 2.)]:
+        left_rows, right_rows = join_pairs(left, layers.Pinned('test', 'test.arrow'), pg.bounds(left), None, predicate, distance=distance)
+        tree = pg.STRtree(layer.geometries)
+        if predicate == 'dwithin':
+            li, ri = np.nonzero(pg.distance(left[:, np.newaxis], layer.geometries[np.newaxis, :]) <= distance)
+        else:
+            li, ri = tree.query_bulk(left, predicate=predicate)
+        assert sorted(zip(left_rows.tolist(), right_rows.tolist())) == sorted(zip(li.tolist(), ri.tolist()))
+    del layers._layers['test']
+
+
+def test_planner_1():
+    """Unit - Test the join planner"""
+    import numpy as np
+    import pygeos as pg
+    from geometry_service.api.planner import plan_join, prefilter
+    from geometry_service.api.spatial_join import SWAPPED_PREDICATES, join_pairs
+    points = {'rows': 1000000, 'vertices': 1., 'extent': [0., 0., 100., 100.]}
+    polygons = {'rows': 200000, 'vertices': 40., 'extent': [0., 0., 100., 100.]}
+    small = {'rows': 100, 'vertices': 40., 'extent': [10., 10., 20., 20.]}
+    plan = plan_join(points, polygons, 'within', budget=2**30)
+    assert plan['strategy'] == 'partition' and plan['swapped'] and plan['build'] == 'left' and plan['prefilter'] is None
+    plan = plan_join(polygons, points, 'contains', budget=2**30)
+    assert plan['strategy'] == 'partition' and not plan['swapped']
+    plan = plan_join(small, points, 'contains', budget=2**30)
+    assert plan['strategy'] == 'broadcast' and plan['swapped'] and plan['prefilter'] == {'bounds': [10., 10., 20., 20.], 'sides': ['right']}
+    assert plan_join(points, polygons, 'intersects', estimate=2**31, budget=2**30)['strategy'] == 'out_of_core'
+    assert plan_join(points, polygons, 'intersects', same_crs=False)['strategy'] == 'legacy'
+    assert plan_join(points, small, 'nearest')['strategy'] == 'nearest'
+    assert plan_join(small, {**points, 'extent': [50., 50., 60., 60.]}, 'intersects')['prefilter'] == {'bounds': None, 'sides': ['left', 'right']}
+    # Extents in different CRSs are not compared.
+    plan = plan_join(small, {**points, 'extent': [3e6, 4e6, 3.1e6, 4.1e6]}, 'intersects', same_crs=False, aggregate=True)
+    assert plan['strategy'] == 'partition' and plan['prefilter'] is None
+    json.dumps(plan)
+
+    # A swapped, prefiltered join finds the same pairs.
+    rng = np.random.default_rng(4)
+    left = pg.buffer(pg.points(rng.uniform(10, 20, size=(50, 2))), 2)
+    right = pg.points(rng.uniform(0, 100, size=(2000, 2)))
+    left_bounds, right_bounds = pg.bounds(left), pg.bounds(right)
+    expected = pg.STRtree(right).query_bulk(left, predicate='contains')
+    plan = plan_join({'rows': 50, 'vertices': 65., 'extent': pg.total_bounds(left).tolist()}, {'rows': 2000, 'vertices': 1., 'extent': pg.total_bounds(right).tolist()}, 'contains')
+    assert plan['strategy'] == 'broadcast' and plan['swapped']
+    right_bounds = prefilter(right_bounds, plan, 'right')
+    assert np.isnan(right_bounds).any(axis=1).sum() > 1000
+    right_rows, left_rows = join_pairs(right, left, right_bounds, left_bounds, SWAPPED_PREDICATES['contains'], broadcast=True)
+    assert sorted(zip(left_rows.tolist(), right_rows.tolist())) == sorted(zip(expected[0].tolist(), expected[1].tolist()))
+
+
+def test_chunked_1():
+    """Unit - Test chunked constructive operations"""
+    from concurrent.futures import ThreadPoolExecutor
+    from geometry_service.api.geovaex import GeoVaex
+    from geometry_service.api.geometries import to_pygeos
+    from geometry_service.api.chunked import apply, apply_steps, bounded_map
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert bounded_map(executor, lambda value: value * 2, list(range(10)), 2) == [value * 2 for value in range(10)]
+    path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.join(path, 'test_data', 'geo.tar.gz')
+    working_path = os.path.join(os.environ['WORKING_DIR'], 'session', 'chunked')
+    os.makedirs(working_path, exist_ok=True)
+    gvx = GeoVaex(path, working_path)
+    steps = [('simplify', (0.001,), {})]
+    expected = to_pygeos(apply_steps(gvx.gdf, steps))
+    os.environ['PARALLEL_MIN_ROWS'] = '0'
+    try:
+        for executor in ['thread', 'process']:
+            os.environ['CONSTRUCTIVE_EXECUTOR'] = executor
+            gdf = apply(gvx.gdf, gvx.arrow_file, steps, os.path.join(working_path, executor), workers=2, chunk_size=1)
+            assert len(gdf) == len(gvx.gdf)
+            assert (to_pygeos(gdf) == expected).all()
+    finally:
+        del os.environ['PARALLEL_MIN_ROWS']
+        del os.environ['CONSTRUCTIVE_EXECUTOR']
+    rmtree(working_path)
+
+
+def test_chunked_2():
+    """Unit - Test reading the steps of a constructive pipeline"""
+    from geometry_service.api.chunked import read_steps
+    steps = read_steps('[{"action": "simplify", "tolerance": 10}, {"action": "centroid"}, {"action": "buffer", "distance": 2.5}, {"action": "reproject", "crs": "EPSG:4326"}]')
+    assert steps == [
+        ('simplify', (), {'tolerance': 10, 'preserve_topology': False}),
+        ('centroid', (), {}),
+        ('buffer', (), {'distance': 2.5, 'resolution': 16}),
+        ('reproject', (), {'crs': 'EPSG:4326'})
+    ]
+    for text in ['', '{}', '[]', '[{"action": "union"}]', '[{"action": "simplify"}]', '[{"action": "simplify", "tolerance": true}]',
+            '[{"action": "centroid", "tolerance": 1}]', '[{"action": "buffer", "distance": 1, "resolution": 0}]', '[{"action": "reproject", "crs": "EPSG:0"}]']:
+        try:
+            read_steps(text)
+        except ValueError:
+            continue
+        assert False, text
+
+
+def test_chunked_3():
+    """Unit - Test multi-resolution simplification"""
+    import numpy as np
+    from geometry_service.api.geovaex import GeoVaex
+    from geometry_service.api.geometries import to_pygeos
+    from geometry_service.api.chunked import read_tolerances, simplify_levels, apply_levels
+    assert read_tolerances('2.5') == [2.5]
+    assert read_tolerances('10, 1,5,1') == [1., 5., 10.]
+    assert read_tolerances('[10, 1]') == [1., 10.]
+    for text in ['', 'a', '1,-1', '[true]', '[[1]]', ','.join(['1'] * 17 + ['2'])]:
+        try:
+            read_tolerances(text)
+        except ValueError:
+            continue
+        assert False, text
+    path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.join(path, 'test_data', 'geo.tar.gz')
+    working_path = os.path.join(os.environ['WORKING_DIR'], 'session', 'levels')
+    os.makedirs(working_path, exist_ok=True)
+    gvx = GeoVaex(path, working_path)
+    tolerances = [0.001, 0.01, 0.1]
+    expected = simplify_levels(gvx.gdf, tolerances, level_column=True)
+    assert [np.unique(gdf['level'].values).tolist() for gdf in expected] == [[tolerance] for tolerance in tolerances]
+    # Each level is the same as a single simplification at its tolerance.
+    for gdf, tolerance in zip(expected, tolerances):
+        assert (to_pygeos(gdf) == to_pygeos(gvx.gdf.constructive.simplify(tolerance, preserve_topology=False))).all()
+    os.environ['PARALLEL_MIN_ROWS'] = '0'
+    try:
+        levels = apply_levels(gvx.gdf, gvx.arrow_file, tolerances, os.path.join(working_path, 'parts'), level_column=True, workers=2, chunk_size=1)
+    finally:
+        del os.environ['PARALLEL_MIN_ROWS']
+    assert len(levels) == len(tolerances)
+    for gdf, other in zip(levels, expected):
+        assert (to_pygeos(gdf) == to_pygeos(other)).all()
+        assert gdf['level'].values.tolist() == other['level'].values.tolist()
+    # Close tolerances are exported to distinct files.
+    import tarfile
+    gvx = GeoVaex(path, working_path, output_format='geoparquet')
+    with tarfile.open(gvx.simplify_levels([0.001, 0.0010000001])) as tar:
+        assert len(tar.getnames()) == 2
+    rmtree(working_path)
+
+
+def test_geometries_1():
+    """Unit - Test the output formats"""
+    import geovaex
+    import pyarrow.parquet as pq
+    from geometry_service.api.geovaex import GeoVaex
+    from geometry_service.api.geometries import export, to_pygeos
+    path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.join(path, 'test_data', 'geo.tar.gz')
+    working_path = os.path.join(os.environ['WORKING_DIR'], 'session', 'formats')
+    os.makedirs(working_path, exist_ok=True)
+    gvx = GeoVaex(path, working_path)
+    parquet = os.path.join(working_path, 'geo.parquet')
+    export(gvx.gdf, parquet, output_format='geoparquet', chunk_size=2)
+    table = pq.read_table(parquet)
+    assert table.num_rows == len(gvx.gdf)
+    assert pq.ParquetFile(parquet).num_row_groups == 2
+    assert table.column_names == [column for column in gvx.gdf.get_column_names() if column != 'geometry'] + ['geometry']
+    geo = json.loads(table.schema.metadata[b'geo'])
+    assert geo['primary_column'] == 'geometry' and geo['columns']['geometry']['encoding'] == 'WKB'
+    assert geo['columns']['geometry']['crs']['id']['code'] == 4326
+    assert table.column('geometry').to_pylist() == list(gvx.gdf.geometry.to_numpy())
+    arrow = os.path.join(working_path, 'geo_export.arrow')
+    export(gvx.gdf, arrow, output_format='arrow')
+    gdf = geovaex.open(arrow)
+    assert (to_pygeos(gdf) == to_pygeos(gvx.gdf)).all()
+    try:
+        export(gvx.gdf, os.path.join(working_path, 'geo.xlsx'), output_format='xlsx')
+    except ValueError:
+        pass
+    else:
+        assert False
     rmtree(working_path)
@@ -0,0 +1,82 @@
+"""A local stub of the Valhalla routing service, for tests."""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        server.requests += 1
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}')
+        if server.failures > 0:
+            server.failures -= 1
+            self._respond(503, {'error': 'Service unavailable'})
+            return
+        if self.path != '/isochrone':
+            self._respond(404, {'error': 'Not found'})
+            return
+        try:
+            location = body['locations'][0]
+            lat, lon = float(location['lat']), float(location['lon'])
+        except (KeyError, IndexError, TypeError, ValueError):
+            self._respond(400, {'error': 'Insufficiently specified required parameter \'locations\''})
+            return
+        # One square feature per contour, in descending order of contour as the router does.
+        contours = sorted((list(contour.values())[0] for contour in body.get('contours', [{'time': 1}])), reverse=True)
+        features = []
+        for contour in contours:
+            d = server.size * contour
+            ring = [[lon - d, lat - d], [lon + d, lat - d], [lon + d, lat + d], [lon - d, lat + d], [lon - d, lat - d]]
+            features.append({'type': 'Feature', 'properties': {'contour': contour}, 'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+        self._respond(200, {'type': 'FeatureCollection', 'features': features})
+
+    def _respond(self, status, data):
+        content = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class StubRouter:
+    """Serves square isochrones around the requested location, with half side *size* times the contour, on a local port.
+
+    Set *failures* to make the next requests fail with status 503.
+    """
+
+    def __init__(self, size=0.01):
+        self._server = HTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.size = size
+        self._server.failures = 0
+        self._server.requests = 0
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{port}'.format(port=self._server.server_address[1])
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    @property
+    def failures(self):
+        return self._server.failures
+
+    @failures.setter
+    def failures(self, value):
+        self._server.failures = value
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()